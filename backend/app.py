@@ -1,19 +1,74 @@
 # Main Flask application
 # This file initializes the Flask app, sets up MongoDB, and registers routes.
+import time
+_startup_began = time.perf_counter()
+
 from flask import Flask
 from flask_cors import CORS
 from routes.auth_routes import auth_bp
 from routes.face_routes import face_bp
 from config import Config
-from flask_pymongo import PyMongo
+from extensions import mongo
+from pymongo import MongoClient
+from repositories.indexes import ensure_indexes
+from services.face_models import face_models_status
+from services.face_worker import face_pool_stats, face_work_ready, start_face_warm_up
+from services.password_hasher import password_hasher_stats
+from services.token_service import token_verifier_stats
+from utils.mail_dispatcher import mail_dispatcher_stats
+from utils.metrics import init_metrics, register_gauge
+from utils.process_info import memory_usage, process_stats, record_startup
+from utils.rate_limit import rate_limit_stats
 import os
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Setup MongoDB
-mongo = PyMongo(app)
+# Setup MongoDB with a single pooled client shared by every request. It
+# connects on first use, so a gunicorn master that preloads the app forks
+# its workers before any connection exists
+mongo.init_app(
+    app,
+    connect=False,
+    maxPoolSize=app.config['MONGO_MAX_POOL_SIZE'],
+    minPoolSize=app.config['MONGO_MIN_POOL_SIZE'],
+    maxIdleTimeMS=app.config['MONGO_MAX_IDLE_TIME_MS'],
+    connectTimeoutMS=app.config['MONGO_CONNECT_TIMEOUT_MS'],
+    socketTimeoutMS=app.config['MONGO_SOCKET_TIMEOUT_MS'],
+    serverSelectionTimeoutMS=app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+    waitQueueTimeoutMS=app.config['MONGO_WAIT_QUEUE_TIMEOUT_MS']
+)
+
+# Create the indexes hot queries rely on; a database that is down at
+# startup costs one server selection timeout, logged by ensure_indexes,
+# and does not stop the app from starting
+if app.config['MONGO_ENSURE_INDEXES']:
+    # On a short-lived client of its own, for the same reason
+    with MongoClient(app.config['MONGO_URI'],
+                     serverSelectionTimeoutMS=app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS']) as client:
+        ensure_indexes(client.get_default_database())
+
+# Stage latency histograms at /metrics and optional Server-Timing headers
+init_metrics(app)
+register_gauge('faceauth_process_resident_bytes', 'Resident memory of this process',
+               lambda: memory_usage().get('rss_bytes'))
+register_gauge('faceauth_process_proportional_bytes', 'Proportional set size, counting shared pages once',
+               lambda: memory_usage().get('pss_bytes'))
+register_gauge('faceauth_face_models_ready', 'Whether the face models are loaded and warmed up where face work runs',
+               lambda: int(face_work_ready(app.config)))
+register_gauge('faceauth_face_in_flight', 'Face extractions admitted and still running',
+               lambda: (rate_limit_stats()['face_admission'] or {}).get('in_flight'))
+register_gauge('faceauth_password_hash_in_flight', 'Password hashes admitted and not yet finished, queued ones included',
+               lambda: (password_hasher_stats() or {}).get('in_flight'))
+register_gauge('faceauth_revoked_tokens', 'Revoked tokens this process knows of that have not expired yet',
+               lambda: (token_verifier_stats() or {}).get('revoked'))
+register_gauge('faceauth_token_cache_hit_rate', 'Share of token checks answered from the claims cache',
+               lambda: ((token_verifier_stats() or {}).get('claims') or {}).get('hit_rate'))
+register_gauge('faceauth_mail_queued', 'Outbound mails waiting for the dispatcher',
+               lambda: (mail_dispatcher_stats() or {}).get('pending'))
+register_gauge('faceauth_mail_waiting_retry', 'Outbound mails waiting to be retried',
+               lambda: (mail_dispatcher_stats() or {}).get('waiting_retry'))
 
 # Enable CORS
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -26,5 +81,35 @@ app.register_blueprint(face_bp, url_prefix='/api/face')
 def index():
     return {'status': 'API is running'}
 
+@app.route('/health')
+def health():
+    # Liveness: answers without touching MongoDB or the face models
+    return {'status': 'ok', **process_stats()}
+
+@app.route('/ready')
+def ready():
+    # Readiness: MongoDB answers and, unless warm-up is off, the face models
+    # are loaded in every face worker process (or in this process when face
+    # work runs inline); the first probe starts the warm-up if nothing else did
+    is_ready = True
+    if app.config['FACE_MODELS_WARM_UP'] and not face_work_ready(app.config):
+        start_face_warm_up(app.config)
+        is_ready = False
+    
+    try:
+        mongo.db.command('ping')
+        mongo_status = 'ok'
+    except Exception as e:
+        mongo_status = str(e)
+        is_ready = False
+    
+    body = {'ready': is_ready, 'mongo': mongo_status, 'face_models': face_models_status(),
+            'face_workers': face_pool_stats()}
+    return body, 200 if is_ready else 503
+
+record_startup(time.perf_counter() - _startup_began)
+
 if __name__ == '__main__':
+    if app.config['FACE_MODELS_WARM_UP']:
+        start_face_warm_up(app.config)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,122 @@
+# Face batching benchmark
+# Compares throughput and tail latency of per-request encoding with
+# cross-request batched encoding at several concurrency levels.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_face_batching --images path/to/faces
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+from config import Config
+from services.face_batcher import FaceBatcher
+from services.face_pipeline import encode_face_chips, prepare_face
+from services.face_service import run_face_job
+from services.face_worker import FaceWorkerPool
+
+def load_images(directory):
+    images = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if path.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(path, 'rb') as f:
+                images.append(f.read())
+    return images
+
+def run_load(images, concurrency, requests, handle):
+    """
+    Send `requests` images through `handle` from `concurrency` threads
+    """
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            start = time.perf_counter()
+            handle(images[n % len(images)])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000.0
+    return requests / wall, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched face encoding')
+    parser.add_argument('--images', required=True, help='Directory of single-face JPEG/PNG images')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--processes', type=int, default=Config.FACE_WORKER_PROCESSES,
+                        help='Face worker processes (0 runs inline)')
+    parser.add_argument('--batch-size', type=int, default=Config.FACE_BATCH_MAX_SIZE)
+    parser.add_argument('--window-ms', type=float, default=Config.FACE_BATCH_WINDOW_MS)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    settings = {
+        'max_side': Config.FACE_DETECTION_MAX_SIDE,
+        'upsample': Config.FACE_DETECTION_UPSAMPLE,
+        'model': Config.FACE_DETECTION_MODEL
+    }
+    pool = None
+    if args.processes:
+        pool = FaceWorkerPool(args.processes, queue_size=max(args.concurrency) * 2, timeout=60)
+
+    batcher = FaceBatcher(
+        lambda face_chips: run_face_job(pool, encode_face_chips, face_chips),
+        max_batch_size=args.batch_size,
+        max_wait=args.window_ms / 1000.0,
+        max_pending=max(args.concurrency) * 2,
+        concurrency=args.processes or 1
+    )
+
+    def unbatched(image):
+        result = run_face_job(pool, prepare_face, image, settings)
+        if result['success']:
+            run_face_job(pool, encode_face_chips, [result['face_chip']])
+
+    def batched(image):
+        result = run_face_job(pool, prepare_face, image, settings)
+        if result['success']:
+            batcher.submit(result['face_chip']).result()
+
+    report = []
+    for concurrency in args.concurrency:
+        for mode, handle in (('off', unbatched), ('on', batched)):
+            throughput, p50, p99 = run_load(images, concurrency, args.requests, handle)
+            report.append({
+                'concurrency': concurrency,
+                'batching': mode,
+                'requests_per_s': throughput,
+                'p50_ms': p50,
+                'p99_ms': p99
+            })
+            print(f'concurrency {concurrency:>3} batching {mode:<3} {throughput:8.1f} req/s '
+                  f'p50 {p50:8.1f}ms p99 {p99:8.1f}ms')
+
+    print('batcher', batcher.stats())
+    if pool:
+        pool.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
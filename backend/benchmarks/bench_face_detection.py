@@ -0,0 +1,111 @@
+# Face detection benchmark
+# Compares full-resolution detection with detection on a downscaled frame,
+# and reports how far the resulting encodings drift from the baseline.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_face_detection --images path/to/faces
+import argparse
+import glob
+import json
+import os
+import time
+import cv2
+import face_recognition
+import numpy as np
+from config import Config
+from services.face_pipeline import decode_image, detect_faces
+
+def load_frames(directory, frame_widths):
+    """
+    Load every image in the directory and resize it to each sample frame width
+    """
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if not path.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        with open(path, 'rb') as f:
+            image = decode_image(f.read())
+
+        height, width = image.shape[:2]
+        for frame_width in frame_widths:
+            size = (frame_width, round(height * frame_width / width))
+            frames.append((os.path.basename(path), frame_width, np.ascontiguousarray(cv2.resize(image, size))))
+    return frames
+
+def run(image, max_side, upsample, model):
+    start = time.perf_counter()
+    locations = detect_faces(image, max_side=max_side, upsample=upsample, model=model)
+    detected = time.perf_counter()
+    encodings = face_recognition.face_encodings(image, locations[:1])
+    encoded = time.perf_counter()
+    encoding = encodings[0] if encodings else None
+    return encoding, (detected - start) * 1000.0, (encoded - detected) * 1000.0
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark downscaled face detection')
+    parser.add_argument('--images', required=True, help='Directory of single-face JPEG/PNG images')
+    parser.add_argument('--frame-widths', type=int, nargs='+', default=[640, 1280, 1920])
+    parser.add_argument('--max-sides', type=int, nargs='+', default=[320, 480, 640, 800])
+    parser.add_argument('--upsample', type=int, default=Config.FACE_DETECTION_UPSAMPLE)
+    parser.add_argument('--model', default=Config.FACE_DETECTION_MODEL)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    frames = load_frames(args.images, args.frame_widths)
+    report = []
+
+    for frame_width in args.frame_widths:
+        samples = [image for _, width, image in frames if width == frame_width]
+        if not samples:
+            continue
+
+        baseline = [run(image, 0, args.upsample, args.model) for image in samples]
+        baseline_ms = np.array([detect + encode for _, detect, encode in baseline])
+        report.append({
+            'frame_width': frame_width,
+            'max_side': 0,
+            'mean_ms': float(baseline_ms.mean()),
+            'p50_ms': float(np.percentile(baseline_ms, 50)),
+            'speedup': 1.0,
+            'missed': sum(1 for encoding, _, _ in baseline if encoding is None),
+            'mean_distance': 0.0,
+            'max_distance': 0.0
+        })
+
+        for max_side in args.max_sides:
+            if max_side >= frame_width:
+                continue
+
+            results = [run(image, max_side, args.upsample, args.model) for image in samples]
+            latency_ms = np.array([detect + encode for _, detect, encode in results])
+            distances = [
+                float(np.linalg.norm(encoding - reference))
+                for (encoding, _, _), (reference, _, _) in zip(results, baseline)
+                if encoding is not None and reference is not None
+            ]
+            report.append({
+                'frame_width': frame_width,
+                'max_side': max_side,
+                'mean_ms': float(latency_ms.mean()),
+                'p50_ms': float(np.percentile(latency_ms, 50)),
+                'speedup': float(baseline_ms.mean() / latency_ms.mean()),
+                'missed': sum(1 for encoding, _, _ in results if encoding is None),
+                'mean_distance': float(np.mean(distances)) if distances else None,
+                'max_distance': float(np.max(distances)) if distances else None
+            })
+
+    for row in report:
+        max_side = row['max_side'] or 'full'
+        distance = 'n/a' if row['mean_distance'] is None else f"{row['mean_distance']:.4f}/{row['max_distance']:.4f}"
+        print(
+            f"width {row['frame_width']:>5} detect@{max_side!s:<5} mean {row['mean_ms']:8.1f}ms "
+            f"p50 {row['p50_ms']:8.1f}ms x{row['speedup']:.2f} missed {row['missed']} "
+            f"distance mean/max {distance}"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
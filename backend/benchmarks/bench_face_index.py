@@ -0,0 +1,127 @@
+# Face index benchmark
+# Compares exact and IVF search on synthetic galleries.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_face_index --sizes 10000 100000 1000000
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+from config import Config
+from repositories.encoding_format import ENCODING_SIZE
+from services.face_index import FaceIndex
+from services.ann_index import IVFFaceIndex
+
+def make_gallery(size, rng, clusters=256):
+    """
+    Synthetic encodings with some cluster structure, scaled so that
+    different identities sit roughly 0.8-1.0 apart like dlib encodings
+    """
+    centers = rng.normal(0.0, 0.06, (clusters, ENCODING_SIZE)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    vectors = centers[labels] + rng.normal(0.0, 0.06, (size, ENCODING_SIZE)).astype(np.float32)
+    return vectors.astype(np.float32)
+
+def make_probes(gallery, count, rng, genuine_ratio=0.8):
+    """
+    Genuine probes are noisy copies of enrolled vectors; the rest are strangers
+    """
+    genuine = int(count * genuine_ratio)
+    rows = rng.integers(0, len(gallery), genuine)
+    probes = gallery[rows] + rng.normal(0.0, 0.025, (genuine, ENCODING_SIZE)).astype(np.float32)
+    strangers = make_gallery(count - genuine, rng)
+    return np.concatenate([probes, strangers]).astype(np.float32)
+
+def build_index(index, ids, vectors):
+    tracemalloc.start()
+    start = time.perf_counter()
+    index.build(ids, vectors)
+    build_time = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return build_time, memory
+
+def run_queries(index, probes, **kwargs):
+    results = []
+    latencies = []
+    for probe in probes:
+        start = time.perf_counter()
+        results.append(index.search(probe, k=1, **kwargs))
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000.0
+
+def recall_at_1(exact_results, results, tolerance):
+    """
+    Share of probes with an exact match within tolerance that the index also returns
+    """
+    expected = 0
+    found = 0
+    for exact, approx in zip(exact_results, results):
+        if not exact or exact[0][1] > tolerance:
+            continue
+        expected += 1
+        if approx and approx[0][0] == exact[0][0]:
+            found += 1
+    return found / expected if expected else 1.0
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark exact and IVF face search')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--nlist', type=int, default=Config.FACE_INDEX_NLIST)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--tolerance', type=float, default=Config.FACE_RECOGNITION_TOLERANCE)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    report = []
+
+    for size in args.sizes:
+        gallery = make_gallery(size, rng)
+        ids = [str(i) for i in range(size)]
+        probes = make_probes(gallery, args.queries, rng)
+
+        exact = FaceIndex()
+        build_time, memory = build_index(exact, ids, gallery)
+        exact_results, latencies = run_queries(exact, probes)
+        rows = [{
+            'size': size,
+            'backend': 'exact',
+            'build_s': build_time,
+            'memory_mb': memory / 2 ** 20,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'recall_at_1': 1.0
+        }]
+
+        ivf = IVFFaceIndex(nlist=args.nlist, seed=args.seed)
+        build_time, memory = build_index(ivf, ids, gallery)
+        for nprobe in args.nprobe:
+            results, latencies = run_queries(ivf, probes, nprobe=nprobe)
+            rows.append({
+                'size': size,
+                'backend': f'ivf nprobe={nprobe}',
+                'build_s': build_time,
+                'memory_mb': memory / 2 ** 20,
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'recall_at_1': recall_at_1(exact_results, results, args.tolerance)
+            })
+
+        for row in rows:
+            print(
+                f"{row['size']:>9} {row['backend']:<16} build {row['build_s']:8.2f}s "
+                f"mem {row['memory_mb']:8.1f}MB p50 {row['p50_ms']:8.3f}ms "
+                f"p99 {row['p99_ms']:8.3f}ms recall@1 {row['recall_at_1']:.4f}"
+            )
+        report.extend(rows)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# Face profile benchmark
+# For every profile in Config.FACE_PROFILES, measures extraction latency and
+# how well genuine and impostor distances separate on a local test set.
+# Each person's first image is enrolled with the enrollment profile (the
+# profile itself unless --enrollment-profile is given); every other image
+# is a probe, compared with its own person (genuine) and with everyone
+# else (impostor).
+#
+# The test set is one directory per person:
+#   faces/alice/1.jpg, faces/alice/2.jpg, faces/bob/1.jpg, ...
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_face_profiles --images path/to/faces
+#   python -m benchmarks.bench_face_profiles --images path/to/faces --enrollment-profile accurate
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+from config import Config
+from services.face_pipeline import extract_encoding
+from services.face_service import face_settings
+
+def load_people(directory):
+    """
+    Return {person: [image bytes]} for people with at least two images
+    """
+    people = {}
+    for person in sorted(os.listdir(directory)):
+        paths = sorted(path for path in glob.glob(os.path.join(directory, person, '*'))
+                       if path.lower().endswith(('.jpg', '.jpeg', '.png')))
+        if len(paths) >= 2:
+            images = []
+            for path in paths:
+                with open(path, 'rb') as f:
+                    images.append(f.read())
+            people[person] = images
+    return people
+
+def profile_settings(name, purpose):
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    config['FACE_ENROLLMENT_PROFILE' if purpose == 'enrollment' else 'FACE_VERIFICATION_PROFILE'] = name
+    return face_settings(config, purpose)
+
+def extract_all(people, settings, first_only=False, skip_first=False):
+    """
+    Extract every image; returns {person: [encoding or None]} and the
+    per-image latencies in milliseconds
+    """
+    encodings = {}
+    latencies = []
+    for person, images in people.items():
+        if first_only:
+            images = images[:1]
+        elif skip_first:
+            images = images[1:]
+        encodings[person] = []
+        for image in images:
+            start = time.perf_counter()
+            result = extract_encoding(image, settings)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            encodings[person].append(result['face_encoding'] if result['success'] else None)
+    return encodings, latencies
+
+def separation(enrolled, probes, tolerance):
+    """
+    Distance statistics for genuine and impostor comparisons
+    """
+    people = [person for person in enrolled if enrolled[person][0] is not None]
+    gallery = np.array([enrolled[person][0] for person in people], dtype=np.float32)
+
+    genuine = []
+    impostor = []
+    for person, encodings in probes.items():
+        for encoding in encodings:
+            if encoding is None:
+                continue
+            distances = np.linalg.norm(gallery - np.asarray(encoding, dtype=np.float32), axis=1)
+            for other, distance in zip(people, distances):
+                (genuine if other == person else impostor).append(float(distance))
+
+    genuine = np.array(genuine)
+    impostor = np.array(impostor)
+    if not len(genuine) or not len(impostor):
+        return None
+
+    # d' (decidability): how many pooled standard deviations apart the two distributions are
+    pooled_std = np.sqrt((genuine.var() + impostor.var()) / 2.0)
+    return {
+        'genuine_mean': float(genuine.mean()),
+        'genuine_std': float(genuine.std()),
+        'impostor_mean': float(impostor.mean()),
+        'impostor_std': float(impostor.std()),
+        'd_prime': float((impostor.mean() - genuine.mean()) / pooled_std) if pooled_std else float('inf'),
+        'false_reject_rate': float((genuine > tolerance).mean()),
+        'false_accept_rate': float((impostor <= tolerance).mean()),
+        'genuine_pairs': len(genuine),
+        'impostor_pairs': len(impostor)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare face profiles for latency and accuracy')
+    parser.add_argument('--images', required=True, help='Directory with one subdirectory of images per person')
+    parser.add_argument('--profiles', nargs='+', default=list(Config.FACE_PROFILES))
+    parser.add_argument('--enrollment-profile', help='Enroll with this profile instead of the one being measured')
+    parser.add_argument('--tolerance', type=float, default=Config.FACE_RECOGNITION_TOLERANCE)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    people = load_people(args.images)
+    if len(people) < 2:
+        parser.error('The test set needs at least two people with two or more images each')
+
+    # Load and warm the models so the first profile is not charged for it
+    extract_encoding(next(iter(people.values()))[0], profile_settings('balanced', 'verification'))
+
+    report = {}
+    for name in args.profiles:
+        enrollment = args.enrollment_profile or name
+        enrolled, enroll_latencies = extract_all(people, profile_settings(enrollment, 'enrollment'), first_only=True)
+        probes, probe_latencies = extract_all(people, profile_settings(name, 'verification'), skip_first=True)
+
+        failed = sum(encoding is None for encodings in list(enrolled.values()) + list(probes.values())
+                     for encoding in encodings)
+        row = {
+            'enrollment_profile': enrollment,
+            'enroll_p50_ms': float(np.percentile(enroll_latencies, 50)),
+            'verify_p50_ms': float(np.percentile(probe_latencies, 50)),
+            'verify_p95_ms': float(np.percentile(probe_latencies, 95)),
+            'failed_images': failed,
+            'separation': separation(enrolled, probes, args.tolerance)
+        }
+        report[name] = row
+
+        stats = row['separation']
+        line = (f"{name:<10} enroll({enrollment}) p50 {row['enroll_p50_ms']:7.1f}ms  "
+                f"verify p50 {row['verify_p50_ms']:7.1f}ms p95 {row['verify_p95_ms']:7.1f}ms  "
+                f"failed {failed}")
+        if stats:
+            line += (f"  genuine {stats['genuine_mean']:.3f}±{stats['genuine_std']:.3f}"
+                     f"  impostor {stats['impostor_mean']:.3f}±{stats['impostor_std']:.3f}"
+                     f"  d' {stats['d_prime']:.2f}  FRR {stats['false_reject_rate']:.2%}"
+                     f"  FAR {stats['false_accept_rate']:.3%} @ {args.tolerance}")
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# Outbound mail benchmark
+# Compares sending each message inline over a fresh SMTP session with
+# queueing it on the mail dispatcher, against a local aiosmtpd server
+# (pip install aiosmtpd) or a relay given with --host/--port.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_mail_dispatcher --messages 200
+import argparse
+import json
+import smtplib
+import socket
+import time
+import numpy as np
+from utils.mail_dispatcher import MailDispatcher, build_message
+
+def start_local_server(delay):
+    """
+    Start an in-process SMTP server that accepts and discards mail,
+    waiting `delay` seconds per message like a slow relay
+    """
+    import asyncio
+    from aiosmtpd.controller import Controller
+
+    class Handler:
+        received = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            await asyncio.sleep(delay)
+            Handler.received += 1
+            return '250 OK'
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+    controller.start()
+    return controller, Handler
+
+def summarize(latencies, wall, messages):
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'request_p50_ms': float(np.percentile(latencies, 50)),
+        'request_p99_ms': float(np.percentile(latencies, 99)),
+        'delivered_per_s': messages / wall
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inline vs queued password reset mail')
+    parser.add_argument('--host', help='SMTP server; starts a local aiosmtpd server when omitted')
+    parser.add_argument('--port', type=int, default=25)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--relay-delay-ms', type=float, default=5.0,
+                        help='Per-message delay of the local server')
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    controller = None
+    if args.host:
+        host, port = args.host, args.port
+    else:
+        controller, _ = start_local_server(args.relay_delay_ms / 1000.0)
+        host, port = controller.hostname, controller.port
+
+    messages = [
+        build_message('noreply@example.com', f'user{i}@example.com', 'Password Reset Request',
+                      f'https://example.com/reset-password?token={i}')
+        for i in range(args.messages)
+    ]
+
+    # What forgot-password did before: a new SMTP session inside the request
+    latencies = []
+    start = time.perf_counter()
+    for message in messages:
+        begin = time.perf_counter()
+        with smtplib.SMTP(host, port) as connection:
+            connection.send_message(message)
+        latencies.append(time.perf_counter() - begin)
+    inline = summarize(latencies, time.perf_counter() - start, args.messages)
+
+    # The request only queues; one reused connection delivers in batches
+    dispatcher = MailDispatcher(host, port, batch_size=args.batch_size)
+    latencies = []
+    start = time.perf_counter()
+    for message in messages:
+        begin = time.perf_counter()
+        dispatcher.submit(message)
+        latencies.append(time.perf_counter() - begin)
+    dispatcher.flush()
+    queued = summarize(latencies, time.perf_counter() - start, args.messages)
+    queued.update(dispatcher.stats())
+    dispatcher.close()
+
+    report = {'inline': inline, 'dispatcher': queued}
+    for name, row in report.items():
+        print(f"{name:<10} request p50 {row['request_p50_ms']:8.3f}ms p99 {row['request_p99_ms']:8.3f}ms "
+              f"delivery {row['delivered_per_s']:8.1f} msg/s")
+    print('dispatcher', dispatcher.stats())
+
+    if controller is not None:
+        controller.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Password login benchmark
+# Measures password login throughput and latency for several PBKDF2
+# iteration counts, with verification running on the bounded hasher.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_password_hash --iterations 100000 260000 600000
+import argparse
+import json
+import os
+import threading
+import time
+import mongomock
+import numpy as np
+from config import Config
+from repositories.user_repository import UserRepository
+from services.password_hasher import PasswordHasher, PasswordHasherBusy, hash_method
+
+PASSWORD = 'benchmark-password1'
+
+def run_load(concurrency, requests, login):
+    """
+    Send `requests` logins through `login` from `concurrency` threads
+    """
+    latencies = []
+    rejected = 0
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        nonlocal rejected
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            start = time.perf_counter()
+            try:
+                login(n)
+            except PasswordHasherBusy:
+                with lock:
+                    rejected += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'logins_per_s': len(latencies) / wall,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'rejected': rejected
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark password login per hash cost')
+    parser.add_argument('--method', default=Config.PASSWORD_HASH_METHOD)
+    parser.add_argument('--iterations', type=int, nargs='+', default=[100000, 260000, 600000])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=Config.PASSWORD_HASH_WORKERS or os.cpu_count() or 1)
+    parser.add_argument('--queue-size', type=int, default=Config.PASSWORD_HASH_QUEUE_SIZE)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    report = []
+    for iterations in args.iterations:
+        hasher = PasswordHasher(hash_method(args.method, iterations), args.workers, args.queue_size, timeout=60)
+
+        db = mongomock.MongoClient().faceauth_bench
+        password_hash = hasher.hash(PASSWORD)
+        db.users.insert_many([
+            {'email': f'user{i}@example.com', 'password_hash': password_hash}
+            for i in range(args.users)
+        ])
+        users = UserRepository(db)
+
+        def login(n):
+            # The same reads and checks as AuthService.login_with_password
+            user_data = users.find_credentials(f'user{n % args.users}@example.com')
+            if not hasher.verify(user_data['password_hash'], PASSWORD):
+                raise AssertionError('password did not verify')
+
+        for concurrency in args.concurrency:
+            row = run_load(concurrency, args.requests, login)
+            row.update({'iterations': iterations, 'concurrency': concurrency})
+            report.append(row)
+            p99 = f"{row['p99_ms']:8.1f}ms" if row['p99_ms'] is not None else '       -'
+            print(f"iterations {iterations:>8} concurrency {concurrency:>3} "
+                  f"{row['logins_per_s']:8.1f} logins/s p99 {p99} rejected {row['rejected']}")
+
+        hasher.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
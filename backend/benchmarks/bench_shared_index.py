@@ -0,0 +1,108 @@
+# Shared face index benchmark
+# Starts N worker processes that each open a gallery of synthetic users,
+# either building a private in-memory index (the 'exact' backend) or
+# mapping the host-wide snapshot (the 'shared' backend), runs a few
+# searches and reports per-worker startup time, search latency and the
+# total resident and proportional memory across all workers. The private
+# index is built from an .npz file, which is faster than reading MongoDB,
+# so its startup time is a lower bound.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_shared_index --gallery-size 1000000 --workers 8
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from bson import ObjectId
+from repositories.encoding_format import ENCODING_SIZE
+from services.face_index import FaceIndex
+from services.shared_face_index import SharedFaceIndex, _locked, write_snapshot
+from utils.process_info import memory_usage
+
+def worker(backend, directory, searches, barrier, results):
+    start = time.perf_counter()
+    if backend == 'shared':
+        index = SharedFaceIndex(directory, max_age=0)
+        index.load(None)
+    else:
+        index = FaceIndex()
+        index.load_file(os.path.join(directory, 'gallery.npz'))
+    loaded = time.perf_counter()
+
+    rng = np.random.default_rng(os.getpid())
+    latencies = []
+    for probe in rng.normal(0, 0.1, (searches, ENCODING_SIZE)).astype(np.float32):
+        began = time.perf_counter()
+        index.search(probe, k=1)
+        latencies.append(time.perf_counter() - began)
+
+    # Measure while every worker still holds its index
+    barrier.wait()
+    results.put({
+        'startup_seconds': loaded - start,
+        'search_ms': float(np.median(latencies)) * 1000.0,
+        'memory': memory_usage()
+    })
+    barrier.wait()
+
+def run(backend, directory, workers, searches):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(backend, directory, searches, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    rows = [results.get() for _ in processes]
+    barrier.wait()
+    for process in processes:
+        process.join()
+
+    return {
+        'startup_seconds_max': max(row['startup_seconds'] for row in rows),
+        'search_ms_p50': float(np.median([row['search_ms'] for row in rows])),
+        'total_rss_mb': sum(row['memory'].get('rss_bytes', row['memory'].get('max_rss_bytes', 0)) for row in rows) / 2 ** 20,
+        'total_pss_mb': sum(row['memory'].get('pss_bytes', 0) for row in rows) / 2 ** 20
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare private and shared face index memory and startup')
+    parser.add_argument('--gallery-size', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--searches', type=int, default=20)
+    parser.add_argument('--directory', help='Where to write the gallery; a temporary directory by default')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix='faceauth-bench-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    ids = [str(ObjectId()) for _ in range(args.gallery_size)]
+    vectors = rng.normal(0, 0.1, (args.gallery_size, ENCODING_SIZE)).astype(np.float32)
+    np.savez(os.path.join(directory, 'gallery.npz'), ids=np.array(ids, dtype=str), vectors=vectors)
+    with _locked(directory):
+        write_snapshot(directory, ids, vectors)
+    del ids, vectors
+
+    report = {}
+    try:
+        for backend in ('exact', 'shared'):
+            report[backend] = row = run(backend, directory, args.workers, args.searches)
+            print(f"{backend:<7} {args.workers} workers, {args.gallery_size} users: "
+                  f"startup {row['startup_seconds_max']:6.2f}s  search p50 {row['search_ms_p50']:7.2f}ms  "
+                  f"total RSS {row['total_rss_mb']:8.1f}MB  total PSS {row['total_pss_mb']:8.1f}MB")
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
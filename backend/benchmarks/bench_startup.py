@@ -0,0 +1,70 @@
+# Startup benchmark
+# Measures, each in a fresh interpreter, how long importing the app takes
+# and how much memory it holds, then the same after loading and warming up
+# the face models. The first row is what a password-only worker or a
+# health check pays now that face_recognition is imported lazily.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_startup --runs 5
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+stage = {stage!r}
+if stage != 'import':
+    from services.face_models import load_face_models, warm_up
+    load_face_models()
+    if stage == 'warm_up':
+        warm_up()
+from utils.process_info import memory_usage
+print(json.dumps({{
+    'import_seconds': imported - start,
+    'total_seconds': time.perf_counter() - start,
+    'memory': memory_usage()
+}}))
+'''
+
+STAGES = ('import', 'load_models', 'warm_up')
+
+def run_stage(stage):
+    env = dict(os.environ, MONGO_ENSURE_INDEXES='false')
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(stage=stage)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark app startup time and memory')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    report = {}
+    for stage in args.stages:
+        runs = [run_stage(stage) for _ in range(args.runs)]
+        rss = [run['memory'].get('rss_bytes', run['memory'].get('max_rss_bytes', 0)) for run in runs]
+        report[stage] = {
+            'total_seconds_p50': float(np.median([run['total_seconds'] for run in runs])),
+            'import_seconds_p50': float(np.median([run['import_seconds'] for run in runs])),
+            'rss_mb': float(np.median(rss)) / 2 ** 20
+        }
+        row = report[stage]
+        print(f"{stage:<12} startup {row['total_seconds_p50']:6.2f}s (app import {row['import_seconds_p50']:5.2f}s) "
+              f"rss {row['rss_mb']:7.1f}MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# User index benchmark
+# Measures email and reset token lookup latency over a large users
+# collection with only the _id index, then again after ensure_indexes().
+# Needs a real MongoDB server: mongomock ignores indexes.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_user_indexes --uri mongodb://localhost:27017 --users 1000000
+import argparse
+import datetime
+import json
+import secrets
+import time
+import numpy as np
+from pymongo import MongoClient
+from repositories.indexes import INDEXES, ensure_indexes, explain_hot_queries
+from repositories.password_reset_repository import PasswordResetRepository, token_digest
+from repositories.user_repository import UserRepository
+
+DB_NAME = 'faceauth_index_bench'
+
+def seed(db, users, batch_size, reset_every):
+    """
+    Insert `users` users; every `reset_every`th one has a reset pending,
+    alternately in the legacy user field and in password_resets
+    """
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(hours=24)
+    legacy_tokens, tokens = [], []
+
+    for start in range(0, users, batch_size):
+        docs, pending = [], []
+        for i in range(start, min(start + batch_size, users)):
+            doc = {'email': f'user{i}@example.com', 'password_hash': 'x', 'created_at': now}
+            if i % reset_every == 0:
+                token = secrets.token_urlsafe(32)
+                if (i // reset_every) % 2:
+                    doc.update({'reset_token': token, 'reset_token_exp': expires_at})
+                    legacy_tokens.append(token)
+                else:
+                    pending.append((len(docs), token))
+            docs.append(doc)
+
+        ids = db.users.insert_many(docs, ordered=False).inserted_ids
+        if pending:
+            db.password_resets.insert_many([
+                {'_id': token_digest(token), 'user_id': ids[n], 'expires_at': expires_at, 'created_at': now}
+                for n, token in pending
+            ])
+            tokens += [token for _, token in pending]
+
+        print(f'seeded {min(start + batch_size, users)}/{users} users', end='\r')
+    print()
+    return legacy_tokens, tokens
+
+def measure(keys, fn):
+    latencies = []
+    for key in keys:
+        start = time.perf_counter()
+        fn(key)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000.0
+    return {'mean_ms': float(latencies.mean()), 'p99_ms': float(np.percentile(latencies, 99))}
+
+def run(db, emails, legacy_tokens, tokens):
+    users = UserRepository(db)
+    resets = PasswordResetRepository(db)
+    now = datetime.datetime.utcnow()
+    return {
+        'user_by_email': measure(emails, users.find_credentials),
+        'legacy_reset_token': measure(legacy_tokens, lambda token: users.find_by_reset_token(token, now)),
+        'reset_by_token': measure(tokens, lambda token: resets.find_valid(token, now))
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark user lookups before and after ensure_indexes')
+    parser.add_argument('--uri', required=True, help='MongoDB URI')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--reset-every', type=int, default=1000,
+                        help='One user in this many has a reset pending')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    client.drop_database(DB_NAME)
+    db = client[DB_NAME]
+    legacy_tokens, tokens = seed(db, args.users, args.batch_size, args.reset_every)
+
+    rng = np.random.default_rng(0)
+    emails = [f'user{i}@example.com' for i in rng.integers(0, args.users, args.lookups)]
+    legacy_tokens = legacy_tokens[:args.lookups]
+    tokens = tokens[:args.lookups]
+
+    # Start from the _id index only
+    for collection in INDEXES:
+        db[collection].drop_indexes()
+    before = run(db, emails, legacy_tokens, tokens)
+
+    ensure_indexes(db)
+    after = run(db, emails, legacy_tokens, tokens)
+
+    report = {'users': args.users, 'before': before, 'after': after, 'explain': explain_hot_queries(db)}
+    for name in before:
+        print(f"{name:<20} before mean {before[name]['mean_ms']:9.3f}ms p99 {before[name]['p99_ms']:9.3f}ms   "
+              f"after mean {after[name]['mean_ms']:7.3f}ms p99 {after[name]['p99_ms']:7.3f}ms")
+    for row in report['explain']:
+        print(f"explain {row['query']:<20} index {row['index']} uses_index {row['uses_index']}")
+
+    client.drop_database(DB_NAME)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
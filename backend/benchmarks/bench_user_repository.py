@@ -0,0 +1,111 @@
+# User lookup benchmark
+# Compares the old per-request client with full-document reads against the
+# shared client with the UserRepository projections.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.bench_user_repository                 # mongomock
+#   python -m benchmarks.bench_user_repository --uri mongodb://localhost:27017
+import argparse
+import json
+import secrets
+import time
+import bson
+import numpy as np
+from werkzeug.security import generate_password_hash
+from repositories.encoding_format import encode_face_encoding
+from repositories.user_repository import UserRepository
+
+DB_NAME = 'faceauth_bench'
+
+def client_factory(uri):
+    """
+    Return a function that opens a new client on the benchmark server
+    """
+    if uri:
+        from pymongo import MongoClient
+        return lambda: MongoClient(uri)
+
+    import mongomock
+    shared = mongomock.MongoClient()
+    # Every mock client shares the first one's in-memory store
+    return lambda: mongomock.MongoClient(_store=shared._store)
+
+def seed(db, users, rng):
+    password_hash = generate_password_hash('benchmark-password1')
+    db.users.drop()
+    db.users.create_index('email', unique=True)
+    db.users.insert_many([
+        {
+            'email': f'user{i}@example.com',
+            'password_hash': password_hash,
+            'reset_token': secrets.token_urlsafe(32),
+            'created_at': None,
+            **encode_face_encoding(rng.normal(0.0, 0.1, 128))
+        }
+        for i in range(users)
+    ])
+
+def measure(lookups, fn):
+    latencies = []
+    sizes = []
+    for email in lookups:
+        start = time.perf_counter()
+        doc = fn(email)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(bson.encode(doc)) if doc else 0)
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'mean_ms': float(latencies.mean()),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_bytes': float(np.mean(sizes))
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark shared client and projected user reads')
+    parser.add_argument('--uri', help='MongoDB URI; uses mongomock when omitted')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    new_client = client_factory(args.uri)
+    shared_client = new_client()
+    db = shared_client[DB_NAME]
+    seed(db, args.users, rng)
+
+    lookups = [f'user{i}@example.com' for i in rng.integers(0, args.users, args.lookups)]
+    users = UserRepository(db)
+
+    def per_request_full_document(email):
+        # What every route did before: a new client and the whole document
+        client = new_client()
+        try:
+            return client[DB_NAME].users.find_one({'email': email})
+        finally:
+            client.close()
+
+    def shared_full_document(email):
+        return db.users.find_one({'email': email})
+
+    report = {
+        'per_request_client_full_document': measure(lookups, per_request_full_document),
+        'shared_client_full_document': measure(lookups, shared_full_document),
+        'shared_client_credentials': measure(lookups, users.find_credentials),
+        'shared_client_encoding': measure(lookups, users.find_encoding),
+        'shared_client_email_exists': measure(lookups, lambda email: {'exists': users.email_exists(email)})
+    }
+
+    for name, row in report.items():
+        print(f"{name:<36} mean {row['mean_ms']:8.3f}ms p99 {row['p99_ms']:8.3f}ms "
+              f"payload {row['mean_bytes']:8.0f}B")
+
+    if args.uri:
+        shared_client.drop_database(DB_NAME)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
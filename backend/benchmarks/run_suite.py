@@ -0,0 +1,243 @@
+# Benchmark suite for the authentication and face pipelines
+# Times every stage of face extraction at several frame sizes and the
+# AuthService flows end to end against mongomock, writes the results as
+# JSON and, given a baseline, fails when a median gets slower than the
+# tolerance allows. Synthetic frames are used unless --images is given;
+# they contain no face, so alignment is only timed on real images and
+# encoding runs on a synthetic chip.
+#
+# Usage (from the backend directory):
+#   python -m benchmarks.run_suite --output results.json
+#   python -m benchmarks.run_suite --baseline baseline.json          # exit 1 on regression
+#   python -m benchmarks.run_suite --output baseline.json --images path/to/faces
+import argparse
+import base64
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import time
+import mongomock
+import numpy as np
+from flask import Flask
+from PIL import Image
+from config import Config
+from repositories.encoding_format import encode_face_samples
+from services.auth_service import AuthService
+from services.face_index import get_face_index
+from services.face_pipeline import align_face, assess_quality, detect_faces, encode_face_chips, image_bytes
+from services.face_service import face_settings
+
+RESOLUTIONS = {'qvga': (320, 240), 'vga': (640, 480), 'hd': (1280, 720), 'fhd': (1920, 1080)}
+PASSWORD = 'benchmark-password1'
+
+def timed(fn, repeat, warmup=1):
+    """
+    Call fn() `repeat` times after `warmup` untimed calls; return the
+    median and 95th percentile in milliseconds and the last result
+    """
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'n': repeat
+    }, result
+
+def synthetic_frame(width, height, rng):
+    """
+    A smooth gradient with noise, so JPEG decode does realistic work
+    """
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                      np.full((height, width), 128.0, dtype=np.float32)], axis=-1)
+    image += rng.normal(0, 12, image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+def load_frames(directory, rng):
+    """
+    Return {resolution: PIL image}, from the first image in `directory`
+    resized to each resolution, or synthetic frames
+    """
+    source = None
+    if directory:
+        paths = sorted(p for p in glob.glob(os.path.join(directory, '*'))
+                       if p.lower().endswith(('.jpg', '.jpeg', '.png')))
+        if paths:
+            source = Image.open(paths[0]).convert('RGB')
+
+    frames = {}
+    for name, (width, height) in RESOLUTIONS.items():
+        frames[name] = source.resize((width, height)) if source else synthetic_frame(width, height, rng)
+    return frames
+
+def to_data_url(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+def bench_face_stages(frames, settings, repeat, results):
+    """
+    Time each stage of FaceService.extract_face_encoding separately
+    """
+    rng = np.random.default_rng(1)
+    synthetic_chip = rng.integers(0, 256, (150, 150, 3), dtype=np.uint8)
+
+    for name, frame in frames.items():
+        data_url = to_data_url(frame)
+
+        stats, raw = timed(lambda: image_bytes(data_url), repeat)
+        results[f'face.{name}.base64_decode'] = stats
+
+        def decode():
+            image = Image.open(io.BytesIO(raw))
+            image.load()
+            return image
+        stats, image = timed(decode, repeat)
+        results[f'face.{name}.image_decode'] = stats
+
+        stats, rgb = timed(lambda: np.asarray(image if image.mode == 'RGB' else image.convert('RGB')), repeat)
+        results[f'face.{name}.color_convert'] = stats
+
+        if settings.get('quality'):
+            stats, _ = timed(lambda: assess_quality(rgb, settings['quality']), repeat)
+            results[f'face.{name}.quality'] = stats
+
+        stats, locations = timed(lambda: detect_faces(rgb, settings['max_side'], settings['upsample'],
+                                                      settings['model']), repeat)
+        results[f'face.{name}.detect'] = stats
+
+        face_chip = synthetic_chip
+        if len(locations) == 1:
+            stats, face_chip = timed(lambda: align_face(rgb, locations[0], settings['landmarks']), repeat)
+            results[f'face.{name}.align'] = stats
+
+        stats, _ = timed(lambda: encode_face_chips([face_chip], settings['num_jitters']), repeat)
+        results[f'face.{name}.encode'] = stats
+
+def create_app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    # Time the pipeline itself, not worker hand-off or caches of repeated frames
+    app.config.update(FACE_WORKER_PROCESSES=0, FACE_BATCH_ENABLED=False, FRAME_CACHE_ENABLED=False)
+    return app
+
+def seed_gallery(db, start, end, rng):
+    if end > start:
+        db.users.insert_many([
+            {'email': f'user{i}@example.com', **encode_face_samples(rng.normal(0, 0.1, (3, 128)))}
+            for i in range(start, end)
+        ])
+
+def bench_auth(app, gallery_sizes, repeat, results):
+    """
+    Time the AuthService flows end to end against mongomock
+    """
+    rng = np.random.default_rng(2)
+    db = mongomock.MongoClient().faceauth_bench
+    db.users.create_index('email', unique=True)
+
+    with app.app_context():
+        auth_service = AuthService(db)
+        probe = rng.normal(0, 0.1, 128)
+        counter = iter(range(10 ** 9))
+
+        stats, _ = timed(lambda: auth_service.register_user(f'new{next(counter)}@example.com', PASSWORD), repeat)
+        results['auth.register_password'] = stats
+
+        stats, _ = timed(lambda: auth_service.register_user(f'new{next(counter)}@example.com', None,
+                                                            [probe, probe + 0.01]), repeat)
+        results['auth.register_face'] = stats
+
+        auth_service.register_user('login@example.com', PASSWORD, [probe])
+        stats, result = timed(lambda: auth_service.login_with_password('login@example.com', PASSWORD), repeat)
+        assert result['success'], result
+        results['auth.login_password'] = stats
+
+        stats, result = timed(lambda: auth_service.login_with_face('login@example.com', probe), repeat)
+        assert result['success'], result
+        results['auth.login_face'] = stats
+
+        seeded = 0
+        for size in sorted(gallery_sizes):
+            seed_gallery(db, seeded, size, rng)
+            seeded = max(seeded, size)
+            get_face_index(db).load(db)
+            stats, _ = timed(lambda: auth_service.identify_with_face(probe), repeat)
+            results[f'auth.identify_face.gallery_{size}'] = stats
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """
+    Return the benchmarks whose median regressed past the tolerance
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        ratio = current['p50_ms'] / base['p50_ms'] if base['p50_ms'] else float('inf')
+        if ratio > 1.0 + tolerance and current['p50_ms'] - base['p50_ms'] > min_delta_ms:
+            regressions.append((name, base['p50_ms'], current['p50_ms'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the face and auth benchmark suite')
+    parser.add_argument('--images', help='Directory of single-face JPEG/PNG images; synthetic frames otherwise')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--gallery-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--skip-face', action='store_true', help='Skip the face pipeline stages')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--baseline', help='Fail if a median is slower than in this results file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown of a median against the baseline, as a fraction')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='Ignore regressions smaller than this many milliseconds')
+    args = parser.parse_args()
+
+    app = create_app()
+    settings = face_settings(app.config)
+
+    results = {}
+    if not args.skip_face:
+        bench_face_stages(load_frames(args.images, np.random.default_rng(0)), settings, args.repeat, results)
+    bench_auth(app, args.gallery_sizes, args.repeat, results)
+
+    for name, row in results.items():
+        print(f"{name:<40} p50 {row['p50_ms']:9.3f}ms p95 {row['p95_ms']:9.3f}ms")
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'images': 'real' if args.images else 'synthetic',
+            'password_hash': f'{Config.PASSWORD_HASH_METHOD}:{Config.PASSWORD_HASH_ITERATIONS}'
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for name, before, after, ratio in regressions:
+            print(f'REGRESSION {name}: {before:.3f}ms -> {after:.3f}ms ({ratio:.2f}x)')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
+
+if __name__ == '__main__':
+    main()
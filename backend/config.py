@@ -1,6 +1,8 @@
 # Configuration file for the backend
 # This file contains the configuration settings for the backend application
+import multiprocessing
 import os
+import tempfile
 from datetime import timedelta
 
 class Config:
@@ -9,6 +11,15 @@ class Config:
     
     # MongoDB settings
     MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/faceauth')
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 10000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+    # Create missing indexes at startup (see repositories/indexes.py)
+    MONGO_ENSURE_INDEXES = os.environ.get('MONGO_ENSURE_INDEXES', 'true').lower() == 'true'
     
     # JWT settings
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key')
@@ -16,12 +27,214 @@ class Config:
     
     # Email settings for password reset
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-    MAIL_PORT = os.environ.get('MAIL_PORT', 587)
-    MAIL_USE_TLS = True
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
     
+    # Background mail dispatcher: queued messages go out in batches over one
+    # reused SMTP connection, closed after MAIL_IDLE_TIMEOUT idle seconds;
+    # failures are retried after MAIL_RETRY_BACKOFF * 2**attempt seconds
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE', 1000))
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 20))
+    MAIL_IDLE_TIMEOUT = float(os.environ.get('MAIL_IDLE_TIMEOUT', 30))
+    MAIL_MAX_RETRIES = int(os.environ.get('MAIL_MAX_RETRIES', 5))
+    MAIL_RETRY_BACKOFF = float(os.environ.get('MAIL_RETRY_BACKOFF', 2))
+    MAIL_SHUTDOWN_TIMEOUT = float(os.environ.get('MAIL_SHUTDOWN_TIMEOUT', 5))
+    
+    # Access token verification caches: decoded claims live until the token
+    # expires, user lookups for TOKEN_USER_CACHE_TTL seconds; revocations
+    # made by other processes are picked up every TOKEN_REVOCATION_SYNC_INTERVAL
+    TOKEN_CACHE_ENABLED = os.environ.get('TOKEN_CACHE_ENABLED', 'true').lower() == 'true'
+    TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 100000))
+    TOKEN_USER_CACHE_TTL = int(os.environ.get('TOKEN_USER_CACHE_TTL', 30))
+    TOKEN_REVOCATION_SYNC_INTERVAL = float(os.environ.get('TOKEN_REVOCATION_SYNC_INTERVAL', 5))
+    
+    # Password hashing: werkzeug method, PBKDF2 iterations and the bounded
+    # thread pool it runs on (0 workers splits the host's cores between the
+    # GUNICORN_WORKERS processes, like FACE_WORKER_PROCESSES)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 260000))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 32))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+    PASSWORD_HASH_RETRY_AFTER = int(os.environ.get('PASSWORD_HASH_RETRY_AFTER', 1))
+    
+    # Prometheus metrics at /metrics; Server-Timing exposes per-stage
+    # timings to clients, so it stays off unless asked for
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+    
     # Face recognition settings
     FACE_RECOGNITION_TOLERANCE = 0.5
-    FACE_ENCODINGS_PATH = os.environ.get('FACE_ENCODINGS_PATH', 'face_encodings')
\ No newline at end of file
+    FACE_ENCODINGS_PATH = os.environ.get('FACE_ENCODINGS_PATH', 'face_encodings')
+    
+    # Warm the face models up before /ready reports ready; gunicorn loads
+    # them in the master before forking unless FACE_MODELS_PRELOAD is off
+    FACE_MODELS_WARM_UP = os.environ.get('FACE_MODELS_WARM_UP', 'true').lower() == 'true'
+    FACE_MODELS_PRELOAD = os.environ.get('FACE_MODELS_PRELOAD', 'true').lower() == 'true'
+    
+    # Enrollment samples kept per user; with adaptive update on, a login
+    # matching within FACE_TEMPLATE_UPDATE_DISTANCE replaces the oldest sample
+    FACE_TEMPLATE_MAX_SAMPLES = int(os.environ.get('FACE_TEMPLATE_MAX_SAMPLES', 8))
+    FACE_TEMPLATE_ADAPTIVE_UPDATE = os.environ.get('FACE_TEMPLATE_ADAPTIVE_UPDATE', 'false').lower() == 'true'
+    FACE_TEMPLATE_UPDATE_DISTANCE = float(os.environ.get('FACE_TEMPLATE_UPDATE_DISTANCE', 0.35))
+    
+    # Streaming face login (/api/auth/login/stream): a burst of at most
+    # FACE_STREAM_MAX_FRAMES frames succeeds after FACE_STREAM_REQUIRED_MATCHES
+    # consecutive matches; up to FACE_STREAM_READ_AHEAD frames wait for
+    # extraction and are dropped once a decision is made
+    FACE_STREAM_MAX_FRAMES = int(os.environ.get('FACE_STREAM_MAX_FRAMES', 10))
+    FACE_STREAM_MAX_FRAME_BYTES = int(os.environ.get('FACE_STREAM_MAX_FRAME_BYTES', 4 * 1024 * 1024))
+    FACE_STREAM_REQUIRED_MATCHES = int(os.environ.get('FACE_STREAM_REQUIRED_MATCHES', 1))
+    FACE_STREAM_READ_AHEAD = int(os.environ.get('FACE_STREAM_READ_AHEAD', 1))
+    
+    # Face detection runs on a copy scaled down to at most this many pixels
+    # per side (0 disables scaling); encodings use the full-resolution frame
+    FACE_DETECTION_MAX_SIDE = int(os.environ.get('FACE_DETECTION_MAX_SIDE', 640))
+    FACE_DETECTION_UPSAMPLE = int(os.environ.get('FACE_DETECTION_UPSAMPLE', 1))
+    FACE_DETECTION_MODEL = os.environ.get('FACE_DETECTION_MODEL', 'hog')
+    
+    # Accuracy/latency profiles for face extraction. 'balanced' matches the
+    # face_recognition defaults; 'fast' skips upsampling and aligns with the
+    # 5-point landmark model; 'accurate' averages the encoding over several
+    # jittered copies, which is meant for enrollment. Enrollment (register,
+    # /api/face/update) and verification (login, /api/face/verify) pick
+    # their profile separately
+    FACE_PROFILES = {
+        'fast': {
+            'max_side': FACE_DETECTION_MAX_SIDE,
+            'upsample': 0,
+            'model': FACE_DETECTION_MODEL,
+            'landmarks': 'small',
+            'num_jitters': 1
+        },
+        'balanced': {
+            'max_side': FACE_DETECTION_MAX_SIDE,
+            'upsample': FACE_DETECTION_UPSAMPLE,
+            'model': FACE_DETECTION_MODEL,
+            'landmarks': 'large',
+            'num_jitters': 1
+        },
+        'accurate': {
+            'max_side': FACE_DETECTION_MAX_SIDE,
+            'upsample': FACE_DETECTION_UPSAMPLE,
+            'model': FACE_DETECTION_MODEL,
+            'landmarks': 'large',
+            'num_jitters': int(os.environ.get('FACE_ACCURATE_JITTERS', 10))
+        }
+    }
+    FACE_ENROLLMENT_PROFILE = os.environ.get('FACE_ENROLLMENT_PROFILE', 'balanced')
+    FACE_VERIFICATION_PROFILE = os.environ.get('FACE_VERIFICATION_PROFILE', 'balanced')
+    
+    # Frame quality gate, run on a grayscale copy at most FACE_QUALITY_MAX_SIDE
+    # pixels per side: Laplacian variance below MIN_SHARPNESS is blurry, mean
+    # gray level outside MIN/MAX_BRIGHTNESS or more than MAX_CLIPPED of pixels
+    # at 250+ is badly exposed, and a face box narrower than MIN_FACE_SIZE
+    # full-resolution pixels is too small
+    FACE_QUALITY_ENABLED = os.environ.get('FACE_QUALITY_ENABLED', 'true').lower() == 'true'
+    FACE_QUALITY_MAX_SIDE = int(os.environ.get('FACE_QUALITY_MAX_SIDE', 256))
+    FACE_QUALITY_MIN_SHARPNESS = float(os.environ.get('FACE_QUALITY_MIN_SHARPNESS', 30))
+    FACE_QUALITY_MIN_BRIGHTNESS = float(os.environ.get('FACE_QUALITY_MIN_BRIGHTNESS', 45))
+    FACE_QUALITY_MAX_BRIGHTNESS = float(os.environ.get('FACE_QUALITY_MAX_BRIGHTNESS', 215))
+    FACE_QUALITY_MAX_CLIPPED = float(os.environ.get('FACE_QUALITY_MAX_CLIPPED', 0.25))
+    FACE_QUALITY_MIN_FACE_SIZE = int(os.environ.get('FACE_QUALITY_MIN_FACE_SIZE', 60))
+    
+    # Gunicorn worker processes on this host (read by gunicorn.conf.py)
+    GUNICORN_WORKERS = int(os.environ.get('GUNICORN_WORKERS', 2))
+    
+    # Face worker processes per gunicorn worker (0 runs face work inline in
+    # the request thread); by default the host's cores are split between
+    # the gunicorn workers rather than given to each of them
+    FACE_WORKER_PROCESSES = int(os.environ.get('FACE_WORKER_PROCESSES',
+                                               max(1, (os.cpu_count() or 1) // GUNICORN_WORKERS)))
+    FACE_WORKER_QUEUE_SIZE = int(os.environ.get('FACE_WORKER_QUEUE_SIZE', 16))
+    FACE_WORKER_TIMEOUT = float(os.environ.get('FACE_WORKER_TIMEOUT', 10))
+    FACE_WORKER_RETRY_AFTER = int(os.environ.get('FACE_WORKER_RETRY_AFTER', 2))
+    # The pool is created from request threads, so its processes are not
+    # forked from a multi-threaded worker
+    FACE_WORKER_START_METHOD = os.environ.get(
+        'FACE_WORKER_START_METHOD',
+        'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    )
+    
+    # At most FACE_MAX_CONCURRENT face extractions run at once per process
+    # (0 for no cap); a request waits up to FACE_ADMISSION_TIMEOUT seconds
+    # for a slot before it is turned away with a 503
+    FACE_MAX_CONCURRENT = int(os.environ.get('FACE_MAX_CONCURRENT', 2 * max(1, FACE_WORKER_PROCESSES)))
+    FACE_ADMISSION_TIMEOUT = float(os.environ.get('FACE_ADMISSION_TIMEOUT', 0.1))
+    
+    # Rate limits for the face endpoints, as 'attempts/seconds' token
+    # buckets per client IP and per email; an empty value disables one.
+    # RATE_LIMIT_BACKEND 'mongo' shares the buckets across workers and
+    # hosts, falling back to local buckets while MongoDB is unreachable
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+    RATE_LIMITS = {
+        'face_login': {
+            'ip': os.environ.get('RATE_LIMIT_FACE_LOGIN_IP', '30/60'),
+            'email': os.environ.get('RATE_LIMIT_FACE_LOGIN_EMAIL', '10/60')
+        },
+        # Streaming login takes one token per frame, not per request
+        'face_login_stream': {
+            'ip': os.environ.get('RATE_LIMIT_FACE_LOGIN_STREAM_IP', '60/60'),
+            'email': os.environ.get('RATE_LIMIT_FACE_LOGIN_STREAM_EMAIL', '20/60')
+        },
+        'face_verify': {
+            'ip': os.environ.get('RATE_LIMIT_FACE_VERIFY_IP', '30/60'),
+            'email': os.environ.get('RATE_LIMIT_FACE_VERIFY_EMAIL', '10/60')
+        },
+        'face_enroll': {
+            'ip': os.environ.get('RATE_LIMIT_FACE_ENROLL_IP', '10/60'),
+            'email': os.environ.get('RATE_LIMIT_FACE_ENROLL_EMAIL', '5/60')
+        }
+    }
+    
+    # Cross-request batching of face encodings
+    FACE_BATCH_ENABLED = os.environ.get('FACE_BATCH_ENABLED', 'false').lower() == 'true'
+    FACE_BATCH_MAX_SIZE = int(os.environ.get('FACE_BATCH_MAX_SIZE', 16))
+    FACE_BATCH_WINDOW_MS = float(os.environ.get('FACE_BATCH_WINDOW_MS', 5))
+    FACE_BATCH_MAX_PENDING = int(os.environ.get('FACE_BATCH_MAX_PENDING', 256))
+    
+    # In-process cache of decoded stored encodings, keyed by email
+    ENCODING_CACHE_ENABLED = os.environ.get('ENCODING_CACHE_ENABLED', 'true').lower() == 'true'
+    ENCODING_CACHE_MAX_ENTRIES = int(os.environ.get('ENCODING_CACHE_MAX_ENTRIES', 100000))
+    ENCODING_CACHE_MAX_BYTES = int(os.environ.get('ENCODING_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    ENCODING_CACHE_TTL = int(os.environ.get('ENCODING_CACHE_TTL', 300))
+    # Hits are served without touching the database; after this many
+    # seconds an entry's face_version is checked again, which bounds how
+    # long another worker's face change or deletion goes unnoticed
+    ENCODING_CACHE_RECHECK_INTERVAL = float(os.environ.get('ENCODING_CACHE_RECHECK_INTERVAL', 30))
+    
+    # Short-lived cache of extraction results keyed by a hash of the image bytes
+    FRAME_CACHE_ENABLED = os.environ.get('FRAME_CACHE_ENABLED', 'true').lower() == 'true'
+    FRAME_CACHE_MAX_ENTRIES = int(os.environ.get('FRAME_CACHE_MAX_ENTRIES', 1024))
+    FRAME_CACHE_TTL = int(os.environ.get('FRAME_CACHE_TTL', 30))
+    
+    # Face identification index: 'exact' brute force, 'ivf' approximate search
+    # or 'shared', an exact index memory-mapped by every worker on the host
+    FACE_INDEX_BACKEND = os.environ.get('FACE_INDEX_BACKEND', 'exact')
+    FACE_INDEX_NLIST = int(os.environ.get('FACE_INDEX_NLIST', 1024))
+    FACE_INDEX_NPROBE = int(os.environ.get('FACE_INDEX_NPROBE', 16))
+    # A worker's 'exact' or 'ivf' index picks up other workers' enrollments
+    # by fetching the faces changed since its last sync every this many
+    # seconds (0 never syncs), and is rebuilt in full once older than
+    # FACE_INDEX_MAX_AGE, which also drops users deleted outside the app
+    # (0 never rebuilds)
+    FACE_INDEX_SYNC_INTERVAL = int(os.environ.get('FACE_INDEX_SYNC_INTERVAL', 30))
+    FACE_INDEX_MAX_AGE = int(os.environ.get('FACE_INDEX_MAX_AGE', 86400))
+    
+    # Shared index: snapshot directory (tmpfs keeps it in RAM), how often a
+    # worker replays the delta log, how many logged changes trigger a new
+    # snapshot, and the age in seconds after which a worker starting up
+    # rebuilds the snapshot from MongoDB (0 never does)
+    FACE_SHARED_INDEX_PATH = os.environ.get(
+        'FACE_SHARED_INDEX_PATH',
+        os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'faceauth-gallery')
+    )
+    FACE_SHARED_INDEX_SYNC_INTERVAL = float(os.environ.get('FACE_SHARED_INDEX_SYNC_INTERVAL', 1))
+    FACE_SHARED_INDEX_COMPACT_RECORDS = int(os.environ.get('FACE_SHARED_INDEX_COMPACT_RECORDS', 10000))
+    FACE_SHARED_INDEX_MAX_AGE = int(os.environ.get('FACE_SHARED_INDEX_MAX_AGE', 86400))
\ No newline at end of file
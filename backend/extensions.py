@@ -0,0 +1,7 @@
+# Shared Flask extensions
+# Created here without an app so routes and services can import them
+# without importing app.py; app.py binds them with init_app().
+from flask_pymongo import PyMongo
+
+# One MongoClient, and so one connection pool, per process
+mongo = PyMongo()
@@ -0,0 +1,68 @@
+# Gunicorn configuration
+# With preload_app the master imports the app, loads the dlib models and
+# runs one warm-up inference before forking, so every worker shares the
+# model pages copy-on-write instead of loading its own copy. gc.freeze()
+# keeps the collector from touching (and so copying) those objects in the
+# workers. That only applies when face work runs inline
+# (FACE_WORKER_PROCESSES=0); otherwise the models live in each worker's
+# face process pool, whose processes fork from a forkserver that preloads
+# them, and every worker starts its pool as soon as it is up. Either way
+# /ready answers 503 until the models are warm where face work runs. With
+# FACE_INDEX_BACKEND=shared the master also builds the face gallery
+# snapshot every worker maps.
+#
+# Usage (from the backend directory):
+#   gunicorn -c gunicorn.conf.py
+import gc
+import os
+from config import Config
+
+wsgi_app = 'app:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = Config.GUNICORN_WORKERS
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = Config.FACE_MODELS_PRELOAD
+
+def _memory(usage):
+    return ', '.join(f'{field} {value / 2 ** 20:.1f}MB' for field, value in usage.items())
+
+def when_ready(server):
+    # Build the host-wide gallery once, so workers only map it
+    if Config.FACE_INDEX_BACKEND == 'shared':
+        from pymongo import MongoClient
+        from services.shared_face_index import build_shared_gallery
+        try:
+            with MongoClient(Config.MONGO_URI,
+                             serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS) as client:
+                generation = build_shared_gallery(Config.FACE_SHARED_INDEX_PATH, client.get_default_database())
+            server.log.info('Shared face gallery generation %d built in %s', generation, Config.FACE_SHARED_INDEX_PATH)
+        except Exception as e:
+            server.log.error('Could not build the shared face gallery: %s', e)
+
+    if not preload_app:
+        return
+
+    from services.face_models import warm_up
+    from utils.process_info import memory_usage, process_stats
+
+    server.log.info('App loaded in %.2fs', process_stats()['startup_seconds'])
+
+    # With a face process pool the workers never run dlib themselves
+    if Config.FACE_MODELS_WARM_UP and Config.FACE_WORKER_PROCESSES == 0:
+        status = warm_up()
+        server.log.info('Face models loaded in %.2fs and warmed up in %.2fs',
+                        status['load_seconds'], status['warm_up_seconds'])
+        gc.freeze()
+
+    server.log.info('Master memory: %s', _memory(memory_usage()))
+
+def post_worker_init(worker):
+    from utils.process_info import memory_usage, process_stats
+
+    if Config.FACE_MODELS_WARM_UP:
+        from services.face_worker import start_face_warm_up
+        start_face_warm_up(worker.wsgi.config)
+
+    stats = process_stats()
+    worker.log.info('Worker %s ready (app loaded in %.2fs), memory: %s',
+                    worker.pid, stats['startup_seconds'], _memory(memory_usage()))
@@ -0,0 +1,55 @@
+# Stored face encoding format
+# Version 1 stored a single encoding as a BSON array of 128 doubles.
+# Version 2 stored it as 512 bytes of little-endian float32 in a BSON
+# Binary. Version 3 stores one or more enrollment samples as consecutive
+# 512-byte rows, oldest first, plus their float32 centroid. Every version
+# is read back with a single np.frombuffer call or array conversion.
+import numpy as np
+from bson.binary import Binary
+
+ENCODING_FORMAT_VERSION = 3
+ENCODING_SIZE = 128
+ENCODING_DTYPE = np.dtype('<f4')
+
+def encode_face_samples(face_encodings):
+    """
+    Return the document fields that store a user's face samples
+    """
+    samples = np.asarray(face_encodings, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE)
+    centroid = samples.mean(axis=0, dtype=np.float32).astype(ENCODING_DTYPE)
+    return {
+        'face_encoding': Binary(samples.tobytes()),
+        'face_centroid': Binary(centroid.tobytes()),
+        'face_encoding_format': ENCODING_FORMAT_VERSION
+    }
+
+def encode_face_encoding(face_encoding):
+    """
+    Return the document fields that store a single face encoding
+    """
+    return encode_face_samples([face_encoding])
+
+def decode_face_samples(stored):
+    """
+    Turn a stored encoding of any format into a (samples, 128) float32 matrix
+    """
+    if isinstance(stored, bytes):
+        return np.frombuffer(stored, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE)
+    return np.asarray(stored, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+def decode_face_encoding(stored):
+    """
+    Turn a single stored vector, such as the centroid, into a float32 vector
+    """
+    if isinstance(stored, bytes):
+        return np.frombuffer(stored, dtype=ENCODING_DTYPE)
+    return np.asarray(stored, dtype=np.float32)
+
+def decode_face_centroid(user_data):
+    """
+    Return the stored centroid, or compute it for documents written
+    before version 3
+    """
+    if user_data.get('face_centroid') is not None:
+        return decode_face_encoding(user_data['face_centroid'])
+    return decode_face_samples(user_data['face_encoding']).mean(axis=0)
@@ -0,0 +1,118 @@
+# Index bootstrap
+# Creates the indexes every hot query relies on and checks with explain()
+# that the query planner actually picks them. create_index is a no-op for
+# an index that already exists, so this is safe to run on every start.
+import datetime
+import logging
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError, ServerSelectionTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# collection -> [(keys, options)]
+INDEXES = {
+    'users': [
+        ([('email', ASCENDING)], {'unique': True}),
+        # Only documents still carrying a legacy reset token are indexed
+        ([('reset_token', ASCENDING)], {'sparse': True}),
+        # Face index sync: users whose face changed since the last sync
+        ([('face_updated_at', ASCENDING)], {'sparse': True})
+    ],
+    'password_resets': [
+        # TTL: MongoDB deletes a reset once expires_at has passed
+        ([('expires_at', ASCENDING)], {'expireAfterSeconds': 0}),
+        ([('user_id', ASCENDING)], {})
+    ],
+    'revoked_tokens': [
+        ([('exp', ASCENDING)], {'expireAfterSeconds': 0}),
+        ([('revoked_at', ASCENDING)], {})
+    ],
+    'rate_limits': [
+        # TTL: a bucket is dropped once it would have refilled completely
+        ([('expires_at', ASCENDING)], {'expireAfterSeconds': 0})
+    ]
+}
+
+# Plan stages that read through an index rather than the whole collection
+INDEX_STAGES = ('IXSCAN', 'IDHACK', 'EXPRESS_IXSCAN', 'EXPRESS_IDHACK', 'COUNT_SCAN', 'DISTINCT_SCAN')
+
+def hot_queries():
+    """
+    Return (name, collection, filter) for the queries that run per request,
+    with placeholder values of the right types
+    """
+    now = datetime.datetime.utcnow()
+    return [
+        ('user by email', 'users', {'email': 'index-check@example.com'}),
+        ('user by id', 'users', {'_id': ObjectId()}),
+        ('legacy reset token', 'users', {'reset_token': 'index-check', 'reset_token_exp': {'$gt': now}}),
+        ('face changes since', 'users', {'face_updated_at': {'$gte': now}}),
+        ('reset by token', 'password_resets', {'_id': 'index-check', 'expires_at': {'$gt': now}}),
+        ('resets by user', 'password_resets', {'user_id': ObjectId()}),
+        ('revocations since', 'revoked_tokens', {'exp': {'$gt': now}, 'revoked_at': {'$gte': now}})
+    ]
+
+def index_name(collection, keys):
+    return f"{collection}.{'_'.join(field for field, _ in keys)}"
+
+def ensure_indexes(db):
+    """
+    Create every index in INDEXES. Returns the names of the indexes that
+    could not be built, such as a unique email index over duplicates. If
+    no server can be reached, gives up straight away rather than waiting
+    out the server selection timeout once per index.
+    """
+    pending = [(collection, keys, options) for collection, indexes in INDEXES.items()
+               for keys, options in indexes]
+    failed = []
+    for number, (collection, keys, options) in enumerate(pending):
+        name = index_name(collection, keys)
+        try:
+            db[collection].create_index(keys, **options)
+        except ServerSelectionTimeoutError as e:
+            logger.error('Could not create indexes, MongoDB is unreachable: %s', e)
+            return failed + [index_name(collection, keys) for collection, keys, _ in pending[number:]]
+        except PyMongoError as e:
+            logger.error('Could not create index %s: %s', name, e)
+            failed.append(name)
+    return failed
+
+def plan_stages(plan):
+    """
+    Return every stage name and index name found in an explain() plan tree
+    """
+    stages, index_names = [], []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        if 'indexName' in plan:
+            index_names.append(plan['indexName'])
+        for value in plan.values():
+            child_stages, child_indexes = plan_stages(value)
+            stages += child_stages
+            index_names += child_indexes
+    elif isinstance(plan, list):
+        for value in plan:
+            child_stages, child_indexes = plan_stages(value)
+            stages += child_stages
+            index_names += child_indexes
+    return stages, index_names
+
+def explain_hot_queries(db):
+    """
+    Return, per hot query, the winning plan's stages, the index it used
+    and whether it avoided a collection scan
+    """
+    report = []
+    for name, collection, query in hot_queries():
+        plan = db[collection].find(query).explain()['queryPlanner']['winningPlan']
+        stages, index_names = plan_stages(plan)
+        report.append({
+            'query': name,
+            'collection': collection,
+            'stages': stages,
+            'index': index_names[0] if index_names else ('_id_' if 'IDHACK' in stages else None),
+            'uses_index': any(stage in INDEX_STAGES for stage in stages) and 'COLLSCAN' not in stages
+        })
+    return report
@@ -0,0 +1,51 @@
+# Password reset token repository
+# Reset tokens live in their own collection, stored under a SHA-256 digest
+# of the token, and a TTL index on expires_at lets MongoDB delete them once
+# they lapse.
+import hashlib
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class PasswordResetRepository:
+    def __init__(self, db):
+        self.resets = db.password_resets
+    
+    def create(self, user_id, token, expires_at, created_at):
+        """
+        Store a new reset for the user, replacing any earlier one so only
+        the latest token works
+        """
+        self.resets.delete_many({'user_id': user_id})
+        self.resets.insert_one({
+            '_id': token_digest(token),
+            'user_id': user_id,
+            'expires_at': expires_at,
+            'created_at': created_at
+        })
+    
+    def find_valid(self, token, now):
+        """
+        Return the reset for an unexpired token, or None. The TTL monitor
+        only runs once a minute, so expiry is checked here as well.
+        """
+        return self.resets.find_one(
+            {'_id': token_digest(token), 'expires_at': {'$gt': now}},
+            {'user_id': 1}
+        )
+    
+    def consume(self, token, now):
+        """
+        Delete an unexpired reset and return it, or None if it was already
+        used or has expired, so a token works at most once
+        """
+        return self.resets.find_one_and_delete(
+            {'_id': token_digest(token), 'expires_at': {'$gt': now}},
+            projection={'user_id': 1}
+        )
+    
+    def delete_for_user(self, user_id):
+        """
+        Drop every outstanding reset of a user once one has been used
+        """
+        self.resets.delete_many({'user_id': user_id})
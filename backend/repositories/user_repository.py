@@ -0,0 +1,166 @@
+# User repository
+# All access to the users collection goes through here, and every read
+# asks only for the fields its caller needs.
+import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from repositories.encoding_format import encode_face_samples
+
+# Password login: the hash, plus the encoding format marker that tells
+# whether a face is enrolled without reading the encoding itself. Legacy
+# array encodings have no marker, so scripts/migrate_face_encodings.py
+# must have run before this is deployed; until then their users are
+# reported as having no face.
+CREDENTIALS_PROJECTION = {'email': 1, 'password_hash': 1, 'face_encoding_format': 1}
+
+# Face login and verification: the stored samples and their version, and
+# never the password hash
+ENCODING_PROJECTION = {'email': 1, 'face_encoding': 1, 'face_version': 1}
+
+# Token checks and other lookups that only need to identify the user
+PROFILE_PROJECTION = {'email': 1}
+
+def to_object_id(user_id):
+    """
+    Convert a user id string to an ObjectId, or None if it is not valid
+    """
+    if isinstance(user_id, ObjectId):
+        return user_id
+    try:
+        return ObjectId(user_id)
+    except (InvalidId, TypeError):
+        return None
+
+class UserRepository:
+    def __init__(self, db):
+        self.users = db.users
+    
+    def email_exists(self, email):
+        return self.users.find_one({'email': email}, {'_id': 1}) is not None
+    
+    def find_credentials(self, email):
+        return self.users.find_one({'email': email}, CREDENTIALS_PROJECTION)
+    
+    def find_encoding(self, email):
+        return self.users.find_one({'email': email}, ENCODING_PROJECTION)
+    
+    def find_encoding_by_id(self, user_id):
+        object_id = to_object_id(user_id)
+        if object_id is None:
+            return None
+        return self.users.find_one({'_id': object_id}, ENCODING_PROJECTION)
+    
+    def find_profile_by_id(self, user_id):
+        object_id = to_object_id(user_id)
+        if object_id is None:
+            return None
+        return self.users.find_one({'_id': object_id}, PROFILE_PROJECTION)
+    
+    def find_id(self, email):
+        return self.users.find_one({'email': email}, {'_id': 1})
+    
+    def has_password(self, user_id):
+        """
+        Return True if the user has a password set, without reading the hash
+        """
+        return self.users.find_one({'_id': user_id, 'password_hash': {'$type': 'string'}}, {'_id': 1}) is not None
+    
+    def find_face_version(self, email):
+        """
+        Return the user's current face_version (0 if never set), or None if
+        not found
+        """
+        user_data = self.users.find_one({'email': email}, {'_id': 0, 'face_version': 1})
+        if user_data is None:
+            return None
+        return user_data.get('face_version', 0)
+    
+    def find_by_reset_token(self, token, now):
+        """
+        Look up a reset token stored on the user document, as tokens were
+        before the password_resets collection. Served by a sparse index.
+        """
+        return self.users.find_one(
+            {'reset_token': token, 'reset_token_exp': {'$gt': now}},
+            {'_id': 1}
+        )
+    
+    def iter_face_encodings(self, batch_size=1000):
+        """
+        Stream the id, samples and centroid of every user with a face enrolled
+        """
+        return self.users.find(
+            {'face_encoding': {'$exists': True}},
+            {'face_encoding': 1, 'face_centroid': 1},
+            batch_size=batch_size
+        )
+    
+    def iter_face_changes(self, since, batch_size=1000):
+        """
+        Stream the id, samples and centroid of every user whose face was
+        enrolled, replaced or removed at or after `since`. Removed faces come
+        back without a face_encoding.
+        """
+        return self.users.find(
+            {'face_updated_at': {'$gte': since}},
+            {'face_encoding': 1, 'face_centroid': 1},
+            batch_size=batch_size
+        )
+    
+    def insert(self, user_dict):
+        return self.users.insert_one(user_dict).inserted_id
+    
+    def set_face_samples(self, email, face_encodings, expected_version=None):
+        """
+        Store a user's face samples and bump the face version. Returns the
+        user's _id and new face_version, or None if not found. With
+        `expected_version` the write only applies if nobody changed the
+        samples since that version was read.
+        """
+        query = {'email': email}
+        if expected_version is not None:
+            query['face_version'] = expected_version if expected_version else {'$in': [0, None]}
+        
+        return self.users.find_one_and_update(
+            query,
+            {'$set': {**encode_face_samples(face_encodings), 'face_updated_at': datetime.datetime.utcnow()},
+             '$inc': {'face_version': 1}},
+            projection={'_id': 1, 'face_version': 1},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    def unset_face_encoding(self, email):
+        """
+        Remove a face encoding and bump the face version. Returns the user's
+        _id and new face_version, or None if not found
+        """
+        return self.users.find_one_and_update(
+            {'email': email},
+            {'$unset': {'face_encoding': '', 'face_centroid': '', 'face_encoding_format': ''},
+             '$set': {'face_updated_at': datetime.datetime.utcnow()},
+             '$inc': {'face_version': 1}},
+            projection={'_id': 1, 'face_version': 1},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    def upgrade_password_hash(self, user_id, old_hash, new_hash):
+        """
+        Replace a hash made with outdated parameters, unless the password
+        changed since it was read
+        """
+        self.users.update_one(
+            {'_id': user_id, 'password_hash': old_hash},
+            {'$set': {'password_hash': new_hash}}
+        )
+    
+    def set_password_hash(self, user_id, password_hash):
+        """
+        Replace the password hash and clear any reset token stored on the
+        user document
+        """
+        self.users.update_one(
+            {'_id': user_id},
+            {'$set': {'password_hash': password_hash},
+             '$unset': {'reset_token': '', 'reset_token_exp': ''}}
+        )
@@ -2,21 +2,29 @@
 from flask import Blueprint, request, jsonify, current_app
 from services.auth_service import AuthService
 from services.face_service import FaceService
-from flask_pymongo import PyMongo
-import jwt
+from services.face_stream import FaceFrameStream, FrameStreamError
+from extensions import mongo
+from services.token_service import get_token_verifier
+from utils.auth import token_required
 from utils.email_sender import send_password_reset_email
 from utils.validators import validate_email, validate_password
+from utils.uploads import get_face_payload, get_face_uploads, password_in_query_string
+from utils.responses import error_response, face_error_response
+from utils.metrics import timer, count
+from utils.rate_limit import check_rate_limit
 
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/register', methods=['POST'])
 def register():
-    data = request.get_json()
+    if password_in_query_string():
+        return jsonify({'success': False, 'message': 'Send the password in a form or JSON body, not the query string'}), 400
+    
+    data, face_images = get_face_uploads()
     
     # Validate inputs
     email = data.get('email')
     password = data.get('password')
-    face_image = data.get('faceImage')
     
     if not validate_email(email):
         return jsonify({'success': False, 'message': 'Invalid email format'}), 400
@@ -24,40 +32,52 @@ def register():
     if password and not validate_password(password):
         return jsonify({'success': False, 'message': 'Password must be at least 8 characters with letters and numbers'}), 400
     
+    max_samples = current_app.config['FACE_TEMPLATE_MAX_SAMPLES']
+    if len(face_images) > max_samples:
+        return jsonify({'success': False, 'message': f'At most {max_samples} face images are allowed'}), 400
+    
     # Initialize services
-    mongo = PyMongo(current_app)
     auth_service = AuthService(mongo.db)
     
-    # Process face image if provided
-    face_encoding = None
-    if face_image:
+    # Process face images if provided, one enrollment sample each
+    face_encodings = None
+    if face_images:
+        limited = check_rate_limit('face_enroll', mongo.db, email)
+        if limited:
+            return error_response(limited)
+        
         face_service = FaceService(mongo.db)
-        result = face_service.extract_face_encoding(face_image)
+        result = face_service.extract_face_encodings(face_images)
         if not result['success']:
-            return jsonify(result), 400
-        face_encoding = result['face_encoding']
+            return face_error_response(result)
+        face_encodings = result['face_encodings']
     
     # Register user
-    result = auth_service.register_user(email, password, face_encoding)
+    result = auth_service.register_user(email, password, face_encodings)
     
     if not result['success']:
-        return jsonify(result), 400
+        return error_response(result)
     
     return jsonify(result), 201
 
 @auth_bp.route('/login', methods=['POST'])
 def login():
-    data = request.get_json()
+    if password_in_query_string():
+        return jsonify({'success': False, 'message': 'Send the password in a form or JSON body, not the query string'}), 400
+    
+    data, face_image = get_face_payload()
     
     # Initialize services
-    mongo = PyMongo(current_app)
     auth_service = AuthService(mongo.db)
     
     # Login method
     login_method = data.get('method', 'password')
     email = data.get('email')
     
-    if not validate_email(email):
+    # Face login without an email identifies the user from the whole gallery
+    identify = login_method == 'face' and not email
+    
+    if not identify and not validate_email(email):
         return jsonify({'success': False, 'message': 'Invalid email format'}), 400
     
     if login_method == 'password':
@@ -68,28 +88,81 @@ def login():
         result = auth_service.login_with_password(email, password)
     
     elif login_method == 'face':
-        face_image = data.get('faceImage')
         if not face_image:
             return jsonify({'success': False, 'message': 'Face image is required'}), 400
+        
+        # Throttle guessing before spending CPU on the frame
+        limited = check_rate_limit('face_login', mongo.db, email)
+        if limited:
+            count('logins', method='identify' if identify else login_method, result='rate_limited')
+            return error_response(limited)
             
         # Process face image
         face_service = FaceService(mongo.db)
         face_result = face_service.extract_face_encoding(face_image)
         
         if not face_result['success']:
-            return jsonify(face_result), 400
+            return face_error_response(face_result)
             
         face_encoding = face_result['face_encoding']
-        result = auth_service.login_with_face(email, face_encoding)
+        if identify:
+            result = auth_service.identify_with_face(face_encoding)
+        else:
+            result = auth_service.login_with_face(email, face_encoding)
     
     else:
         return jsonify({'success': False, 'message': 'Invalid login method'}), 400
     
+    count('logins', method='identify' if identify else login_method,
+          result='success' if result['success'] else result.get('code', 'failure'))
+    
     if not result['success']:
-        return jsonify(result), 401
+        return error_response(result, 401)
     
     return jsonify(result)
 
+@auth_bp.route('/login/stream', methods=['POST'])
+def login_stream():
+    # A burst of frames for one email, each prefixed with its length as a
+    # 4-byte big-endian integer; the email comes in the query string
+    email = request.args.get('email')
+    
+    if not validate_email(email):
+        return jsonify({'success': False, 'message': 'Invalid email format'}), 400
+    
+    # Every frame costs a token: the first here, the rest as they are read
+    limited = check_rate_limit('face_login_stream', mongo.db, email)
+    if limited:
+        count('logins', method='face_stream', result='rate_limited')
+        return error_response(limited)
+    
+    config = current_app.config
+    frames = FaceFrameStream(
+        request.stream,
+        FaceService(mongo.db),
+        max_frames=config['FACE_STREAM_MAX_FRAMES'],
+        max_frame_bytes=config['FACE_STREAM_MAX_FRAME_BYTES'],
+        read_ahead=config['FACE_STREAM_READ_AHEAD'],
+        admit=lambda: check_rate_limit('face_login_stream', mongo.db, email)
+    )
+    
+    # Stops reading as soon as enough consecutive frames match
+    auth_service = AuthService(mongo.db)
+    try:
+        result = auth_service.login_with_face_frames(email, frames, config['FACE_STREAM_REQUIRED_MATCHES'])
+    except FrameStreamError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        frames.close()
+    
+    stats = frames.stats()
+    count('logins', method='face_stream', result='success' if result['success'] else result.get('code', 'failure'))
+    
+    if not result['success']:
+        return error_response({**result, 'frames': stats}, 401)
+    
+    return jsonify({**result, 'frames': stats})
+
 @auth_bp.route('/forgot-password', methods=['POST'])
 def forgot_password():
     data = request.get_json()
@@ -99,7 +172,6 @@ def forgot_password():
         return jsonify({'success': False, 'message': 'Invalid email format'}), 400
     
     # Initialize services
-    mongo = PyMongo(current_app)
     auth_service = AuthService(mongo.db)
     
     # Generate reset token
@@ -108,7 +180,8 @@ def forgot_password():
     # Send email with reset link
     if result.get('token'):
         reset_url = f"{request.origin}/reset-password?token={result['token']}&email={email}"
-        send_password_reset_email(email, reset_url)
+        with timer('email_queue'):
+            send_password_reset_email(email, reset_url)
     
     # Always return success to prevent email enumeration
     return jsonify({'success': True, 'message': 'If your email is registered, you will receive a password reset link'})
@@ -126,51 +199,40 @@ def reset_password():
         return jsonify({'success': False, 'message': 'Password must be at least 8 characters with letters and numbers'}), 400
     
     # Initialize services
-    mongo = PyMongo(current_app)
     auth_service = AuthService(mongo.db)
     
     # Reset password
     result = auth_service.reset_password(token, new_password)
     
     if not result['success']:
-        return jsonify(result), 400
+        return error_response(result)
     
     return jsonify(result)
 
 @auth_bp.route('/verify-token', methods=['POST'])
+@token_required
 def verify_token():
-    auth_header = request.headers.get('Authorization')
-    
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'success': False, 'message': 'No token provided'}), 401
-    
-    token = auth_header.split(' ')[1]
-    
-    try:
-        # Verify token
-        payload = jwt.decode(
-            token,
-            current_app.config['JWT_SECRET_KEY'],
-            algorithms=['HS256']
-        )
-        
-        # Get user info
-        mongo = PyMongo(current_app)
-        user_data = mongo.db.users.find_one({'_id': payload['sub']})
-        
-        if not user_data:
-            return jsonify({'success': False, 'message': 'User not found'}), 404
-        
-        # Return user info
-        return jsonify({
-            'success': True,
-            'user': {
-                'id': str(user_data['_id']),
-                'email': user_data['email']
-            }
-        })
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({'success': False, 'message': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'success': False, 'message': 'Invalid token'}), 401
\ No newline at end of file
+    # Get user info, cached briefly since this runs on every page navigation
+    with timer('db_read'):
+        user_data = get_token_verifier(current_app.config).find_user(request.user['id'], mongo.db)
+    
+    if not user_data:
+        return jsonify({'success': False, 'message': 'User not found'}), 404
+    
+    # Return user info
+    return jsonify({
+        'success': True,
+        'user': {
+            'id': str(user_data['_id']),
+            'email': user_data['email']
+        }
+    })
+
+@auth_bp.route('/logout', methods=['POST'])
+@token_required
+def logout():
+    # Revoke the token so it stops working before it expires
+    if not get_token_verifier(current_app.config).revoke(request.token_payload, mongo.db):
+        # Issued before tokens carried an id; it stays valid until it expires
+        return jsonify({'success': False, 'message': 'This token cannot be revoked; sign in again to get one that can'}), 400
+    return jsonify({'success': True, 'message': 'Logged out'})
\ No newline at end of file
@@ -1,68 +1,47 @@
 # Face recognition routes
 from flask import Blueprint, request, jsonify, current_app
 from services.face_service import FaceService
-from flask_pymongo import PyMongo
-import jwt
+from extensions import mongo
+from repositories.user_repository import UserRepository
+from utils.auth import token_required
+from utils.uploads import get_face_payload, get_face_uploads
+from utils.responses import error_response, face_error_response
+from services.face_index import best_sample_distance
+from services.face_worker import face_pool_stats
+from services.face_batcher import face_batcher_stats
+from services.encoding_cache import get_face_template, encoding_cache_stats
+from services.frame_cache import frame_cache_stats
+from utils.metrics import timer, count
+from utils.rate_limit import check_rate_limit, rate_limit_stats
 
 face_bp = Blueprint('face', __name__)
 
-# Middleware to verify JWT token
-def token_required(f):
-    def decorated(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'success': False, 'message': 'No token provided'}), 401
-        
-        token = auth_header.split(' ')[1]
-        
-        try:
-            # Verify token
-            payload = jwt.decode(
-                token,
-                current_app.config['JWT_SECRET_KEY'],
-                algorithms=['HS256']
-            )
-            
-            # Add user info to request
-            request.user = {
-                'id': payload['sub'],
-                'email': payload['email']
-            }
-            
-            return f(*args, **kwargs)
-            
-        except jwt.ExpiredSignatureError:
-            return jsonify({'success': False, 'message': 'Token expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'success': False, 'message': 'Invalid token'}), 401
-    
-    # Preserve the original function name
-    decorated.__name__ = f.__name__
-    return decorated
-
 @face_bp.route('/update', methods=['POST'])
 @token_required
 def update_face():
-    data = request.get_json()
-    face_image = data.get('faceImage')
+    _, face_images = get_face_uploads()
     
-    if not face_image:
+    if not face_images:
         return jsonify({'success': False, 'message': 'Face image is required'}), 400
     
+    max_samples = current_app.config['FACE_TEMPLATE_MAX_SAMPLES']
+    if len(face_images) > max_samples:
+        return jsonify({'success': False, 'message': f'At most {max_samples} face images are allowed'}), 400
+    
+    limited = check_rate_limit('face_enroll', mongo.db, request.user['email'])
+    if limited:
+        return error_response(limited)
+    
     # Initialize services
-    mongo = PyMongo(current_app)
     face_service = FaceService(mongo.db)
     
-    # Extract face encoding
-    result = face_service.extract_face_encoding(face_image)
+    # Extract one encoding per enrollment image
+    result = face_service.extract_face_encodings(face_images)
     if not result['success']:
-        return jsonify(result), 400
-    
-    face_encoding = result['face_encoding']
+        return face_error_response(result)
     
-    # Update face encoding
-    update_result = face_service.update_face_encoding(request.user['email'], face_encoding)
+    # Replace the stored face samples
+    update_result = face_service.update_face_encoding(request.user['email'], result['face_encodings'])
     
     if not update_result['success']:
         return jsonify(update_result), 400
@@ -73,7 +52,6 @@ def update_face():
 @token_required
 def delete_face():
     # Initialize services
-    mongo = PyMongo(current_app)
     face_service = FaceService(mongo.db)
     
     # Delete face encoding
@@ -86,39 +64,53 @@ def delete_face():
 
 @face_bp.route('/verify', methods=['POST'])
 def verify_face():
-    data = request.get_json()
+    data, face_image = get_face_payload()
     email = data.get('email')
-    face_image = data.get('faceImage')
     
     if not email or not face_image:
         return jsonify({'success': False, 'message': 'Email and face image are required'}), 400
     
+    limited = check_rate_limit('face_verify', mongo.db, email)
+    if limited:
+        return error_response(limited)
+    
     # Initialize services
-    mongo = PyMongo(current_app)
     face_service = FaceService(mongo.db)
     
     # Extract face encoding
     result = face_service.extract_face_encoding(face_image)
     if not result['success']:
-        return jsonify(result), 400
+        return face_error_response(result)
     
     face_encoding = result['face_encoding']
     
-    # Find user
-    user_data = mongo.db.users.find_one({'email': email})
-    if not user_data or 'face_encoding' not in user_data:
+    # Find user's stored encoding, from the cache on repeat verifications
+    with timer('template_read'):
+        template = get_face_template(UserRepository(mongo.db), email)
+    if template is None:
         return jsonify({'success': False, 'message': 'User not found or face not registered'}), 404
     
-    # Compare faces
-    import face_recognition
-    import numpy as np
-    
-    stored_encoding = np.array(user_data['face_encoding'])
-    tolerance = current_app.config['FACE_RECOGNITION_TOLERANCE']
-    
-    match = face_recognition.compare_faces([stored_encoding], face_encoding, tolerance=tolerance)[0]
+    # Compare against every enrolled sample at once and keep the best
+    with timer('compare'):
+        distance = best_sample_distance(template['face_samples'], face_encoding)
+    match = distance <= current_app.config['FACE_RECOGNITION_TOLERANCE']
+    count('face_matches', mode='verify', result='match' if match else 'no_match')
     
     return jsonify({
         'success': True,
-        'match': bool(match)
+        'match': match
+    })
+
+@face_bp.route('/stats', methods=['GET'])
+@token_required
+def face_stats():
+    # Queue depth, job and cache counters of the face pipeline, for
+    # monitoring; they reveal load and cache contents, so not anonymously
+    return jsonify({
+        'success': True,
+        'worker_pool': face_pool_stats(),
+        'batcher': face_batcher_stats(),
+        'encoding_cache': encoding_cache_stats(),
+        'frame_cache': frame_cache_stats(),
+        **rate_limit_stats()
     })
\ No newline at end of file
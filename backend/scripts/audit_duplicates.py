@@ -0,0 +1,240 @@
+# Duplicate face audit
+# Finds accounts enrolled with the same face. Every user's face centroid is
+# streamed from MongoDB into one float32 matrix (512 bytes per user), then
+# all pairs are compared in square blocks of matrix products, one row of
+# blocks per worker thread. The block size is derived from --memory-mb, so
+# the working set beyond the gallery itself stays fixed however large the
+# gallery grows. Pairs closer than the tolerance are joined into clusters
+# and written as JSON or CSV.
+#
+# Usage (from the backend directory):
+#   python -m scripts.audit_duplicates --output duplicates.json
+#   python -m scripts.audit_duplicates --format csv --output duplicates.csv --memory-mb 512
+#   python -m scripts.audit_duplicates --synthetic 1000000 --output /dev/null
+import os
+
+# One BLAS thread per worker; the workers already use every core
+for _variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_variable, '1')
+
+import argparse
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from bson import ObjectId
+from pymongo import MongoClient
+from config import Config
+from repositories.encoding_format import ENCODING_SIZE, decode_face_centroid
+from repositories.user_repository import UserRepository
+from utils.process_info import peak_memory_bytes
+
+# Bytes of working memory per block cell: the float32 distances and the
+# boolean match mask
+BLOCK_CELL_BYTES = 5
+
+# User ids are kept as raw 12-byte ObjectIds, one row each
+OBJECT_ID_SIZE = 12
+
+def object_id(ids, row):
+    return ObjectId(ids[row].tobytes())
+
+def read_centroids(db, batch_size):
+    """
+    Stream every enrolled user's centroid into parallel id and vector arrays
+    """
+    capacity = max(db.users.count_documents({'face_encoding': {'$exists': True}}), 1)
+    ids = np.empty((capacity, OBJECT_ID_SIZE), dtype=np.uint8)
+    vectors = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+
+    size = 0
+    for user_data in UserRepository(db).iter_face_encodings(batch_size):
+        # Users enrolled while the audit reads the gallery
+        if size == len(ids):
+            ids = np.resize(ids, (size * 2, OBJECT_ID_SIZE))
+            vectors = np.resize(vectors, (size * 2, ENCODING_SIZE))
+        ids[size] = np.frombuffer(user_data['_id'].binary, dtype=np.uint8)
+        vectors[size] = decode_face_centroid(user_data)
+        size += 1
+
+    return ids[:size], vectors[:size]
+
+def synthetic_gallery(size, duplicates, seed=0):
+    """
+    A random gallery of `size` users in which `duplicates` users re-enrolled
+    under a second account with a slightly different encoding
+    """
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(0, 0.1, (size, ENCODING_SIZE)).astype(np.float32)
+    originals = rng.choice(size - duplicates, duplicates, replace=False)
+    vectors[size - duplicates:] = vectors[originals] + rng.normal(0, 0.01, (duplicates, ENCODING_SIZE))
+    ids = np.frombuffer(b''.join(ObjectId().binary for _ in range(size)), dtype=np.uint8)
+    return ids.reshape(size, OBJECT_ID_SIZE), vectors
+
+def block_size_for(memory_mb, workers):
+    """
+    The largest block, in rows, whose working set fits the memory budget
+    across all workers
+    """
+    cells = memory_mb * 2 ** 20 / (workers * BLOCK_CELL_BYTES)
+    return max(256, int(np.sqrt(cells)) // 256 * 256)
+
+def find_close_pairs(vectors, tolerance, block_size, workers, progress_interval=10.0):
+    """
+    Return (rows, cols, distances) of every pair of distinct users closer
+    than `tolerance`, with rows < cols
+    """
+    n = len(vectors)
+    sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+    limit = np.float32(tolerance * tolerance)
+
+    def scan(start):
+        # Compare one row of blocks against itself and every block after it
+        stop = min(start + block_size, n)
+        block = vectors[start:stop]
+        found = []
+        for other in range(start, n, block_size):
+            other_stop = min(other + block_size, n)
+            # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2, updated in place
+            sq_distances = block @ vectors[other:other_stop].T
+            sq_distances *= -2.0
+            sq_distances += sq_norms[start:stop, None]
+            sq_distances += sq_norms[None, other:other_stop]
+
+            rows, cols = np.nonzero(sq_distances <= limit)
+            if other == start:
+                upper = rows < cols
+                rows, cols = rows[upper], cols[upper]
+            if len(rows):
+                distances = np.sqrt(np.maximum(sq_distances[rows, cols], 0.0))
+                found.append((rows + start, cols + other, distances))
+        return found
+
+    starts = range(0, n, block_size)
+    # Work in a row of blocks shrinks towards the end of the gallery
+    total_work = sum(n - start for start in starts) or 1
+    done_work = 0
+    last_report = began = time.perf_counter()
+
+    found = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(scan, start): start for start in starts}
+        for future in as_completed(futures):
+            found += future.result()
+            done_work += n - futures[future]
+            if time.perf_counter() - last_report >= progress_interval:
+                last_report = time.perf_counter()
+                elapsed = last_report - began
+                print(f'{done_work / total_work:6.1%} of pairs compared in {elapsed:.0f}s, '
+                      f'{sum(len(rows) for rows, _, _ in found)} close pairs so far')
+
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    rows, cols, distances = (np.concatenate(parts) for parts in zip(*found))
+    return rows, cols, distances
+
+def cluster_pairs(rows, cols, distances):
+    """
+    Join close pairs into clusters of accounts. Returns lists of row
+    numbers, each with the largest pair distance inside the cluster.
+    """
+    parent = {}
+
+    def find(row):
+        parent.setdefault(row, row)
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        root_row, root_col = find(row), find(col)
+        if root_row != root_col:
+            parent[root_col] = root_row
+
+    members = {}
+    for row in parent:
+        members.setdefault(find(row), []).append(row)
+    max_distance = {}
+    for row, distance in zip(rows.tolist(), distances.tolist()):
+        root = find(row)
+        max_distance[root] = max(max_distance.get(root, 0.0), distance)
+
+    clusters = [(sorted(rows_in_cluster), max_distance[root]) for root, rows_in_cluster in members.items()]
+    clusters.sort(key=lambda cluster: (-len(cluster[0]), cluster[1]))
+    return clusters
+
+def lookup_emails(db, user_ids, chunk_size=1000):
+    emails = {}
+    for i in range(0, len(user_ids), chunk_size):
+        for user_data in db.users.find({'_id': {'$in': user_ids[i:i + chunk_size]}}, {'email': 1}):
+            emails[user_data['_id']] = user_data['email']
+    return emails
+
+def write_clusters(path, output_format, clusters, ids, emails):
+    with open(path, 'w', newline='') as f:
+        if output_format == 'json':
+            json.dump([
+                {
+                    'max_distance': round(max_distance, 4),
+                    'users': [{'user_id': str(object_id(ids, row)),
+                               'email': emails.get(object_id(ids, row))} for row in rows]
+                }
+                for rows, max_distance in clusters
+            ], f, indent=2)
+            return
+
+        writer = csv.writer(f)
+        writer.writerow(['cluster', 'user_id', 'email', 'max_distance'])
+        for number, (rows, max_distance) in enumerate(clusters, 1):
+            for row in rows:
+                user_id = object_id(ids, row)
+                writer.writerow([number, str(user_id), emails.get(user_id, ''), f'{max_distance:.4f}'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Find accounts enrolled with the same face')
+    parser.add_argument('--uri', default=Config.MONGO_URI)
+    parser.add_argument('--output', required=True, help='Where to write the clusters')
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--tolerance', type=float, default=Config.FACE_RECOGNITION_TOLERANCE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--memory-mb', type=int, default=256,
+                        help='Working memory for distance blocks, on top of the gallery itself')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Cursor batch size when reading the gallery')
+    parser.add_argument('--synthetic', type=int, metavar='USERS',
+                        help='Audit a random gallery of this many users instead of MongoDB')
+    parser.add_argument('--synthetic-duplicates', type=int, default=100)
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    db = None
+    if args.synthetic:
+        ids, vectors = synthetic_gallery(args.synthetic, args.synthetic_duplicates)
+    else:
+        db = MongoClient(args.uri).get_default_database()
+        ids, vectors = read_centroids(db, args.batch_size)
+    read_seconds = time.perf_counter() - began
+
+    block_size = block_size_for(args.memory_mb, args.workers)
+    print(f'{len(ids)} users read in {read_seconds:.1f}s ({vectors.nbytes / 2 ** 20:.0f}MB); '
+          f'comparing in blocks of {block_size} rows on {args.workers} workers')
+
+    rows, cols, distances = find_close_pairs(vectors, args.tolerance, block_size, args.workers)
+    clusters = cluster_pairs(rows, cols, distances)
+    compare_seconds = time.perf_counter() - began - read_seconds
+
+    emails = {}
+    if db is not None:
+        emails = lookup_emails(db, [object_id(ids, row) for cluster_rows, _ in clusters for row in cluster_rows])
+    write_clusters(args.output, args.format, clusters, ids, emails)
+
+    pair_count = len(ids) * (len(ids) - 1) // 2
+    print(f'{len(rows)} close pairs in {len(clusters)} clusters '
+          f'({sum(len(cluster_rows) for cluster_rows, _ in clusters)} accounts) written to {args.output}')
+    print(f'Runtime {time.perf_counter() - began:.1f}s (read {read_seconds:.1f}s, compare {compare_seconds:.1f}s, '
+          f'{pair_count / max(compare_seconds, 1e-9) / 1e6:.0f}M pairs/s), '
+          f'peak memory {peak_memory_bytes() / 2 ** 20:.0f}MB')
+
+if __name__ == '__main__':
+    main()
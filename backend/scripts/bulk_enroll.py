@@ -0,0 +1,304 @@
+# Bulk face enrollment
+# Registers face-only users from a directory of photos or a CSV manifest.
+# Encodings are extracted on every core with a process pool running the
+# same pipeline as FaceService, and users are inserted with unordered
+# bulk writes. Finished emails are appended to a checkpoint file, so an
+# interrupted import picks up where it stopped; users whose images all
+# failed are not checkpointed and are retried on the next run.
+#
+# With FACE_INDEX_BACKEND=shared every inserted user is appended to the
+# shared index's delta log, so running workers can identify them at their
+# next sync, and the log is compacted at the end if it grew past
+# FACE_SHARED_INDEX_COMPACT_RECORDS. The per-worker 'exact' and 'ivf'
+# indexes pick the new users up at their next sync, at most
+# FACE_INDEX_SYNC_INTERVAL seconds later.
+#
+# Input layouts:
+#   --directory photos/    photos/alice@example.com.jpg, or several images
+#                          in photos/alice@example.com/
+#   --manifest people.csv  header "email,image", one row per image; image
+#                          paths are relative to the manifest
+#
+# Usage (from the backend directory):
+#   python -m scripts.bulk_enroll --directory photos --report failures.csv
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pymongo import InsertOne, MongoClient
+from pymongo.errors import BulkWriteError
+from config import Config
+from repositories.encoding_format import decode_face_centroid
+from repositories.indexes import ensure_indexes
+from services.auth_service import new_user_document
+from services.face_pipeline import extract_encoding
+from services.face_service import face_settings
+from services.shared_face_index import ADD, append_deltas, compact
+from services.face_worker import _init_worker
+from utils.validators import validate_email
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DUPLICATE_KEY = 11000
+
+def load_directory(directory):
+    """
+    Return {email: [image paths]} for a directory of photos
+    """
+    jobs = OrderedDict()
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            images = [os.path.join(path, image) for image in sorted(os.listdir(path))
+                      if image.lower().endswith(IMAGE_EXTENSIONS)]
+            if images:
+                jobs.setdefault(name, []).extend(images)
+        elif name.lower().endswith(IMAGE_EXTENSIONS):
+            jobs.setdefault(os.path.splitext(name)[0], []).append(path)
+    return jobs
+
+def load_manifest(manifest):
+    """
+    Return {email: [image paths]} for a CSV manifest
+    """
+    base = os.path.dirname(os.path.abspath(manifest))
+    jobs = OrderedDict()
+    with open(manifest, newline='') as f:
+        for row in csv.DictReader(f):
+            email = row['email'].strip()
+            jobs.setdefault(email, []).append(os.path.join(base, row['image'].strip()))
+    return jobs
+
+def read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return {line.strip() for line in f if line.strip()}
+    return set()
+
+def append_checkpoint(path, emails):
+    if path and emails:
+        with open(path, 'a') as f:
+            f.writelines(f'{email}\n' for email in emails)
+            f.flush()
+            os.fsync(f.fileno())
+
+def extract_file(path, settings):
+    """
+    Extract the encoding of one image file; runs in a worker process
+    """
+    try:
+        with open(path, 'rb') as f:
+            face_image = f.read()
+    except OSError as e:
+        return {'success': False, 'code': 'unreadable', 'message': str(e)}
+
+    result = extract_encoding(face_image, settings)
+    result.pop('timings', None)
+    return result
+
+class BulkEnroller:
+    """
+    Feeds images to the process pool, groups the encodings per user and
+    writes finished users in batches
+    """
+    def __init__(self, db, settings, workers, batch_size, max_samples, checkpoint=None,
+                 start_method=None, progress_interval=5.0, shared_index_path=None):
+        self.db = db
+        self.shared_index_path = shared_index_path
+        self.delta_records = 0
+        self.settings = settings
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+        self.checkpoint = checkpoint
+        self.start_method = start_method
+        self.progress_interval = progress_interval
+        self.failures = []
+        self.enrolled = 0
+        self.existing = 0
+        self.images_done = 0
+        self.images_total = 0
+        self._batch = []
+        self._encodings = {}
+        self._remaining = {}
+        self.start = self._last_report = time.perf_counter()
+
+    def run(self, jobs):
+        done = read_checkpoint(self.checkpoint)
+        jobs = OrderedDict((email, paths) for email, paths in jobs.items() if email not in done)
+        for email in [email for email in jobs if not validate_email(email)]:
+            self._fail(email, None, 'invalid_email', 'Not a valid email address')
+            del jobs[email]
+
+        # Users registered earlier, for example through the API, cost no extraction
+        existing = self._existing_emails(list(jobs))
+        for email in existing:
+            del jobs[email]
+        self.existing += len(existing)
+        append_checkpoint(self.checkpoint, existing)
+
+        self.images_total = sum(len(paths) for paths in jobs.values())
+        print(f'{len(jobs)} users and {self.images_total} images to enroll '
+              f'({len(done)} already checkpointed, {len(existing)} already registered)')
+
+        tasks = ((email, path) for email, paths in jobs.items() for path in paths)
+        self._remaining = {email: len(paths) for email, paths in jobs.items()}
+        self.start = self._last_report = time.perf_counter()
+
+        context = multiprocessing.get_context(self.start_method)
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker) as executor:
+            # Enough images in flight to keep every worker busy, without
+            # queueing the whole import in memory
+            in_flight = {}
+            for email, path in tasks:
+                if len(in_flight) >= self.workers * 4:
+                    self._collect(in_flight, wait(in_flight, return_when=FIRST_COMPLETED).done)
+                in_flight[executor.submit(extract_file, path, self.settings)] = (email, path)
+            while in_flight:
+                self._collect(in_flight, wait(in_flight, return_when=FIRST_COMPLETED).done)
+
+        self._flush()
+        self._report_progress(final=True)
+
+    def _existing_emails(self, emails, chunk_size=1000):
+        existing = []
+        for i in range(0, len(emails), chunk_size):
+            existing += [user['email'] for user in
+                         self.db.users.find({'email': {'$in': emails[i:i + chunk_size]}}, {'email': 1, '_id': 0})]
+        return existing
+
+    def _collect(self, in_flight, finished):
+        for future in finished:
+            email, path = in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'success': False, 'code': 'error', 'message': str(e)}
+
+            self.images_done += 1
+            if result['success']:
+                self._encodings.setdefault(email, []).append(result['face_encoding'])
+            else:
+                self._fail(email, path, result.get('code', 'error'), result['message'])
+
+            self._remaining[email] -= 1
+            if not self._remaining[email]:
+                del self._remaining[email]
+                self._finish_user(email)
+
+        if time.perf_counter() - self._last_report >= self.progress_interval:
+            self._report_progress()
+
+    def _finish_user(self, email):
+        face_encodings = self._encodings.pop(email, None)
+        if not face_encodings:
+            self._fail(email, None, 'no_usable_image', 'None of the images could be enrolled')
+            return
+
+        self._batch.append((email, new_user_document(email, face_encodings=face_encodings,
+                                                     max_samples=self.max_samples)))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+
+        try:
+            result = self.db.users.bulk_write([InsertOne(user_dict) for _, user_dict in batch], ordered=False)
+            inserted = result.inserted_count
+            errors = []
+        except BulkWriteError as e:
+            inserted = e.details['nInserted']
+            errors = e.details['writeErrors']
+
+        self.enrolled += inserted
+        self._log_inserted(batch, {error['index'] for error in errors})
+        # Duplicates were registered concurrently and count as done; any
+        # other failed insert is retried on the next run
+        retry = set()
+        for error in errors:
+            email = batch[error['index']][0]
+            if error['code'] == DUPLICATE_KEY:
+                self.existing += 1
+            else:
+                self._fail(email, None, 'write_error', error['errmsg'])
+                retry.add(email)
+        append_checkpoint(self.checkpoint, [email for email, _ in batch if email not in retry])
+
+    def _log_inserted(self, batch, failed):
+        # insert_one style writes fill in each document's _id
+        if not self.shared_index_path:
+            return
+        changes = [(ADD, str(user_dict['_id']), decode_face_centroid(user_dict))
+                   for number, (_, user_dict) in enumerate(batch) if number not in failed]
+        if changes:
+            self.delta_records = append_deltas(self.shared_index_path, changes) or 0
+
+    def _fail(self, email, path, code, message):
+        self.failures.append({'email': email, 'image': path or '', 'code': code, 'message': message})
+
+    def _report_progress(self, final=False):
+        now = time.perf_counter()
+        self._last_report = now
+        elapsed = now - self.start
+        rate = self.images_done / elapsed if elapsed else 0.0
+        print(f"{'Done: ' if final else ''}{self.images_done}/{self.images_total} images "
+              f"({rate:.1f} images/s), {self.enrolled} users enrolled, "
+              f"{self.existing} already registered, {len(self.failures)} failures")
+
+def write_report(path, failures):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['email', 'image', 'code', 'message'])
+        writer.writeheader()
+        writer.writerows(failures)
+
+def main():
+    parser = argparse.ArgumentParser(description='Register face-only users from a photo directory or CSV manifest')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--directory', help='Directory of <email>.jpg files or <email>/ subdirectories')
+    source.add_argument('--manifest', help='CSV file with "email" and "image" columns')
+    parser.add_argument('--uri', default=Config.MONGO_URI)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=500, help='Users per bulk write')
+    parser.add_argument('--checkpoint', default='bulk_enroll.checkpoint',
+                        help='File listing finished emails; empty string disables it')
+    parser.add_argument('--report', help='Write per-image failures as CSV to this path')
+    parser.add_argument('--start-method', default=Config.FACE_WORKER_START_METHOD)
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='Seconds between progress lines')
+    args = parser.parse_args()
+
+    jobs = load_directory(args.directory) if args.directory else load_manifest(args.manifest)
+    config = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+
+    db = MongoClient(args.uri).get_default_database()
+    # The unique email index is what makes concurrent or repeated imports safe
+    for name in ensure_indexes(db):
+        print(f'WARNING: could not create index {name}')
+
+    enroller = BulkEnroller(
+        db,
+        face_settings(config, purpose='enrollment'),
+        workers=args.workers,
+        batch_size=args.batch_size,
+        max_samples=Config.FACE_TEMPLATE_MAX_SAMPLES,
+        checkpoint=args.checkpoint or None,
+        start_method=args.start_method,
+        progress_interval=args.progress_interval,
+        shared_index_path=Config.FACE_SHARED_INDEX_PATH if Config.FACE_INDEX_BACKEND == 'shared' else None
+    )
+    enroller.run(jobs)
+    if enroller.delta_records >= Config.FACE_SHARED_INDEX_COMPACT_RECORDS:
+        print(f'Compacting the shared face index ({enroller.delta_records} logged changes)')
+        compact(Config.FACE_SHARED_INDEX_PATH)
+
+    for code in sorted({failure['code'] for failure in enroller.failures}):
+        print(f"  {code}: {sum(failure['code'] == code for failure in enroller.failures)}")
+    if args.report:
+        write_report(args.report, enroller.failures)
+
+if __name__ == '__main__':
+    main()
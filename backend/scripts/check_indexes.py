@@ -0,0 +1,34 @@
+# Index check
+# Creates any missing indexes, then explains every hot query and exits
+# non-zero if one of them would scan a whole collection.
+#
+# Usage (from the backend directory):
+#   python -m scripts.check_indexes --uri mongodb://localhost:27017/faceauth
+import argparse
+import sys
+from pymongo import MongoClient
+from config import Config
+from repositories.indexes import ensure_indexes, explain_hot_queries
+
+def main():
+    parser = argparse.ArgumentParser(description='Create and verify the indexes behind hot queries')
+    parser.add_argument('--uri', default=Config.MONGO_URI)
+    parser.add_argument('--no-create', action='store_true', help='Only explain, do not create indexes')
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri).get_default_database()
+    failed = [] if args.no_create else ensure_indexes(db)
+    for name in failed:
+        print(f'FAILED to create {name}')
+
+    report = explain_hot_queries(db)
+    for row in report:
+        status = 'ok  ' if row['uses_index'] else 'SCAN'
+        print(f"{status} {row['query']:<20} {row['collection']:<16} index {row['index']} "
+              f"plan {' > '.join(row['stages'])}")
+
+    if failed or not all(row['uses_index'] for row in report):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Face encoding storage migration
+# Rewrites legacy list-of-doubles encodings into the binary float32 format.
+# Safe to stop and rerun: only documents still holding an array are
+# touched, and the last migrated _id is checkpointed between batches.
+#
+# Password login tells whether a user has a face from the format marker
+# this adds (see CREDENTIALS_PROJECTION), so run the migration to the end
+# before deploying that; --dry-run counts the documents still to convert.
+#
+# Usage (from the backend directory):
+#   python -m scripts.migrate_face_encodings --batch-size 1000
+import argparse
+import os
+import time
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+from config import Config
+from repositories.encoding_format import encode_face_encoding
+
+def read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            value = f.read().strip()
+            return ObjectId(value) if value else None
+    return None
+
+def write_checkpoint(path, last_id):
+    if path:
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(last_id))
+        os.replace(path + '.tmp', path)
+
+def migrate(db, batch_size, checkpoint=None, dry_run=False):
+    """
+    Convert every legacy encoding, one bulk_write per batch
+    """
+    last_id = read_checkpoint(checkpoint)
+    migrated = 0
+    start = time.perf_counter()
+
+    while True:
+        query = {'face_encoding': {'$type': 'array'}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+
+        batch = list(
+            db.users.find(query, {'face_encoding': 1})
+            .sort('_id', 1)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+
+        # Filtering on the array type again leaves documents alone if the
+        # user replaced or removed their face since the batch was read
+        requests = [
+            UpdateOne(
+                {'_id': user_data['_id'], 'face_encoding': {'$type': 'array'}},
+                {'$set': encode_face_encoding(user_data['face_encoding'])}
+            )
+            for user_data in batch
+        ]
+
+        if not dry_run:
+            result = db.users.bulk_write(requests, ordered=False)
+            migrated += result.modified_count
+        else:
+            migrated += len(requests)
+
+        last_id = batch[-1]['_id']
+        if not dry_run:
+            write_checkpoint(checkpoint, last_id)
+
+        elapsed = time.perf_counter() - start
+        print(f'{migrated} documents migrated ({migrated / elapsed:.0f}/s), last _id {last_id}')
+
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate face encodings to the binary float32 format')
+    parser.add_argument('--uri', default=Config.MONGO_URI)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--checkpoint', default='migrate_face_encodings.checkpoint',
+                        help='File recording the last migrated _id; empty string disables it')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    migrated = migrate(client.get_default_database(), args.batch_size, args.checkpoint or None, args.dry_run)
+    print(f'Done: {migrated} documents migrated')
+
+    if args.checkpoint and not args.dry_run and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+if __name__ == '__main__':
+    main()
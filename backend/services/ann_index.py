@@ -0,0 +1,202 @@
+# Approximate nearest-neighbour face index
+import threading
+import numpy as np
+from repositories.encoding_format import ENCODING_SIZE
+from services.face_index import FaceIndex, read_gallery
+
+# k-means needs a few dozen points per centroid to produce useful cells
+MIN_POINTS_PER_LIST = 39
+
+class IVFFaceIndex:
+    """
+    Inverted-file index for very large face galleries.
+
+    A k-means coarse quantizer splits the gallery into `nlist` cells, each
+    stored as its own FaceIndex. A probe is only compared against the
+    `nprobe` cells whose centroids are closest to it, trading a little
+    recall for a search cost that no longer grows with the whole gallery.
+    Passing the `centroids` of an earlier index skips k-means on the next
+    build, as long as the gallery still calls for that many cells.
+    """
+    def __init__(self, nlist=1024, nprobe=16, train_size=65536, kmeans_iterations=20, seed=0, centroids=None):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self._lock = threading.RLock()
+        self._centroids = None
+        self._initial_centroids = centroids
+        self._lists = [FaceIndex(capacity=16)]
+        self._where = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._where)
+
+    @property
+    def is_trained(self):
+        return self._centroids is not None
+
+    def load(self, db):
+        """
+        Train the quantizer and build the index from the users collection
+        """
+        with self._lock:
+            ids, vectors = read_gallery(db)
+            self.build(ids, vectors)
+            self.loaded = True
+
+    def build(self, ids, vectors):
+        """
+        Index all of the given encodings, training the quantizer on them
+        unless the current one already has the right number of cells
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+        with self._lock:
+            nlist = min(self.nlist, len(ids) // MIN_POINTS_PER_LIST)
+            if nlist < 2:
+                self._centroids = None
+                self._fill(ids, vectors, np.zeros(len(ids), dtype=np.int64), 1)
+                return
+
+            centroids = self._centroids if self.is_trained else self._initial_centroids
+            if centroids is not None and len(centroids) == nlist:
+                self._centroids = centroids
+            else:
+                self._centroids = self._train(vectors, nlist)
+            self._fill(ids, vectors, self._assign(vectors), nlist)
+
+    def add(self, user_id, face_encoding):
+        """
+        Insert or replace the encoding stored for a user
+        """
+        vector = np.asarray(face_encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+
+        with self._lock:
+            list_no = int(self._assign(vector[None, :])[0]) if self.is_trained else 0
+
+            current = self._where.get(user_id)
+            if current is not None and current != list_no:
+                self._lists[current].remove(user_id)
+
+            self._lists[list_no].add(user_id, vector)
+            self._where[user_id] = list_no
+
+    def remove(self, user_id):
+        """
+        Drop a user's encoding from its cell
+        """
+        with self._lock:
+            list_no = self._where.pop(user_id, None)
+            if list_no is None:
+                return False
+            return self._lists[list_no].remove(user_id)
+
+    def search(self, probe, k=1, nprobe=None):
+        """
+        Return up to k (user_id, distance) pairs from the closest cells
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(ENCODING_SIZE)
+        nprobe = nprobe or self.nprobe
+
+        with self._lock:
+            if self.is_trained and nprobe < len(self._lists):
+                distances = np.sum((self._centroids - probe) ** 2, axis=1)
+                cells = np.argpartition(distances, nprobe - 1)[:nprobe]
+            else:
+                cells = range(len(self._lists))
+
+            candidates = []
+            for list_no in cells:
+                candidates.extend(self._lists[list_no].search(probe, k))
+
+        candidates.sort(key=lambda match: match[1])
+        return candidates[:k]
+
+    def save(self, path):
+        """
+        Write the quantizer and all indexed encodings to an .npz file
+        """
+        with self._lock:
+            ids = []
+            vectors = []
+            for index in self._lists:
+                n = len(index)
+                ids.extend(index._ids[:n])
+                vectors.append(index._vectors[:n])
+
+            np.savez(
+                path,
+                centroids=self._centroids if self.is_trained else np.empty((0, ENCODING_SIZE), dtype=np.float32),
+                ids=np.array(ids, dtype=str),
+                vectors=np.concatenate(vectors) if vectors else np.empty((0, ENCODING_SIZE), dtype=np.float32)
+            )
+
+    def load_file(self, path):
+        """
+        Restore the state written by save() without retraining the quantizer
+        """
+        state = np.load(path)
+        ids = state['ids'].tolist()
+        vectors = state['vectors']
+
+        with self._lock:
+            if len(state['centroids']):
+                self._centroids = state['centroids']
+                self._fill(ids, vectors, self._assign(vectors), len(self._centroids))
+            else:
+                self._centroids = None
+                self._fill(ids, vectors, np.zeros(len(ids), dtype=np.int64), 1)
+            self.loaded = True
+
+    def _fill(self, ids, vectors, assignments, nlist):
+        ids = np.asarray(ids, dtype=object)
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+
+        self._lists = []
+        for list_no in range(nlist):
+            rows = order[bounds[list_no]:bounds[list_no + 1]]
+            index = FaceIndex(capacity=max(16, len(rows)))
+            index.build(ids[rows].tolist(), vectors[rows])
+            self._lists.append(index)
+
+        self._where = {user_id: int(list_no) for user_id, list_no in zip(ids, assignments)}
+
+    def _assign(self, vectors, chunk_size=8192):
+        centroid_sq_norms = np.einsum('ij,ij->i', self._centroids, self._centroids)
+        assignments = np.empty(len(vectors), dtype=np.int64)
+
+        # Chunked so the distance matrix stays small for million-row galleries
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            scores = centroid_sq_norms - 2.0 * (chunk @ self._centroids.T)
+            assignments[start:start + chunk_size] = np.argmin(scores, axis=1)
+
+        return assignments
+
+    def _train(self, vectors, nlist):
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.train_size:
+            vectors = vectors[rng.choice(len(vectors), self.train_size, replace=False)]
+
+        self._centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            assignments = self._assign(vectors)
+            order = np.argsort(assignments, kind='stable')
+            counts = np.bincount(assignments, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+            filled = counts > 0
+            sums = np.add.reduceat(vectors[order], starts[filled], axis=0)
+            self._centroids[filled] = sums / counts[filled, None]
+
+            # Reseed empty cells from random training points
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                self._centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        return self._centroids
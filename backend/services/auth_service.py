@@ -2,93 +2,219 @@
 import secrets
 import datetime
 import jwt
+import numpy as np
 from flask import current_app
 from models.user import User
-from werkzeug.security import generate_password_hash
-import numpy as np
+from repositories.encoding_format import ENCODING_SIZE, encode_face_samples, decode_face_samples, decode_face_centroid
+from repositories.user_repository import UserRepository
+from repositories.password_reset_repository import PasswordResetRepository
+from services.encoding_cache import get_face_template
+from services.face_index import get_face_index, update_face_index, best_sample_distance
+from services.face_service import FaceService
+from services.password_hasher import get_password_hasher, PasswordHasherBusy
+from utils.metrics import timer, count
+
+def new_user_document(email, password_hash=None, face_encodings=None, max_samples=None):
+    """
+    Build the document stored for a new user. Face encodings are kept as
+    the last `max_samples` samples plus their centroid, in the compact
+    binary format.
+    """
+    user = User(email=email, password_hash=password_hash, face_encoding=face_encodings)
+    
+    user_dict = {
+        'email': user.email,
+        'password_hash': user.password_hash,
+        'created_at': datetime.datetime.utcnow()
+    }
+    
+    if face_encodings is not None:
+        face_samples = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if max_samples:
+            face_samples = face_samples[-max_samples:]
+        user_dict.update(encode_face_samples(face_samples))
+        user_dict['face_updated_at'] = user_dict['created_at']
+    
+    return user_dict
 
 class AuthService:
     def __init__(self, db):
         self.db = db
+        self.users = UserRepository(db)
+        self.resets = PasswordResetRepository(db)
     
-    def register_user(self, email, password=None, face_encoding=None):
+    def register_user(self, email, password=None, face_encodings=None):
         # Check if user already exists
-        existing_user = self.db.users.find_one({'email': email})
-        if existing_user:
+        if self.users.email_exists(email):
             return {'success': False, 'message': 'Email already registered'}
         
         # At least one authentication method is required
-        if not password and face_encoding is None:
+        if not password and face_encodings is None:
             return {'success': False, 'message': 'Password or face encoding is required'}
 
         # Create new user
-        user = User(email=email, password=password, face_encoding=face_encoding)
-        
-        # Convert face_encoding from numpy array to list if present
-        user_dict = {
-            'email': user.email,
-            'password_hash': user.password_hash,
-            'face_encoding': user.face_encoding.tolist() if isinstance(user.face_encoding, np.ndarray) else user.face_encoding,
-            'created_at': datetime.datetime.utcnow()
-        }
+        try:
+            password_hash = self._hasher().hash(password) if password else None
+        except PasswordHasherBusy:
+            return self._busy()
+        
+        user_dict = new_user_document(email, password_hash, face_encodings,
+                                      current_app.config['FACE_TEMPLATE_MAX_SAMPLES'])
+        
+        with timer('db_write'):
+            user_id = self.users.insert(user_dict)
         
-        result = self.db.users.insert_one(user_dict)
-        return {'success': True, 'user_id': str(result.inserted_id)}
+        if face_encodings is not None:
+            update_face_index(str(user_id), decode_face_centroid(user_dict))
+        
+        return {'success': True, 'user_id': str(user_id)}
     
     def login_with_password(self, email, password):
-        user_data = self.db.users.find_one({'email': email})
+        with timer('db_read'):
+            user_data = self.users.find_credentials(email)
         if not user_data or not user_data.get('password_hash'):
             return {'success': False, 'message': 'Invalid email or password'}
         
         user = User.from_dict(user_data)
-        if not user.check_password(password):
-            return {'success': False, 'message': 'Invalid email or password'}
+        hasher = self._hasher()
+        try:
+            if not hasher.verify(user.password_hash, password):
+                return {'success': False, 'message': 'Invalid email or password'}
+            
+            # Upgrade a hash made with an older method or iteration count
+            # while the plaintext is at hand
+            if hasher.needs_rehash(user.password_hash):
+                self.users.upgrade_password_hash(user_data['_id'], user.password_hash, hasher.hash(password))
+                hasher.record_rehash()
+        except PasswordHasherBusy:
+            return self._busy()
         
         # Generate JWT token
         token = self._generate_token(str(user_data['_id']), user_data['email'])
         return {'success': True, 'token': token, 'user': user.to_dict()}
     
     def login_with_face(self, email, face_encoding):
-        from face_recognition import compare_faces
+        # Decoded stored samples, from the cache on repeat logins
+        with timer('template_read'):
+            template = get_face_template(self.users, email)
+        if template is None:
+            return {'success': False, 'message': 'User not found or face not registered'}
         
-        user_data = self.db.users.find_one({'email': email})
-        if not user_data or not user_data.get('face_encoding'):
+        # Compare against every enrolled sample at once and keep the best
+        config = current_app.config
+        with timer('compare'):
+            distance = best_sample_distance(template['face_samples'], face_encoding)
+        
+        if distance > config['FACE_RECOGNITION_TOLERANCE']:
+            count('face_matches', mode='login', result='no_match')
+            return {'success': False, 'message': 'Face verification failed'}
+        count('face_matches', mode='login', result='match')
+        
+        return self._face_login(template, face_encoding, distance)
+    
+    def login_with_face_frames(self, email, face_results, required_matches=1):
+        """
+        Verify a burst of frame extraction results against one user.
+
+        The template is read once. Iteration over `face_results` stops at
+        the first run of `required_matches` consecutive matching frames, so
+        the caller can drop frames it has not processed yet; a frame that
+        does not match or has no usable face breaks the run.
+        """
+        with timer('template_read'):
+            template = get_face_template(self.users, email)
+        if template is None:
             return {'success': False, 'message': 'User not found or face not registered'}
         
-        # Convert stored face encoding from list back to numpy array
-        stored_encoding = np.array(user_data['face_encoding'])
+        tolerance = current_app.config['FACE_RECOGNITION_TOLERANCE']
+        matches = 0
+        failure = {'success': False, 'message': 'At least one face frame is required'}
+        for face_result in face_results:
+            if not face_result['success']:
+                # The face workers are saturated or the client is out of
+                # attempts; later frames would fare no better
+                if face_result.get('code') in ('face_busy', 'face_timeout', 'rate_limited'):
+                    return face_result
+                failure = face_result
+                matches = 0
+                continue
+            
+            face_encoding = face_result['face_encoding']
+            with timer('compare'):
+                distance = best_sample_distance(template['face_samples'], face_encoding)
+            if distance > tolerance:
+                count('face_matches', mode='login', result='no_match')
+                failure = None
+                matches = 0
+                continue
+            count('face_matches', mode='login', result='match')
+            
+            matches += 1
+            if matches >= required_matches:
+                return self._face_login(template, face_encoding, distance)
+        
+        # When the burst was empty or ended on unusable frames, tell the client why
+        if failure is not None:
+            return failure
+        return {'success': False, 'message': 'Face verification failed'}
+    
+    def _face_login(self, template, face_encoding, distance):
+        # A confident match refreshes the template with the current appearance
+        config = current_app.config
+        if config['FACE_TEMPLATE_ADAPTIVE_UPDATE'] and distance <= config['FACE_TEMPLATE_UPDATE_DISTANCE']:
+            FaceService(self.db).add_face_sample(template, face_encoding)
+        
+        # Generate JWT token
+        token = self._generate_token(str(template['user_id']), template['email'])
+        
+        user = User(email=template['email'], _id=template['user_id'])
+        user.has_password = template['has_password']
+        user.has_face = True
+        return {'success': True, 'token': token, 'user': user.to_dict()}
+    
+    def identify_with_face(self, face_encoding):
+        # Match the probe against every enrolled face instead of a single user
+        with timer('index_search'):
+            matches = get_face_index(self.db).search(face_encoding, k=1)
         
-        # Compare faces
         tolerance = current_app.config['FACE_RECOGNITION_TOLERANCE']
-        match = compare_faces([stored_encoding], face_encoding, tolerance=tolerance)[0]
+        if not matches or matches[0][1] > tolerance:
+            count('face_matches', mode='identify', result='no_match')
+            return {'success': False, 'message': 'Face not recognized'}
         
-        if not match:
-            return {'success': False, 'message': 'Face verification failed'}
+        # The index holds centroids; confirm against the candidate's own samples
+        user_id, _ = matches[0]
+        with timer('db_read'):
+            user_data = self.users.find_encoding_by_id(user_id)
+        if not user_data or not user_data.get('face_encoding'):
+            count('face_matches', mode='identify', result='no_match')
+            return {'success': False, 'message': 'Face not recognized'}
+        
+        with timer('compare'):
+            distance = best_sample_distance(decode_face_samples(user_data['face_encoding']), face_encoding)
+        if distance > tolerance:
+            count('face_matches', mode='identify', result='no_match')
+            return {'success': False, 'message': 'Face not recognized'}
+        count('face_matches', mode='identify', result='match')
         
         # Generate JWT token
         token = self._generate_token(str(user_data['_id']), user_data['email'])
         
         user = User.from_dict(user_data)
+        user.has_password = self.users.has_password(user_data['_id'])
         return {'success': True, 'token': token, 'user': user.to_dict()}
     
     def generate_password_reset_token(self, email):
-        user_data = self.db.users.find_one({'email': email})
+        user_data = self.users.find_id(email)
         if not user_data:
             # Don't reveal that email doesn't exist for security
             return {'success': True, 'message': 'If your email is registered, you will receive a password reset link'}
         
-        # Generate token and expiration (24 hours from now)
+        # Generate token and expiration (24 hours from now); MongoDB deletes
+        # the reset once it expires
         token = secrets.token_urlsafe(32)
-        token_exp = datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-        
-        # Update user with reset token
-        self.db.users.update_one(
-            {'_id': user_data['_id']},
-            {'$set': {
-                'reset_token': token,
-                'reset_token_exp': token_exp
-            }}
-        )
+        now = datetime.datetime.utcnow()
+        self.resets.create(user_data['_id'], token, now + datetime.timedelta(hours=24), now)
         
         return {
             'success': True, 
@@ -98,30 +224,55 @@ class AuthService:
         }
     
     def reset_password(self, token, new_password):
-        user_data = self.db.users.find_one({
-            'reset_token': token,
-            'reset_token_exp': {'$gt': datetime.datetime.utcnow()}
-        })
-        
-        if not user_data:
-            return {'success': False, 'message': 'Invalid or expired token'}
+        now = datetime.datetime.utcnow()
+        reset = self.resets.find_valid(token, now)
+        if reset:
+            user_id = reset['user_id']
+        else:
+            # Tokens issued before resets had their own collection
+            user_data = self.users.find_by_reset_token(token, now)
+            if not user_data:
+                return {'success': False, 'message': 'Invalid or expired token'}
+            user_id = user_data['_id']
         
         # Update password and clear reset token
-        password_hash = generate_password_hash(new_password)
-        self.db.users.update_one(
-            {'_id': user_data['_id']},
-            {'$set': {'password_hash': password_hash},
-             '$unset': {'reset_token': '', 'reset_token_exp': ''}}
-        )
+        try:
+            password_hash = self._hasher().hash(new_password)
+        except PasswordHasherBusy:
+            return self._busy()
+        
+        # Use the token up before changing the password; of two concurrent
+        # resets with the same token only one gets it
+        if reset is not None and not self.resets.consume(token, now):
+            return {'success': False, 'message': 'Invalid or expired token'}
+        self.users.set_password_hash(user_id, password_hash)
+        self.resets.delete_for_user(user_id)
         
         return {'success': True, 'message': 'Password reset successful'}
     
+    def _hasher(self):
+        return get_password_hasher(current_app.config)
+    
+    def _busy(self):
+        return {
+            'success': False,
+            'code': 'auth_busy',
+            'message': 'Too many sign-in attempts are being processed. Please try again shortly.',
+            'retry_after': current_app.config['PASSWORD_HASH_RETRY_AFTER']
+        }
+    
     def _generate_token(self, user_id, email):
+        with timer('token_issue'):
+            return self._encode_token(user_id, email)
+    
+    def _encode_token(self, user_id, email):
         payload = {
             'exp': datetime.datetime.utcnow() + current_app.config['JWT_ACCESS_TOKEN_EXPIRES'],
             'iat': datetime.datetime.utcnow(),
             'sub': user_id,
-            'email': email
+            'email': email,
+            # Token id, so a single token can be revoked
+            'jti': secrets.token_urlsafe(12)
         }
         return jwt.encode(
             payload,
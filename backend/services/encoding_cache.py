@@ -0,0 +1,118 @@
+# Decoded face encoding cache
+# Keeps ready-to-compare float32 sample matrices in memory so repeat face logins
+# skip reading and decoding the stored samples. Every change to a user's face
+# bumps the document's face_version; entries carry the version they were read
+# at, and a write leaves a marker with the new version so an older read racing
+# with it cannot be cached afterwards. Hits skip the database; writes made by
+# other workers are caught by the first hit more than
+# ENCODING_CACHE_RECHECK_INTERVAL seconds after the entry was last checked,
+# with a lookup that returns only face_version.
+import threading
+import time
+from flask import current_app
+from repositories.encoding_format import decode_face_samples
+from utils.ttl_cache import TTLCache
+
+# Rough per-entry overhead on top of the encoding itself
+ENTRY_OVERHEAD_BYTES = 256
+
+class EncodingCache:
+    def __init__(self, max_entries, max_bytes, ttl, recheck_interval=0.0):
+        self.recheck_interval = recheck_interval
+        self._cache = TTLCache(max_entries, ttl, max_bytes=max_bytes)
+        # Latest known face_version per recently changed email
+        self._versions = TTLCache(max_entries, ttl)
+
+    def get(self, email):
+        return self._cache.get(email)
+
+    def discard(self, email):
+        self._cache.invalidate(email)
+
+    def put(self, email, template):
+        latest = self._versions.peek(email)
+        if latest is not None and template['version'] < latest:
+            return
+        self._cache.put(email, template, size=template['face_samples'].nbytes + ENTRY_OVERHEAD_BYTES)
+
+    def invalidate(self, email, version):
+        """
+        Drop the entry and remember that anything older than `version` is stale
+        """
+        self._cache.invalidate(email)
+        self._versions.put(email, version)
+
+    def stats(self):
+        return self._cache.stats()
+
+# Process-wide cache, created on first use
+_encoding_cache = None
+_encoding_cache_lock = threading.Lock()
+
+def get_encoding_cache():
+    """
+    Return the shared cache, or None when ENCODING_CACHE_ENABLED is off
+    """
+    global _encoding_cache
+
+    config = current_app.config
+    if _encoding_cache is None and config['ENCODING_CACHE_ENABLED']:
+        with _encoding_cache_lock:
+            if _encoding_cache is None:
+                _encoding_cache = EncodingCache(
+                    max_entries=config['ENCODING_CACHE_MAX_ENTRIES'],
+                    max_bytes=config['ENCODING_CACHE_MAX_BYTES'],
+                    ttl=config['ENCODING_CACHE_TTL'],
+                    recheck_interval=config['ENCODING_CACHE_RECHECK_INTERVAL']
+                )
+
+    return _encoding_cache
+
+def get_face_template(users, email):
+    """
+    Return the user's id, email, stored face samples, version and whether
+    a password is set, from the cache when possible. Returns None if the
+    user has no face enrolled.
+    """
+    cache = get_encoding_cache()
+    if cache is not None:
+        template = cache.get(email)
+        if template is not None:
+            if time.monotonic() - template['checked_at'] < cache.recheck_interval:
+                return template
+            # Another worker may have replaced or deleted the face since
+            version = users.find_face_version(email)
+            if version == template['version']:
+                template['checked_at'] = time.monotonic()
+                return template
+            cache.discard(email)
+            if version is None:
+                return None
+
+    user_data = users.find_encoding(email)
+    if not user_data or not user_data.get('face_encoding'):
+        return None
+
+    template = {
+        'user_id': user_data['_id'],
+        'email': user_data['email'],
+        'face_samples': decode_face_samples(user_data['face_encoding']),
+        'version': user_data.get('face_version', 0),
+        'has_password': users.has_password(user_data['_id']),
+        'checked_at': time.monotonic()
+    }
+    if cache is not None:
+        cache.put(email, template)
+
+    return template
+
+def invalidate_face_template(email, version):
+    cache = get_encoding_cache()
+    if cache is not None:
+        cache.invalidate(email, version)
+
+def encoding_cache_stats():
+    """
+    Return the cache counters, or None if the cache has not been created
+    """
+    return _encoding_cache.stats() if _encoding_cache is not None else None
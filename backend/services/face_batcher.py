@@ -0,0 +1,112 @@
+# Cross-request face encoding batcher
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from services.face_worker import FaceQueueFull
+
+class FaceBatcher:
+    """
+    Collects aligned face chips from concurrent requests and encodes them
+    together.
+
+    A batch is dispatched once it holds `max_batch_size` chips or
+    `max_wait` seconds after its first chip arrived, whichever comes
+    first. `runner` receives the list of chips and returns one encoding
+    per chip. Up to `concurrency` batches run at the same time.
+    """
+    def __init__(self, runner, max_batch_size=16, max_wait=0.005, max_pending=256, concurrency=1):
+        self._runner = runner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='face-batch')
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._rejected = 0
+        self._thread = threading.Thread(target=self._collect, name='face-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, face_chip):
+        """
+        Queue a chip for encoding and return a Future for its encoding
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((face_chip, future))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise FaceQueueFull()
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'batches': self._batches,
+                'items': self._items,
+                'mean_batch_size': self._items / self._batches if self._batches else 0.0,
+                'rejected': self._rejected
+            }
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            encodings = self._runner([face_chip for face_chip, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), face_encoding in zip(batch, encodings):
+            future.set_result(face_encoding)
+
+# Process-wide batcher, created on first use
+_face_batcher = None
+_face_batcher_lock = threading.Lock()
+
+def get_face_batcher(config, runner, concurrency=1):
+    """
+    Return the shared batcher, or None when FACE_BATCH_ENABLED is off
+    """
+    global _face_batcher
+
+    if _face_batcher is None and config['FACE_BATCH_ENABLED']:
+        with _face_batcher_lock:
+            if _face_batcher is None:
+                _face_batcher = FaceBatcher(
+                    runner,
+                    max_batch_size=config['FACE_BATCH_MAX_SIZE'],
+                    max_wait=config['FACE_BATCH_WINDOW_MS'] / 1000.0,
+                    max_pending=config['FACE_BATCH_MAX_PENDING'],
+                    concurrency=concurrency
+                )
+
+    return _face_batcher
+
+def face_batcher_stats():
+    """
+    Return the batcher counters, or None if batching has not started
+    """
+    return _face_batcher.stats() if _face_batcher is not None else None
@@ -0,0 +1,360 @@
+# Face identification index
+import datetime
+import logging
+import threading
+import time
+import numpy as np
+from flask import current_app
+from repositories.encoding_format import ENCODING_SIZE, decode_face_centroid
+from repositories.user_repository import UserRepository
+
+logger = logging.getLogger(__name__)
+
+class FaceIndex:
+    """
+    In-memory 1:N index over every enrolled face, one centroid per user.
+
+    Encodings are kept in one contiguous float32 matrix with a parallel
+    array of user ids, so a probe is matched against the whole gallery
+    with a single vectorized distance computation.
+    """
+    def __init__(self, capacity=1024):
+        self._initial_capacity = capacity
+        self._lock = threading.RLock()
+        self._vectors = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=object)
+        self._rows = {}
+        self._size = 0
+        self.loaded = False
+
+    def __len__(self):
+        return self._size
+
+    def load(self, db):
+        """
+        Build the index from every user document that has a face encoding
+        """
+        with self._lock:
+            ids, vectors = read_gallery(db)
+            self.build(ids, vectors)
+            self.loaded = True
+
+    def save(self, path):
+        """
+        Write the index state to an .npz file
+        """
+        with self._lock:
+            n = self._size
+            np.savez(
+                path,
+                ids=np.array(self._ids[:n], dtype=str),
+                vectors=self._vectors[:n]
+            )
+
+    def load_file(self, path):
+        """
+        Restore the index state written by save()
+        """
+        state = np.load(path)
+        with self._lock:
+            self.build(state['ids'].tolist(), state['vectors'])
+            self.loaded = True
+
+    def build(self, ids, vectors):
+        """
+        Replace the index contents with the given ids and encodings
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+        with self._lock:
+            capacity = max(len(ids), self._initial_capacity)
+            self._vectors = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+            self._sq_norms = np.empty(capacity, dtype=np.float32)
+            self._ids = np.empty(capacity, dtype=object)
+            self._rows = {}
+            self._size = 0
+
+            n = len(ids)
+            self._vectors[:n] = vectors
+            self._sq_norms[:n] = np.einsum('ij,ij->i', vectors, vectors)
+            self._ids[:n] = ids
+            self._rows = {user_id: row for row, user_id in enumerate(ids)}
+            self._size = n
+
+    def add(self, user_id, face_encoding):
+        """
+        Insert or replace the encoding stored for a user
+        """
+        vector = np.asarray(face_encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow()
+                row = self._size
+                self._rows[user_id] = row
+                self._ids[row] = user_id
+                self._size += 1
+
+            self._vectors[row] = vector
+            self._sq_norms[row] = vector.dot(vector)
+
+    def remove(self, user_id):
+        """
+        Drop a user's encoding, moving the last row into the freed slot
+        """
+        with self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return False
+
+            last = self._size - 1
+            if row != last:
+                moved_id = self._ids[last]
+                self._vectors[row] = self._vectors[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+
+            self._ids[last] = None
+            self._size = last
+            return True
+
+    def search(self, probe, k=1):
+        """
+        Return up to k (user_id, distance) pairs closest to the probe encoding
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(ENCODING_SIZE)
+
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return []
+
+            # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2 over the whole gallery at once
+            sq_distances = self._sq_norms[:n] - 2.0 * (self._vectors[:n] @ probe)
+            sq_distances += probe.dot(probe)
+
+            k = min(k, n)
+            if k < n:
+                top = np.argpartition(sq_distances, k - 1)[:k]
+            else:
+                top = np.arange(n)
+            top = top[np.argsort(sq_distances[top])]
+
+            distances = np.sqrt(np.maximum(sq_distances[top], 0.0))
+            return [(self._ids[row], float(distance)) for row, distance in zip(top, distances)]
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+
+        vectors = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        ids = np.empty(capacity, dtype=object)
+        ids[:self._size] = self._ids[:self._size]
+
+        self._vectors = vectors
+        self._sq_norms = sq_norms
+        self._ids = ids
+
+def read_gallery(db):
+    """
+    Read every user's face centroid as parallel id and float32 vector arrays
+    """
+    cursor = UserRepository(db).iter_face_encodings()
+    ids = []
+    vectors = []
+    for user_data in cursor:
+        ids.append(str(user_data['_id']))
+        vectors.append(decode_face_centroid(user_data))
+
+    return ids, np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+def best_sample_distance(face_samples, probe):
+    """
+    Distance from the probe to the closest of a user's enrolled samples,
+    computed for all samples at once
+    """
+    differences = face_samples - np.asarray(probe, dtype=np.float32)
+    return float(np.sqrt(np.einsum('ij,ij->i', differences, differences).min()))
+
+def create_face_index(config, previous=None):
+    """
+    Build an empty index for the backend selected in the configuration.
+    An 'ivf' index reuses the quantizer trained by the `previous` one.
+    """
+    backend = config.get('FACE_INDEX_BACKEND', 'exact')
+
+    if backend == 'exact':
+        return FaceIndex()
+
+    if backend == 'ivf':
+        from services.ann_index import IVFFaceIndex
+        return IVFFaceIndex(
+            nlist=config.get('FACE_INDEX_NLIST', 1024),
+            nprobe=config.get('FACE_INDEX_NPROBE', 16),
+            centroids=getattr(previous, '_centroids', None)
+        )
+
+    if backend == 'shared':
+        from services.shared_face_index import SharedFaceIndex
+        return SharedFaceIndex(
+            config['FACE_SHARED_INDEX_PATH'],
+            sync_interval=config.get('FACE_SHARED_INDEX_SYNC_INTERVAL', 1.0),
+            compact_records=config.get('FACE_SHARED_INDEX_COMPACT_RECORDS', 10000),
+            max_age=config.get('FACE_SHARED_INDEX_MAX_AGE', 86400)
+        )
+
+    raise ValueError(f'Unknown face index backend: {backend}')
+
+# Process-wide index shared by all requests, created on first use. The
+# 'exact' and 'ivf' indexes are private to the worker: every
+# FACE_INDEX_SYNC_INTERVAL seconds a background thread applies the faces
+# changed since the last sync, found through face_updated_at, and after
+# FACE_INDEX_MAX_AGE the index is rebuilt from scratch. The 'shared' index
+# replays every worker's changes from its delta log instead.
+_face_index = None
+_face_index_loaded_at = 0.0
+_face_index_synced_at = None
+_face_index_lock = threading.Lock()
+# Serializes the first load, so requests wait for one load instead of
+# starting their own; updates never take it
+_face_index_load_lock = threading.Lock()
+# Changes made while a new index reads the gallery, replayed onto it
+_pending_updates = None
+_next_refresh = 0.0
+_refreshing = False
+
+def get_face_index(db):
+    """
+    Return the shared face index, loading it from the database on first use
+    """
+    config = current_app.config
+
+    if _face_index is None:
+        with _face_index_load_lock:
+            if _face_index is None:
+                # Try again on the next request if this fails
+                _load_face_index(config, db)
+
+    if config.get('FACE_INDEX_BACKEND', 'exact') != 'shared' and time.monotonic() >= _next_refresh:
+        _start_refresh(config, db)
+
+    return _face_index
+
+def _load_face_index(config, db, previous=None):
+    # The new index is filled off to the side, so searches keep using the
+    # current one and updates only wait for the brief publish below
+    global _face_index, _face_index_loaded_at, _face_index_synced_at, _pending_updates, _next_refresh
+
+    replay = config.get('FACE_INDEX_BACKEND', 'exact') != 'shared'
+    if replay:
+        with _face_index_lock:
+            _pending_updates = []
+
+    started = datetime.datetime.utcnow()
+    try:
+        index = create_face_index(config, previous)
+        index.load(db)
+    except Exception:
+        with _face_index_lock:
+            _pending_updates = None
+        raise
+
+    with _face_index_lock:
+        if replay:
+            for user_id, face_encoding in _pending_updates:
+                if face_encoding is None:
+                    index.remove(user_id)
+                else:
+                    index.add(user_id, face_encoding)
+        _face_index = index
+        _face_index_loaded_at = time.monotonic()
+        _face_index_synced_at = started
+        _pending_updates = None
+        _next_refresh = _face_index_loaded_at + _refresh_interval(config)
+
+def _refresh_interval(config):
+    intervals = [interval for interval in (config.get('FACE_INDEX_SYNC_INTERVAL', 0),
+                                           config.get('FACE_INDEX_MAX_AGE', 0)) if interval]
+    return min(intervals) if intervals else float('inf')
+
+def _start_refresh(config, db):
+    global _refreshing
+
+    with _face_index_lock:
+        if _refreshing or time.monotonic() < _next_refresh:
+            return
+        _refreshing = True
+    threading.Thread(target=_refresh, args=(config, db), name='face-index-refresh', daemon=True).start()
+
+def _refresh(config, db):
+    # Requests keep searching the current index throughout
+    global _refreshing, _next_refresh
+
+    max_age = config.get('FACE_INDEX_MAX_AGE', 0)
+    try:
+        if max_age and time.monotonic() - _face_index_loaded_at > max_age:
+            _load_face_index(config, db, previous=_face_index)
+        else:
+            _sync_face_index(db, config.get('FACE_INDEX_SYNC_INTERVAL', 0))
+    except Exception:
+        logger.warning('Face index refresh failed; keeping the current index', exc_info=True)
+    finally:
+        with _face_index_lock:
+            _refreshing = False
+            _next_refresh = time.monotonic() + _refresh_interval(config)
+
+def _sync_face_index(db, overlap):
+    global _face_index_synced_at
+
+    # Overlap the previous window so a write that committed just before the
+    # last sync's clock reading is not missed; applying a change twice is
+    # harmless. A failure part way leaves the window where it was.
+    started = datetime.datetime.utcnow()
+    since = _face_index_synced_at - datetime.timedelta(seconds=overlap)
+    index = _face_index
+
+    for user_data in UserRepository(db).iter_face_changes(since):
+        user_id = str(user_data['_id'])
+        if 'face_encoding' in user_data:
+            index.add(user_id, decode_face_centroid(user_data))
+        else:
+            index.remove(user_id)
+
+    with _face_index_lock:
+        _face_index_synced_at = started
+
+def _record_pending(user_id, face_encoding):
+    # Returns the index to apply the change to, or None before the first load
+    with _face_index_lock:
+        if _pending_updates is not None:
+            _pending_updates.append((user_id, face_encoding))
+        return _face_index
+
+def update_face_index(user_id, face_encoding):
+    """
+    Apply an enrolled or replaced centroid to the shared index, if loaded
+    """
+    index = _record_pending(user_id, face_encoding)
+    if index is not None:
+        index.add(user_id, face_encoding)
+    elif current_app.config['FACE_INDEX_BACKEND'] == 'shared':
+        # Other workers may have the host-wide gallery mapped already
+        from services.shared_face_index import ADD, append_delta
+        append_delta(current_app.config['FACE_SHARED_INDEX_PATH'], ADD, user_id, face_encoding)
+
+def remove_from_face_index(user_id):
+    """
+    Remove a user from the shared index, if loaded
+    """
+    index = _record_pending(user_id, None)
+    if index is not None:
+        index.remove(user_id)
+    elif current_app.config['FACE_INDEX_BACKEND'] == 'shared':
+        from services.shared_face_index import DELETE, append_delta
+        append_delta(current_app.config['FACE_SHARED_INDEX_PATH'], DELETE, user_id)
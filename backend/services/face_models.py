@@ -0,0 +1,90 @@
+# Face model lifecycle
+# Importing face_recognition loads the dlib detector, landmark and encoder
+# models, which takes seconds and a few hundred MB. Nothing imports it at
+# module level: load_face_models() does on first use, so password-only
+# workers and health checks start instantly. Face work normally runs in
+# the face worker pool, whose processes load and warm the models as they
+# start (see face_worker.py). When it runs inline instead, under gunicorn
+# with preload_app the master loads and warms the models before forking
+# and every worker shares those pages copy-on-write (see gunicorn.conf.py).
+import logging
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class FaceModels:
+    def __init__(self, face_recognition, face_api, dlib, cv2):
+        self.face_recognition = face_recognition
+        self.face_api = face_api
+        self.dlib = dlib
+        self.cv2 = cv2
+
+_models = None
+_models_lock = threading.Lock()
+_status = {'loaded': False, 'warm': False, 'load_seconds': None, 'warm_up_seconds': None, 'error': None}
+_warm_up_thread = None
+
+def load_face_models():
+    """
+    Import face_recognition, dlib and OpenCV on first call and return them
+    """
+    global _models
+
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                start = time.perf_counter()
+                import face_recognition
+                from face_recognition import api as face_api
+                import dlib
+                import cv2
+                _models = FaceModels(face_recognition, face_api, dlib, cv2)
+                _status['load_seconds'] = time.perf_counter() - start
+                _status['loaded'] = True
+
+    return _models
+
+def warm_up():
+    """
+    Load the models and run detection and encoding once, so the first real
+    request does not pay for lazy initialisation inside dlib
+    """
+    from services.face_pipeline import detect_faces, encode_face_chips
+
+    try:
+        load_face_models()
+        start = time.perf_counter()
+        detect_faces(np.zeros((120, 160, 3), dtype=np.uint8), max_side=0, upsample=0)
+        encode_face_chips([np.zeros((150, 150, 3), dtype=np.uint8)])
+        _status['warm_up_seconds'] = time.perf_counter() - start
+        _status['warm'] = True
+    except Exception as e:
+        _status['error'] = str(e)
+        raise
+
+    return dict(_status)
+
+def start_warm_up():
+    """
+    Warm the models up on a background thread; /ready reports when done
+    """
+    global _warm_up_thread
+
+    with _models_lock:
+        if _warm_up_thread is None and not _status['warm']:
+            _warm_up_thread = threading.Thread(target=_warm_up_in_background, name='face-warm-up', daemon=True)
+            _warm_up_thread.start()
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    except Exception:
+        logger.exception('Face model warm-up failed')
+
+def face_models_ready():
+    return _status['warm']
+
+def face_models_status():
+    return dict(_status)
@@ -0,0 +1,212 @@
+# Face extraction pipeline
+# Plain functions with no Flask or database dependencies, so they can run
+# inside face worker processes as well as request threads. The dlib models
+# are only loaded by the first function that needs them.
+import numpy as np
+import base64
+import io
+import time
+from PIL import Image
+from services.face_models import load_face_models
+
+def image_bytes(face_image):
+    """
+    Return the raw image bytes of an upload, decoding a base64 data URL
+    """
+    if isinstance(face_image, str):
+        return base64.b64decode(face_image.split(',')[-1])
+    return face_image
+
+def decode_image(face_image):
+    """
+    Decode raw JPEG/PNG bytes or a base64 data URL into an RGB uint8 array
+    """
+    image = Image.open(io.BytesIO(image_bytes(face_image)))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    # face_recognition expects RGB, so the decoded buffer is used as is
+    return np.asarray(image)
+
+def detect_faces(image, max_side=640, upsample=1, model='hog'):
+    """
+    Detect faces on a downscaled copy of the image and return the boxes
+    in full-resolution (top, right, bottom, left) coordinates
+    """
+    models = load_face_models()
+    face_recognition, cv2 = models.face_recognition, models.cv2
+    
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width) if max_side else 1.0
+    
+    if scale >= 1.0:
+        return face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model=model)
+    
+    small = cv2.resize(
+        image,
+        (max(1, round(width * scale)), max(1, round(height * scale))),
+        interpolation=cv2.INTER_AREA
+    )
+    locations = face_recognition.face_locations(small, number_of_times_to_upsample=upsample, model=model)
+    
+    # Map the boxes back onto the original frame
+    return [
+        (
+            max(0, int(top / scale)),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(left / scale))
+        )
+        for top, right, bottom, left in locations
+    ]
+
+# Messages for frames rejected by the quality gate
+QUALITY_MESSAGES = {
+    'blurry': 'The image is too blurry. Please hold still and try again.',
+    'too_dark': 'The image is too dark. Please move to a brighter place and try again.',
+    'overexposed': 'The image is too bright. Please avoid direct light and try again.',
+    'face_too_small': 'Your face is too small in the image. Please move closer and try again.'
+}
+
+def assess_quality(image, quality):
+    """
+    Score sharpness and exposure on a small grayscale copy of the frame.
+
+    Sharpness is the variance of the Laplacian; exposure comes from the
+    grayscale histogram. Returns (code, scores) where code is None for an
+    acceptable frame, or 'blurry', 'too_dark' or 'overexposed'.
+    """
+    cv2 = load_face_models().cv2
+    
+    height, width = image.shape[:2]
+    scale = quality['max_side'] / max(height, width)
+    if scale < 1.0:
+        image = cv2.resize(
+            image,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    pixels = gray.size
+    scores = {
+        'sharpness': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        'brightness': float(histogram @ np.arange(256) / pixels),
+        'clipped': float(histogram[250:].sum() / pixels)
+    }
+    
+    if scores['brightness'] < quality['min_brightness']:
+        return 'too_dark', scores
+    if scores['brightness'] > quality['max_brightness'] or scores['clipped'] > quality['max_clipped']:
+        return 'overexposed', scores
+    # Checked last: a dark or washed-out frame also has little detail
+    if scores['sharpness'] < quality['min_sharpness']:
+        return 'blurry', scores
+    return None, scores
+
+def quality_failure(code, scores, timings):
+    return {
+        'success': False,
+        'code': code,
+        'message': QUALITY_MESSAGES[code],
+        'quality': scores,
+        'timings': timings
+    }
+
+def align_face(image, location, landmarks='large'):
+    """
+    Locate the landmarks inside a face box and return the aligned
+    150x150 face chip the encoder expects
+    """
+    models = load_face_models()
+    dlib = models.dlib
+    
+    top, right, bottom, left = location
+    # The 5-point 'small' model is several times faster than the 68-point one
+    predictor = models.face_api.pose_predictor_5_point if landmarks == 'small' else models.face_api.pose_predictor_68_point
+    shape = predictor(image, dlib.rectangle(left, top, right, bottom))
+    return dlib.get_face_chip(image, shape, size=150, padding=0.25)
+
+def encode_face_chips(face_chips, num_jitters=1):
+    """
+    Compute encodings for a batch of aligned face chips in one encoder call
+    """
+    descriptors = load_face_models().face_api.face_encoder.compute_face_descriptor(face_chips, num_jitters)
+    return [np.array(descriptor) for descriptor in descriptors]
+
+def prepare_face(face_image, settings):
+    """
+    Run decode, detection and alignment for one image.
+
+    `settings` holds the detection options ('max_side', 'upsample' and
+    'model'), the 'landmarks' model used for alignment and, optionally,
+    the quality gate thresholds in 'quality'.
+    On success the result carries the aligned 'face_chip'. Every result
+    carries the seconds spent per stage in 'timings'.
+    """
+    timings = {}
+    quality = settings.get('quality')
+    try:
+        start = time.perf_counter()
+        image = decode_image(face_image)
+        decoded = time.perf_counter()
+        timings['decode'] = decoded - start
+        
+        # Turn away blurry and badly exposed frames before detection
+        if quality:
+            code, scores = assess_quality(image, quality)
+            assessed = time.perf_counter()
+            timings['quality'] = assessed - decoded
+            decoded = assessed
+            if code:
+                return quality_failure(code, scores, timings)
+        
+        # Detect face locations at reduced resolution
+        face_locations = detect_faces(
+            image,
+            max_side=settings['max_side'],
+            upsample=settings['upsample'],
+            model=settings['model']
+        )
+        detected = time.perf_counter()
+        timings['detect'] = detected - decoded
+        
+        if not face_locations:
+            return {'success': False, 'code': 'no_face', 'message': 'No face detected in the image', 'timings': timings}
+        
+        if len(face_locations) > 1:
+            return {'success': False, 'code': 'multiple_faces', 'message': 'Multiple faces detected. Please ensure only one face is visible.', 'timings': timings}
+        
+        # A tiny face encodes poorly; ask for a closer capture instead
+        top, right, bottom, left = face_locations[0]
+        face_size = min(right - left, bottom - top)
+        if quality and face_size < quality['min_face_size']:
+            return quality_failure('face_too_small', {'face_size': face_size}, timings)
+        
+        # Align the face on the full-resolution frame
+        face_chip = align_face(image, face_locations[0], settings.get('landmarks', 'large'))
+        timings['align'] = time.perf_counter() - detected
+        return {'success': True, 'face_chip': face_chip, 'timings': timings}
+    
+    except Exception as e:
+        return {'success': False, 'message': f'Error processing image: {str(e)}', 'timings': timings}
+
+def extract_encoding(face_image, settings):
+    """
+    Run the whole pipeline for one image. Returns the same result dict as
+    FaceService.extract_face_encoding.
+    """
+    result = prepare_face(face_image, settings)
+    if not result['success']:
+        return result
+    
+    timings = result['timings']
+    try:
+        start = time.perf_counter()
+        face_encoding = encode_face_chips([result['face_chip']], settings.get('num_jitters', 1))[0]
+        timings['encode'] = time.perf_counter() - start
+    except Exception as e:
+        return {'success': False, 'message': f'Error processing image: {str(e)}', 'timings': timings}
+    
+    return {'success': True, 'face_encoding': face_encoding, 'timings': timings}
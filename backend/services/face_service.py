@@ -1,68 +1,220 @@
 # Face recognition service 
-import face_recognition
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
-import base64
-import cv2
-import io
-from PIL import Image
+from flask import current_app
+from repositories.encoding_format import ENCODING_SIZE
+from repositories.user_repository import UserRepository
+from services.encoding_cache import invalidate_face_template
+from services.face_index import update_face_index, remove_from_face_index
+from services.face_pipeline import extract_encoding, prepare_face, encode_face_chips, image_bytes
+from services.frame_cache import get_frame_cache, frame_key, is_cacheable
+from services.face_worker import get_face_pool, FaceQueueFull, FaceJobTimeout
+from services.face_batcher import get_face_batcher
+from utils.metrics import timer, observe, count
+from utils.rate_limit import get_face_admission
+
+def run_face_job(pool, fn, *args):
+    """
+    Run CPU-bound face work in a worker process when the pool is enabled
+    """
+    if pool is None:
+        return fn(*args)
+    return pool.run(fn, *args)
+
+def face_settings(config, purpose='verification'):
+    """
+    Build the pipeline settings passed to the face worker processes, from
+    the profile configured for 'enrollment' or 'verification'
+    """
+    name = config['FACE_ENROLLMENT_PROFILE'] if purpose == 'enrollment' else config['FACE_VERIFICATION_PROFILE']
+    profile = config['FACE_PROFILES'].get(name)
+    if profile is None:
+        raise ValueError(f'Unknown face profile: {name}')
+    
+    settings = {
+        'profile': name,
+        'max_side': profile['max_side'],
+        'upsample': profile['upsample'],
+        'model': profile['model'],
+        'landmarks': profile['landmarks'],
+        'num_jitters': profile['num_jitters']
+    }
+    if config['FACE_QUALITY_ENABLED']:
+        settings['quality'] = {
+            'max_side': config['FACE_QUALITY_MAX_SIDE'],
+            'min_sharpness': config['FACE_QUALITY_MIN_SHARPNESS'],
+            'min_brightness': config['FACE_QUALITY_MIN_BRIGHTNESS'],
+            'max_brightness': config['FACE_QUALITY_MAX_BRIGHTNESS'],
+            'max_clipped': config['FACE_QUALITY_MAX_CLIPPED'],
+            'min_face_size': config['FACE_QUALITY_MIN_FACE_SIZE']
+        }
+    return settings
 
 class FaceService:
     def __init__(self, db):
         self.db = db
+        self.users = UserRepository(db)
     
-    def extract_face_encoding(self, face_image_base64):
+    def extract_face_encoding(self, face_image, purpose='verification'):
         """
-        Extract face encoding from a base64 encoded image
+        Extract face encoding from raw image bytes or a base64 encoded image,
+        with the enrollment or verification profile
         """
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(face_image_base64.split(',')[1])
-            image = np.array(Image.open(io.BytesIO(image_data)))
-            
-            # Convert RGB to BGR (OpenCV format)
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            
-            # Detect face locations
-            face_locations = face_recognition.face_locations(image)
-            
-            if not face_locations:
-                return {'success': False, 'message': 'No face detected in the image'}
-            
-            if len(face_locations) > 1:
-                return {'success': False, 'message': 'Multiple faces detected. Please ensure only one face is visible.'}
+            with timer('base64_decode'):
+                face_image = image_bytes(face_image)
+        except Exception as e:
+            count('face_extractions', result='error')
+            return {'success': False, 'message': f'Error processing image: {str(e)}'}
+        
+        settings = face_settings(current_app.config, purpose)
+        
+        # A frame seen moments ago returns its earlier result without touching dlib
+        cache = get_frame_cache()
+        if cache is None:
+            result = self._extract(face_image, settings)
+        else:
+            key = (settings['profile'], frame_key(face_image))
+            result = cache.get(key)
+            if result is None:
+                result = self._extract(face_image, settings)
+                if is_cacheable(result):
+                    cache.put(key, result)
+            result = dict(result)
+        
+        count('face_extractions', result='success' if result['success'] else result.get('code', 'error'))
+        return result
+    
+    def _extract(self, face_image, settings):
+        # Turn work away quickly once enough extractions are already running
+        admission = get_face_admission(current_app.config)
+        if admission is None:
+            return self._run_extraction(face_image, settings)
+        
+        if not admission.acquire():
+            count('face_admission', result='rejected')
+            return {
+                'success': False,
+                'code': 'face_busy',
+                'message': 'Face recognition is busy. Please try again shortly.',
+                'retry_after': current_app.config['FACE_WORKER_RETRY_AFTER']
+            }
+        
+        count('face_admission', result='admitted')
+        try:
+            return self._run_extraction(face_image, settings)
+        finally:
+            admission.release()
+    
+    def _run_extraction(self, face_image, settings):
+        config = current_app.config
+        pool = get_face_pool(config)
+        batcher = get_face_batcher(
+            config,
+            lambda face_chips: run_face_job(pool, encode_face_chips, face_chips),
+            concurrency=pool.processes if pool else 1
+        )
+        
+        try:
+            # The shared batcher encodes with a single jitter
+            if batcher is None or settings['num_jitters'] != 1:
+                return self._record_timings(run_face_job(pool, extract_encoding, face_image, settings))
             
-            # Get face encoding
-            face_encoding = face_recognition.face_encodings(image, face_locations)[0]
+            # Align here, then encode together with other requests' faces
+            result = self._record_timings(run_face_job(pool, prepare_face, face_image, settings))
+            if not result['success']:
+                return result
             
+            with timer('encode'):
+                face_encoding = batcher.submit(result['face_chip']).result(timeout=config['FACE_WORKER_TIMEOUT'])
             return {'success': True, 'face_encoding': face_encoding}
         
+        except (FaceQueueFull, BrokenProcessPool):
+            # A broken pool has already been replaced; the new one may
+            # still be starting, so ask the client to retry
+            return {
+                'success': False,
+                'code': 'face_busy',
+                'message': 'Face recognition is busy. Please try again shortly.',
+                'retry_after': config['FACE_WORKER_RETRY_AFTER']
+            }
+        except (FaceJobTimeout, TimeoutError):
+            # concurrent.futures' TimeoutError, from the batcher's future
+            return {
+                'success': False,
+                'code': 'face_timeout',
+                'message': 'Face recognition timed out. Please try again.',
+                'retry_after': config['FACE_WORKER_RETRY_AFTER']
+            }
         except Exception as e:
             return {'success': False, 'message': f'Error processing image: {str(e)}'}
     
-    def update_face_encoding(self, email, face_encoding):
+    def _record_timings(self, result):
+        # Stage timings measured in the worker process
+        for stage, seconds in result.pop('timings', {}).items():
+            observe(stage, seconds)
+        return result
+    
+    def extract_face_encodings(self, face_images):
         """
-        Update or add face encoding for a user
+        Extract one encoding per enrollment image, stopping at the first failure
         """
-        result = self.db.users.update_one(
-            {'email': email},
-            {'$set': {'face_encoding': face_encoding.tolist()}}
-        )
+        face_encodings = []
+        for face_image in face_images:
+            result = self.extract_face_encoding(face_image, purpose='enrollment')
+            if not result['success']:
+                return result
+            face_encodings.append(result['face_encoding'])
+        
+        return {'success': True, 'face_encodings': face_encodings}
+    
+    def update_face_encoding(self, email, face_encodings):
+        """
+        Replace a user's face samples with one or more new encodings
+        """
+        face_samples = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        face_samples = face_samples[-current_app.config['FACE_TEMPLATE_MAX_SAMPLES']:]
+        
+        user_data = self.users.set_face_samples(email, face_samples)
         
-        if result.matched_count == 0:
+        if not user_data:
             return {'success': False, 'message': 'User not found'}
         
+        # Keep the identification index and encoding cache in step with the database
+        update_face_index(str(user_data['_id']), face_samples.mean(axis=0))
+        invalidate_face_template(email, user_data['face_version'])
+        
         return {'success': True, 'message': 'Face encoding updated successfully'}
     
+    def add_face_sample(self, template, face_encoding):
+        """
+        Add a confidently matched probe to the user's template, dropping the
+        oldest sample once the template is full. Returns False when another
+        request changed the template first.
+        """
+        face_samples = np.vstack([template['face_samples'], np.asarray(face_encoding, dtype=np.float32)])
+        face_samples = face_samples[-current_app.config['FACE_TEMPLATE_MAX_SAMPLES']:]
+        
+        user_data = self.users.set_face_samples(template['email'], face_samples,
+                                                expected_version=template['version'])
+        if not user_data:
+            return False
+        
+        update_face_index(str(user_data['_id']), face_samples.mean(axis=0))
+        invalidate_face_template(template['email'], user_data['face_version'])
+        return True
+    
     def delete_face_encoding(self, email):
         """
         Remove face encoding for a user
         """
-        result = self.db.users.update_one(
-            {'email': email},
-            {'$unset': {'face_encoding': ''}}
-        )
+        user_data = self.users.unset_face_encoding(email)
         
-        if result.matched_count == 0:
+        if not user_data:
             return {'success': False, 'message': 'User not found'}
         
+        remove_from_face_index(str(user_data['_id']))
+        invalidate_face_template(email, user_data['face_version'])
+        
         return {'success': True, 'message': 'Face encoding removed successfully'}
\ No newline at end of file
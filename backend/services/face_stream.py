@@ -0,0 +1,121 @@
+# Streaming multi-frame face verification
+# A client sends a short burst of frames in one request body, each frame
+# prefixed with its length as a 4-byte big-endian integer. Frames are read
+# off the network while the previous one is being extracted, and the
+# consumer stops iterating as soon as it has a decision; frames still
+# queued at that point are dropped without touching dlib.
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+FRAME_HEADER = struct.Struct('>I')
+
+class FrameStreamError(ValueError):
+    """
+    The request body is not a well-formed frame stream
+    """
+
+def read_frames(stream, max_frames, max_frame_bytes):
+    """
+    Yield the frames of a length-prefixed stream until it ends
+    """
+    for _ in range(max_frames):
+        header = _read_exact(stream, FRAME_HEADER.size)
+        if not header:
+            return
+        size, = FRAME_HEADER.unpack(header)
+        if size == 0 or size > max_frame_bytes:
+            raise FrameStreamError(f'Frames must be between 1 and {max_frame_bytes} bytes')
+        frame = _read_exact(stream, size)
+        if len(frame) < size:
+            raise FrameStreamError('The frame stream ended in the middle of a frame')
+        yield frame
+
+    if stream.read(1):
+        raise FrameStreamError(f'At most {max_frames} frames are allowed')
+
+def _read_exact(stream, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            if chunks:
+                return b''.join(chunks)
+            return b''
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+class FaceFrameStream:
+    """
+    Iterates over the extraction results of a frame stream, in order.
+
+    One frame is extracted on a helper thread while the request thread
+    reads the next from the network; at most `read_ahead` further frames
+    wait behind it. Closing the iterator early cancels the waiting frames
+    and counts them, and the one in flight, in `dropped`.
+
+    `admit`, if given, is called in the request thread before every frame
+    after the first (which the caller admitted with the request) is sent
+    for extraction. When it returns a failure result, that result is
+    yielded in place of the frame and the stream stops.
+    """
+    def __init__(self, stream, face_service, max_frames, max_frame_bytes, read_ahead=1, admit=None):
+        self._frames = read_frames(stream, max_frames, max_frame_bytes)
+        self._face_service = face_service
+        self._admit = admit
+        self._app = current_app._get_current_object()
+        self.read_ahead = read_ahead
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self._results = self._iterate()
+
+    def __iter__(self):
+        return self._results
+
+    def close(self):
+        """
+        Stop reading and drop the frames that are still queued
+        """
+        self._results.close()
+
+    def _iterate(self):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='face-stream')
+        pending = deque()
+        try:
+            for frame in self._frames:
+                self.received += 1
+                refused = self._admit() if self._admit is not None and self.received > 1 else None
+                if refused:
+                    while pending:
+                        yield self._take(pending)
+                    yield refused
+                    return
+                pending.append(executor.submit(self._extract, frame))
+                # Hand over every finished result before blocking on the network again
+                while pending and (pending[0].done() or len(pending) > self.read_ahead):
+                    yield self._take(pending)
+
+            while pending:
+                yield self._take(pending)
+        finally:
+            # A frame already being extracted finishes, but its result is dropped too
+            for future in pending:
+                future.cancel()
+            self.dropped += len(pending)
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        return {'received': self.received, 'processed': self.processed, 'dropped': self.dropped}
+
+    def _take(self, pending):
+        result = pending.popleft().result()
+        self.processed += 1
+        return result
+
+    def _extract(self, frame):
+        with self._app.app_context():
+            return self._face_service.extract_face_encoding(frame)
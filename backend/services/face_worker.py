@@ -0,0 +1,203 @@
+# Face processing worker pool
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from services.face_models import face_models_ready, start_warm_up
+
+class FaceQueueFull(Exception):
+    """
+    Raised when every worker is busy and the job queue is full
+    """
+
+class FaceJobTimeout(Exception):
+    """
+    Raised when a job does not finish within the configured timeout
+    """
+
+# Modules the forkserver imports before forking pool processes. Importing
+# face_recognition loads the dlib models, so every pool process starts with
+# them and shares their pages with the server instead of loading its own.
+FORKSERVER_PRELOAD = ['face_recognition', 'services.face_pipeline']
+
+def _init_worker(warm_count=None):
+    # Load the models and run one inference as the process starts, so no
+    # request pays for dlib's lazy initialisation; `warm_count` counts the
+    # processes that got this far
+    from services.face_models import warm_up
+    warm_up()
+    if warm_count is not None:
+        with warm_count.get_lock():
+            warm_count.value += 1
+
+class FaceWorkerPool:
+    """
+    Pool of face-processing processes fed through a bounded queue.
+
+    At most `processes + queue_size` jobs are admitted at once; further
+    jobs are rejected straight away with FaceQueueFull so callers can
+    answer 503 instead of piling up behind CPU-bound dlib work.
+    """
+    def __init__(self, processes, queue_size, timeout, start_method=None):
+        self.processes = processes
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._context = multiprocessing.get_context(start_method)
+        if self._context.get_start_method() == 'forkserver':
+            self._context.set_forkserver_preload(FORKSERVER_PRELOAD)
+        self._executor = self._create_executor()
+        self._warm_up = None
+        self._slots = threading.BoundedSemaphore(processes + queue_size)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._failed = 0
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) in a worker process and return its result
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise FaceQueueFull()
+
+        with self._lock:
+            self._in_flight += 1
+            self._submitted += 1
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release(None)
+            self._restart()
+            raise
+
+        # The slot is only freed once the job really finishes, so a timed
+        # out job still counts against the queue while a worker is on it
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise FaceJobTimeout()
+        except BrokenProcessPool:
+            # A worker died (for example inside dlib); replace the pool
+            self._restart()
+            raise
+
+    def start_warm_up(self):
+        """
+        Start every worker process now rather than on the first requests;
+        `ready` turns true once they have loaded and warmed the models
+        """
+        with self._lock:
+            if self._warm_up is None:
+                # No process is idle yet, so each job starts one of its own
+                self._warm_up = [self._executor.submit(os.getpid) for _ in range(self.processes)]
+
+    @property
+    def ready(self):
+        return self._warm_up is not None and self._warm_count.value >= self.processes
+
+    def stats(self):
+        """
+        Return queue depth and job counters for monitoring
+        """
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'processes': self.processes,
+                'queue_size': self.queue_size,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.processes),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'failed': self._failed
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _create_executor(self):
+        self._warm_count = self._context.Value('i', 0)
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(self._warm_count,)
+        )
+
+    def _restart(self):
+        with self._lock:
+            self._failed += 1
+            old_executor = self._executor
+            self._executor = self._create_executor()
+            warming = self._warm_up is not None
+            self._warm_up = None
+        old_executor.shutdown(wait=False, cancel_futures=True)
+        if warming:
+            self.start_warm_up()
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if future is not None and not future.cancelled():
+                self._completed += 1
+        self._slots.release()
+
+# Process-wide pool, created on first use
+_face_pool = None
+_face_pool_lock = threading.Lock()
+
+def get_face_pool(config):
+    """
+    Return the shared worker pool, or None when FACE_WORKER_PROCESSES is 0
+    """
+    global _face_pool
+
+    if _face_pool is None and config['FACE_WORKER_PROCESSES'] > 0:
+        with _face_pool_lock:
+            if _face_pool is None:
+                _face_pool = FaceWorkerPool(
+                    processes=config['FACE_WORKER_PROCESSES'],
+                    queue_size=config['FACE_WORKER_QUEUE_SIZE'],
+                    timeout=config['FACE_WORKER_TIMEOUT'],
+                    start_method=config.get('FACE_WORKER_START_METHOD')
+                )
+
+    return _face_pool
+
+def start_face_warm_up(config):
+    """
+    Warm the models up where face work runs: in every pool process, or in
+    this process when FACE_WORKER_PROCESSES is 0
+    """
+    pool = get_face_pool(config)
+    if pool is None:
+        start_warm_up()
+    else:
+        pool.start_warm_up()
+
+def face_work_ready(config):
+    """
+    Return True once face requests will not wait for models to load
+    """
+    if config['FACE_WORKER_PROCESSES'] > 0:
+        return _face_pool is not None and _face_pool.ready
+    return face_models_ready()
+
+def face_pool_stats():
+    """
+    Return the worker pool counters, or None if no pool has been started
+    """
+    return _face_pool.stats() if _face_pool is not None else None
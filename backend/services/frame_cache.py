@@ -0,0 +1,41 @@
+# Extraction result cache for repeated identical frames
+# Clients retry with the very same capture (double taps, network retries,
+# verify followed by login), so results are cached for a short time under
+# a hash of the raw image bytes. Deterministic failures such as "no face"
+# are cached too; transient ones such as a busy worker pool are not.
+import hashlib
+import threading
+from flask import current_app
+from utils.ttl_cache import TTLCache
+
+CACHEABLE_FAILURE_CODES = ('no_face', 'multiple_faces', 'blurry', 'too_dark', 'overexposed', 'face_too_small')
+
+def frame_key(image_bytes):
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+def is_cacheable(result):
+    return result['success'] or result.get('code') in CACHEABLE_FAILURE_CODES
+
+# Process-wide cache, created on first use
+_frame_cache = None
+_frame_cache_lock = threading.Lock()
+
+def get_frame_cache():
+    """
+    Return the shared cache, or None when FRAME_CACHE_ENABLED is off
+    """
+    global _frame_cache
+
+    config = current_app.config
+    if _frame_cache is None and config['FRAME_CACHE_ENABLED']:
+        with _frame_cache_lock:
+            if _frame_cache is None:
+                _frame_cache = TTLCache(config['FRAME_CACHE_MAX_ENTRIES'], config['FRAME_CACHE_TTL'])
+
+    return _frame_cache
+
+def frame_cache_stats():
+    """
+    Return the cache counters, or None if the cache has not been created
+    """
+    return _frame_cache.stats() if _frame_cache is not None else None
@@ -0,0 +1,145 @@
+# Password hashing executor
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+from utils.metrics import timer
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when every hashing thread is busy and the queue is full, or a
+    hash does not finish within the configured timeout
+    """
+
+def hash_method(method, iterations):
+    """
+    Return the werkzeug method string for the configured method and cost
+    """
+    if method.startswith('pbkdf2') and iterations:
+        return f'{method}:{iterations}'
+    return method
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification on a small thread pool.
+
+    hashlib releases the GIL while it hashes, so `workers` bounds how many
+    cores password work can take. At most `workers + queue_size` calls are
+    admitted at once; the rest fail fast with PasswordHasherBusy instead of
+    starving face and token requests during a credential-stuffing burst.
+    """
+    def __init__(self, method, workers, queue_size, timeout):
+        self.method = method
+        # werkzeug stores the expanded parameters ('scrypt:32768:8:1',
+        # 'pbkdf2:sha256:600000'), so learn the prefix from a real hash
+        self.hash_prefix = generate_password_hash('', method).split('$', 1)[0]
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._rehashed = 0
+
+    def hash(self, password):
+        """
+        Return a new hash of the password with the configured method
+        """
+        with timer('password_hash'):
+            return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """
+        Return True if the password matches the stored hash
+        """
+        with timer('password_verify'):
+            return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Return True if the stored hash was made with other parameters
+        """
+        return password_hash.split('$', 1)[0] != self.hash_prefix
+
+    def record_rehash(self):
+        with self._lock:
+            self._rehashed += 1
+
+    def stats(self):
+        """
+        Return queue depth and call counters for monitoring
+        """
+        with self._lock:
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.workers),
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'rehashed': self._rehashed
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordHasherBusy()
+
+        with self._lock:
+            self._in_flight += 1
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise PasswordHasherBusy()
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if not future.cancelled():
+                self._completed += 1
+        self._slots.release()
+
+# Process-wide hasher, created on first use
+_password_hasher = None
+_password_hasher_lock = threading.Lock()
+
+def get_password_hasher(config):
+    """
+    Return the shared password hasher
+    """
+    global _password_hasher
+
+    if _password_hasher is None:
+        with _password_hasher_lock:
+            if _password_hasher is None:
+                _password_hasher = PasswordHasher(
+                    method=hash_method(config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_ITERATIONS']),
+                    workers=config['PASSWORD_HASH_WORKERS'] or max(1, (os.cpu_count() or 1) // config['GUNICORN_WORKERS']),
+                    queue_size=config['PASSWORD_HASH_QUEUE_SIZE'],
+                    timeout=config['PASSWORD_HASH_TIMEOUT']
+                )
+
+    return _password_hasher
+
+def password_hasher_stats():
+    """
+    Return the hasher counters, or None if no password has been hashed yet
+    """
+    return _password_hasher.stats() if _password_hasher is not None else None
@@ -0,0 +1,397 @@
+# Host-wide face index shared by every gunicorn worker
+# One process writes a snapshot of the gallery (centroids, their squared
+# norms and the user ids sorted for binary search) as .npy files, and every
+# worker maps them read-only, so the pages live once in the page cache
+# whatever the number of workers. Enrollments and deletions are appended
+# to a delta log of fixed-size records that each worker replays into a
+# small private overlay. Once the log grows past a threshold it is folded
+# into a new snapshot generation; workers switch over on their next sync.
+#
+# Directory layout:
+#   CURRENT          generation number of the live snapshot
+#   gen-<n>/         vectors.npy, sq_norms.npy, ids.npy
+#   gen-<n>.log      deltas recorded since snapshot <n> was written
+#   lock             flock() serialising appends, builds and compaction
+import fcntl
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from repositories.encoding_format import ENCODING_SIZE
+from services.face_index import FaceIndex, read_gallery
+
+# User ids are ObjectId hex strings
+ID_DTYPE = np.dtype('S24')
+
+# op (b'A' add or replace, b'D' delete), user id, float32 centroid
+DELTA_RECORD = struct.Struct(f'<c24s{ENCODING_SIZE * 4}s')
+ADD = b'A'
+DELETE = b'D'
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def _locked(directory):
+    with open(os.path.join(directory, 'lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_generation(directory):
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _snapshot_path(directory, generation):
+    return os.path.join(directory, f'gen-{generation}')
+
+def _log_path(directory, generation):
+    return os.path.join(directory, f'gen-{generation}.log')
+
+def write_snapshot(directory, ids, vectors):
+    """
+    Write a new snapshot generation and make it current. Call with the
+    directory lock held.
+    """
+    return _publish_snapshot(directory, _stage_snapshot(directory, ids, vectors))
+
+def _stage_snapshot(directory, ids, vectors):
+    # Write the files to a private directory; needs no lock
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    ids = np.asarray(ids, dtype=ID_DTYPE)
+    order = np.argsort(ids, kind='stable')
+    ids, vectors = ids[order], vectors[order]
+
+    staging = tempfile.mkdtemp(prefix='staging-', dir=directory)
+    os.chmod(staging, 0o755)
+    np.save(os.path.join(staging, 'vectors.npy'), vectors)
+    np.save(os.path.join(staging, 'sq_norms.npy'), np.einsum('ij,ij->i', vectors, vectors))
+    np.save(os.path.join(staging, 'ids.npy'), ids)
+    return staging
+
+def _publish_snapshot(directory, staging, log_data=b''):
+    # Make a staged snapshot the next generation, its log starting with
+    # `log_data`. Call with the directory lock held.
+    previous = _read_generation(directory)
+    generation = (previous or 0) + 1
+    path = _snapshot_path(directory, generation)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    with open(_log_path(directory, generation), 'wb') as f:
+        f.write(log_data)
+
+    with open(os.path.join(directory, 'CURRENT.tmp'), 'w') as f:
+        f.write(str(generation))
+    os.replace(os.path.join(directory, 'CURRENT.tmp'), os.path.join(directory, 'CURRENT'))
+
+    # Workers still mapping the old files keep them until they switch over
+    if previous is not None:
+        shutil.rmtree(_snapshot_path(directory, previous), ignore_errors=True)
+        try:
+            os.remove(_log_path(directory, previous))
+        except FileNotFoundError:
+            pass
+    return generation
+
+def build_shared_gallery(directory, db):
+    """
+    Build a fresh snapshot from the users collection, for example once in
+    the gunicorn master before the workers start
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _locked(directory):
+        ids, vectors = read_gallery(db)
+        return write_snapshot(directory, ids, vectors)
+
+def _pack_delta(op, user_id, face_encoding=None):
+    vector = np.zeros(ENCODING_SIZE, dtype='<f4') if face_encoding is None else \
+        np.asarray(face_encoding, dtype='<f4').reshape(ENCODING_SIZE)
+    return DELTA_RECORD.pack(op, user_id.encode('ascii'), vector.tobytes())
+
+def append_delta(directory, op, user_id, face_encoding=None):
+    """
+    Record an enrollment or deletion in the live generation's log. Returns
+    the number of records in the log, or None if there is no snapshot yet
+    (the first build reads the users collection anyway).
+    """
+    return append_deltas(directory, [(op, user_id, face_encoding)])
+
+def append_deltas(directory, changes):
+    """
+    Record several (op, user_id, face_encoding) changes with one write
+    """
+    data = b''.join(_pack_delta(*change) for change in changes)
+
+    with _locked(directory):
+        generation = _read_generation(directory)
+        if generation is None:
+            return None
+        fd = os.open(_log_path(directory, generation), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, data)
+            return os.fstat(fd).st_size // DELTA_RECORD.size
+        finally:
+            os.close(fd)
+
+def compact(directory, min_records=0):
+    """
+    Fold the delta log into a new snapshot generation. The lock is only
+    held to read the log and to publish the result, so enrollments keep
+    appending while the gallery is rewritten; records they add meanwhile
+    carry over to the new generation's log. Returns the new generation, or
+    None if there was nothing to do or another process compacted first.
+    """
+    with _locked(directory):
+        generation = _read_generation(directory)
+        if generation is None:
+            return None
+        with open(_log_path(directory, generation), 'rb') as f:
+            data = f.read()
+    if len(data) // DELTA_RECORD.size < max(min_records, 1):
+        return None
+
+    try:
+        snapshot = _Snapshot(directory, generation)
+    except FileNotFoundError:
+        # Another process compacted after the log was read
+        return None
+    overlay = _Overlay()
+    consumed = overlay.apply(data, snapshot)
+
+    keep = np.ones(len(snapshot.ids), dtype=bool)
+    keep[list(overlay.dead_rows)] = False
+    n = len(overlay.index)
+    ids = np.concatenate([snapshot.ids[keep], np.asarray(overlay.index._ids[:n].tolist(), dtype=ID_DTYPE)])
+    vectors = np.concatenate([snapshot.vectors[keep], overlay.index._vectors[:n]])
+    staging = _stage_snapshot(directory, ids, vectors)
+
+    with _locked(directory):
+        if _read_generation(directory) != generation:
+            shutil.rmtree(staging, ignore_errors=True)
+            return None
+        with open(_log_path(directory, generation), 'rb') as f:
+            f.seek(consumed)
+            tail = f.read()
+        return _publish_snapshot(directory, staging, tail)
+
+class _Snapshot:
+    """
+    Read-only memory maps of one snapshot generation
+    """
+    def __init__(self, directory, generation):
+        path = _snapshot_path(directory, generation)
+        self.generation = generation
+        self.built_at = os.path.getmtime(path)
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        self.sq_norms = np.load(os.path.join(path, 'sq_norms.npy'), mmap_mode='r')
+        self.ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode='r')
+
+    def row(self, user_id):
+        key = np.array(user_id.encode('ascii'), dtype=ID_DTYPE)
+        row = int(np.searchsorted(self.ids, key))
+        if row < len(self.ids) and self.ids[row] == key:
+            return row
+        return None
+
+class _Overlay:
+    """
+    A worker's private view of the deltas: snapshot rows that are deleted
+    or replaced, and the current encodings of users added or replaced
+    """
+    def __init__(self):
+        self.dead_rows = set()
+        self.index = FaceIndex(capacity=64)
+        self.records = 0
+
+    def apply(self, data, snapshot):
+        """
+        Replay whole records from `data`; returns the bytes consumed
+        """
+        size = len(data) - len(data) % DELTA_RECORD.size
+        for op, user_id, vector in DELTA_RECORD.iter_unpack(data[:size]):
+            user_id = user_id.decode('ascii')
+            row = snapshot.row(user_id)
+            if row is not None:
+                self.dead_rows.add(row)
+            if op == ADD:
+                self.index.add(user_id, np.frombuffer(vector, dtype='<f4'))
+            else:
+                self.index.remove(user_id)
+        self.records += size // DELTA_RECORD.size
+        return size
+
+class SharedFaceIndex:
+    """
+    Face index over a snapshot mapped from `directory`, shared by every
+    process on the host, plus the deltas logged since it was written
+    """
+    def __init__(self, directory, sync_interval=1.0, compact_records=10000, max_age=86400):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.compact_records = compact_records
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._overlay = _Overlay()
+        self._log_offset = 0
+        self._synced_at = 0.0
+        self._compacting = False
+        self.loaded = False
+
+    def __len__(self):
+        with self._lock:
+            if self._snapshot is None:
+                return 0
+            return len(self._snapshot.ids) - len(self._overlay.dead_rows) + len(self._overlay.index)
+
+    def load(self, db):
+        """
+        Map the current snapshot, building it from the users collection
+        first if there is none or it is older than `max_age` seconds
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            generation = _read_generation(self.directory)
+            if generation is None or self._is_stale(generation):
+                with _locked(self.directory):
+                    # Another worker may have built it while we waited
+                    generation = _read_generation(self.directory)
+                    if generation is None or self._is_stale(generation):
+                        ids, vectors = read_gallery(db)
+                        generation = write_snapshot(self.directory, ids, vectors)
+            self._open(generation)
+            self.loaded = True
+
+    def add(self, user_id, face_encoding):
+        """
+        Log an enrolled or replaced centroid and apply it locally
+        """
+        self._append(ADD, user_id, face_encoding)
+
+    def remove(self, user_id):
+        """
+        Log a deleted face and apply it locally
+        """
+        self._append(DELETE, user_id)
+        return True
+
+    def search(self, probe, k=1):
+        """
+        Return up to k (user_id, distance) pairs closest to the probe encoding
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(ENCODING_SIZE)
+
+        with self._lock:
+            self._maybe_sync()
+            snapshot = self._snapshot
+            matches = self._overlay.index.search(probe, k)
+
+            n = len(snapshot.ids)
+            if n:
+                # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2, straight off the shared pages
+                sq_distances = snapshot.sq_norms - 2.0 * (snapshot.vectors @ probe)
+                sq_distances += probe.dot(probe)
+                if self._overlay.dead_rows:
+                    sq_distances[list(self._overlay.dead_rows)] = np.inf
+
+                k_base = min(k, n)
+                top = np.argpartition(sq_distances, k_base - 1)[:k_base] if k_base < n else np.arange(n)
+                for row in top:
+                    if np.isfinite(sq_distances[row]):
+                        distance = float(np.sqrt(max(sq_distances[row], 0.0)))
+                        matches.append((snapshot.ids[row].decode('ascii'), distance))
+
+        matches.sort(key=lambda match: match[1])
+        return matches[:k]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'generation': self._snapshot.generation if self._snapshot else None,
+                'snapshot_size': len(self._snapshot.ids) if self._snapshot else 0,
+                'delta_records': self._overlay.records,
+                'overlay_size': len(self._overlay.index),
+                'dead_rows': len(self._overlay.dead_rows)
+            }
+
+    def _is_stale(self, generation):
+        try:
+            built_at = os.path.getmtime(_snapshot_path(self.directory, generation))
+        except FileNotFoundError:
+            return True
+        return self.max_age and time.time() - built_at > self.max_age
+
+    def _open(self, generation):
+        # A compaction elsewhere may remove the generation just read from CURRENT
+        while True:
+            try:
+                snapshot = _Snapshot(self.directory, generation)
+                break
+            except FileNotFoundError:
+                latest = _read_generation(self.directory)
+                if latest is None or latest == generation:
+                    raise
+                generation = latest
+        self._snapshot = snapshot
+        self._overlay = _Overlay()
+        self._log_offset = 0
+        self._sync()
+
+    def _append(self, op, user_id, face_encoding=None):
+        records = append_delta(self.directory, op, user_id, face_encoding)
+        with self._lock:
+            if self._snapshot is not None:
+                self._sync()
+        if records is not None and records >= self.compact_records:
+            self._start_compaction()
+
+    def _start_compaction(self):
+        # Rewriting the gallery is left to a background thread rather than
+        # the request that crossed the threshold
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact, name='face-index-compact', daemon=True).start()
+
+    def _compact(self):
+        try:
+            compact(self.directory, min_records=self.compact_records)
+        except Exception:
+            logger.warning('Shared face index compaction failed', exc_info=True)
+        finally:
+            self._compacting = False
+
+    def _maybe_sync(self):
+        if time.monotonic() - self._synced_at >= self.sync_interval:
+            self._sync()
+
+    def _sync(self):
+        # Switch to a newer generation after a compaction elsewhere
+        generation = _read_generation(self.directory)
+        if generation is not None and generation != self._snapshot.generation:
+            self._open(generation)
+            return
+
+        try:
+            with open(_log_path(self.directory, self._snapshot.generation), 'rb') as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            # Compacted between reading CURRENT and opening the log
+            generation = _read_generation(self.directory)
+            if generation is not None and generation != self._snapshot.generation:
+                self._open(generation)
+            return
+
+        self._log_offset += self._overlay.apply(data, self._snapshot)
+        self._synced_at = time.monotonic()
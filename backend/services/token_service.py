@@ -0,0 +1,183 @@
+# Access token verification
+# Every authenticated request and every page navigation checks a token, so
+# decoded claims are cached under a digest of the token until it expires,
+# and the user behind it is cached for a few seconds. Revoked token ids are
+# kept in memory and picked up from the revoked_tokens collection, which
+# other processes write to, at most every TOKEN_REVOCATION_SYNC_INTERVAL
+# seconds.
+import datetime
+import hashlib
+import logging
+import threading
+import time
+import jwt
+from pymongo.errors import PyMongoError
+from repositories.user_repository import UserRepository, to_object_id
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class TokenRevoked(jwt.InvalidTokenError):
+    """
+    Raised for a validly signed token that has been revoked
+    """
+
+def token_key(token):
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+class TokenVerifier:
+    def __init__(self, secret, max_entries, user_ttl, sync_interval, cache_enabled=True):
+        self.secret = secret
+        self.sync_interval = sync_interval
+        self._claims = TTLCache(max_entries, ttl=0) if cache_enabled else None
+        self._users = TTLCache(max_entries, ttl=user_ttl) if cache_enabled else None
+        # Revoked jti -> exp (epoch seconds), dropped once the token expires anyway
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self._synced_at = None
+        self._next_sync = 0.0
+
+    def verify(self, token, db):
+        """
+        Return the token's claims, raising jwt.InvalidTokenError (or one of
+        its subclasses) for an invalid, expired or revoked token
+        """
+        payload = self._claims.get(token_key(token)) if self._claims is not None else None
+        if payload is None:
+            payload = jwt.decode(token, self.secret, algorithms=['HS256'])
+            self._cache_claims(token, payload)
+
+        self._sync_revocations(db)
+        if payload.get('jti') in self._revoked:
+            raise TokenRevoked()
+
+        return payload
+
+    def find_user(self, user_id, db):
+        """
+        Return the id and email of the token's user, or None if it no longer
+        exists. Found users are cached briefly; missing ones are not.
+        """
+        object_id = to_object_id(user_id)
+        if object_id is None:
+            return None
+
+        if self._users is not None:
+            user_data = self._users.get(object_id)
+            if user_data is not None:
+                return user_data
+
+        user_data = UserRepository(db).find_profile_by_id(object_id)
+        if user_data is not None and self._users is not None:
+            self._users.put(object_id, user_data)
+
+        return user_data
+
+    def revoke(self, payload, db):
+        """
+        Revoke a token by its jti, here and, through the database, in every
+        other process
+        """
+        jti = payload.get('jti')
+        if not jti:
+            return False
+
+        with self._lock:
+            self._revoked[jti] = payload['exp']
+
+        db.revoked_tokens.update_one(
+            {'_id': jti},
+            {'$set': {
+                'exp': datetime.datetime.utcfromtimestamp(payload['exp']),
+                'revoked_at': datetime.datetime.utcnow()
+            }},
+            upsert=True
+        )
+        return True
+
+    def forget_user(self, user_id):
+        """
+        Drop a cached user, for example after the account is deleted
+        """
+        if self._users is not None:
+            self._users.invalidate(to_object_id(user_id))
+
+    def stats(self):
+        with self._lock:
+            revoked = len(self._revoked)
+        return {
+            'claims': self._claims.stats() if self._claims is not None else None,
+            'users': self._users.stats() if self._users is not None else None,
+            'revoked': revoked
+        }
+
+    def _cache_claims(self, token, payload):
+        if self._claims is None or 'exp' not in payload:
+            return
+        ttl = payload['exp'] - time.time()
+        if ttl > 0:
+            self._claims.put(token_key(token), payload, ttl=ttl)
+
+    def _sync_revocations(self, db):
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+
+        with self._lock:
+            if now < self._next_sync:
+                return
+            self._next_sync = now + self.sync_interval
+            synced_at = self._synced_at
+
+        # Overlap the previous window a little so a write that committed
+        # just before the last sync's clock reading is not missed
+        started = datetime.datetime.utcnow()
+        query = {'exp': {'$gt': started}}
+        if synced_at is not None:
+            query['revoked_at'] = {'$gte': synced_at - datetime.timedelta(seconds=self.sync_interval)}
+
+        try:
+            revoked = {
+                doc['_id']: doc['exp'].replace(tzinfo=datetime.timezone.utc).timestamp()
+                for doc in db.revoked_tokens.find(query, {'exp': 1})
+            }
+        except PyMongoError:
+            # Keep checking against the revocations already known and try
+            # again after the next interval; the window is not advanced
+            logger.warning('Could not sync revoked tokens', exc_info=True)
+            return
+
+        expired_before = time.time()
+        with self._lock:
+            self._revoked.update(revoked)
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > expired_before}
+            self._synced_at = started
+
+# Process-wide verifier, created on first use
+_token_verifier = None
+_token_verifier_lock = threading.Lock()
+
+def get_token_verifier(config):
+    """
+    Return the shared token verifier
+    """
+    global _token_verifier
+
+    if _token_verifier is None:
+        with _token_verifier_lock:
+            if _token_verifier is None:
+                _token_verifier = TokenVerifier(
+                    secret=config['JWT_SECRET_KEY'],
+                    max_entries=config['TOKEN_CACHE_MAX_ENTRIES'],
+                    user_ttl=config['TOKEN_USER_CACHE_TTL'],
+                    sync_interval=config['TOKEN_REVOCATION_SYNC_INTERVAL'],
+                    cache_enabled=config['TOKEN_CACHE_ENABLED']
+                )
+
+    return _token_verifier
+
+def token_verifier_stats():
+    """
+    Return the verifier counters, or None if no token has been checked yet
+    """
+    return _token_verifier.stats() if _token_verifier is not None else None
@@ -0,0 +1,7 @@
+# Test configuration
+# Tests import the backend modules the way the app does, from the backend
+# directory, whichever directory pytest is started from.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
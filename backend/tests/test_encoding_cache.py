@@ -0,0 +1,115 @@
+# Decoded face encoding cache tests
+import mongomock
+import numpy as np
+import pytest
+from flask import Flask
+from repositories.user_repository import UserRepository
+from services import encoding_cache
+from services.encoding_cache import get_face_template, invalidate_face_template
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class CountingUsers(UserRepository):
+    """
+    UserRepository that records which reads reach the database
+    """
+    def __init__(self, db):
+        super().__init__(db)
+        self.calls = []
+
+    def find_encoding(self, email):
+        self.calls.append('find_encoding')
+        return super().find_encoding(email)
+
+    def find_face_version(self, email):
+        self.calls.append('find_face_version')
+        return super().find_face_version(email)
+
+    def has_password(self, user_id):
+        self.calls.append('has_password')
+        return super().has_password(user_id)
+
+def samples(seed, count=2):
+    return np.random.default_rng(seed).normal(size=(count, 128)).astype(np.float32)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(encoding_cache.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture
+def users(monkeypatch, clock):
+    monkeypatch.setattr(encoding_cache, '_encoding_cache', None)
+    app = Flask(__name__)
+    app.config.update(
+        ENCODING_CACHE_ENABLED=True,
+        ENCODING_CACHE_MAX_ENTRIES=100,
+        ENCODING_CACHE_MAX_BYTES=1 << 20,
+        ENCODING_CACHE_TTL=3600,
+        ENCODING_CACHE_RECHECK_INTERVAL=30
+    )
+    users = CountingUsers(mongomock.MongoClient().db)
+    users.insert({'email': 'a@example.com', 'password_hash': 'hash'})
+    users.set_face_samples('a@example.com', samples(0))
+    with app.app_context():
+        yield users
+
+def test_hit_skips_the_database(users):
+    template = get_face_template(users, 'a@example.com')
+    assert users.calls == ['find_encoding', 'has_password']
+    assert template['has_password']
+    np.testing.assert_array_equal(template['face_samples'], samples(0))
+
+    users.calls.clear()
+    assert get_face_template(users, 'a@example.com') is template
+    assert users.calls == []
+
+def test_hit_rechecks_version_after_interval(users, clock):
+    template = get_face_template(users, 'a@example.com')
+
+    clock.now += 31
+    users.calls.clear()
+    assert get_face_template(users, 'a@example.com') is template
+    assert users.calls == ['find_face_version']
+
+    # The check restarts the interval
+    users.calls.clear()
+    get_face_template(users, 'a@example.com')
+    assert users.calls == []
+
+def test_version_mismatch_rereads_samples(users, clock):
+    get_face_template(users, 'a@example.com')
+    # Another worker replaces the face; this worker's cache is not told
+    users.set_face_samples('a@example.com', samples(1))
+
+    clock.now += 31
+    users.calls.clear()
+    template = get_face_template(users, 'a@example.com')
+    assert users.calls == ['find_face_version', 'find_encoding', 'has_password']
+    np.testing.assert_array_equal(template['face_samples'], samples(1))
+
+def test_face_removed_elsewhere_returns_none(users, clock):
+    get_face_template(users, 'a@example.com')
+    users.unset_face_encoding('a@example.com')
+
+    clock.now += 31
+    assert get_face_template(users, 'a@example.com') is None
+
+def test_invalidate_drops_entry_and_older_reads(users):
+    stale = get_face_template(users, 'a@example.com')
+    user_data = users.set_face_samples('a@example.com', samples(1))
+    invalidate_face_template('a@example.com', user_data['face_version'])
+
+    # A read that started before the write must not be cached again
+    encoding_cache.get_encoding_cache().put('a@example.com', stale)
+    users.calls.clear()
+    template = get_face_template(users, 'a@example.com')
+    assert users.calls == ['find_encoding', 'has_password']
+    assert template['version'] == user_data['face_version']
+    np.testing.assert_array_equal(template['face_samples'], samples(1))
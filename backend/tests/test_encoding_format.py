@@ -0,0 +1,43 @@
+# Stored face encoding format tests
+import numpy as np
+from bson import BSON
+from repositories.encoding_format import (
+    ENCODING_FORMAT_VERSION, ENCODING_SIZE, decode_face_centroid, decode_face_encoding,
+    decode_face_samples, encode_face_encoding, encode_face_samples
+)
+
+def _through_bson(fields):
+    # Read the fields back the way pymongo returns them
+    return BSON.encode(fields).decode()
+
+def test_samples_round_trip():
+    samples = np.random.default_rng(0).normal(0, 0.1, (3, ENCODING_SIZE)).astype(np.float32)
+    stored = _through_bson(encode_face_samples(samples))
+
+    assert stored['face_encoding_format'] == ENCODING_FORMAT_VERSION
+    np.testing.assert_array_equal(decode_face_samples(stored['face_encoding']), samples)
+    np.testing.assert_allclose(decode_face_centroid(stored), samples.mean(axis=0), rtol=1e-6)
+
+def test_single_encoding_round_trip():
+    encoding = np.random.default_rng(1).normal(0, 0.1, ENCODING_SIZE)
+    stored = _through_bson(encode_face_encoding(encoding))
+
+    decoded = decode_face_samples(stored['face_encoding'])
+    assert decoded.shape == (1, ENCODING_SIZE)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded[0], encoding.astype(np.float32))
+    np.testing.assert_array_equal(decode_face_encoding(stored['face_centroid']), encoding.astype(np.float32))
+
+def test_version_1_array_is_read():
+    encoding = np.random.default_rng(2).normal(0, 0.1, ENCODING_SIZE)
+    stored = _through_bson({'face_encoding': encoding.tolist()})
+
+    np.testing.assert_allclose(decode_face_samples(stored['face_encoding'])[0], encoding, rtol=1e-6)
+    np.testing.assert_allclose(decode_face_centroid(stored), encoding, rtol=1e-6)
+
+def test_version_2_binary_is_read():
+    encoding = np.random.default_rng(3).normal(0, 0.1, ENCODING_SIZE).astype('<f4')
+    stored = _through_bson({'face_encoding': encoding.tobytes(), 'face_encoding_format': 2})
+
+    np.testing.assert_array_equal(decode_face_samples(stored['face_encoding']), encoding[None, :])
+    np.testing.assert_array_equal(decode_face_centroid(stored), encoding)
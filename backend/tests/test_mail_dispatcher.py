@@ -0,0 +1,88 @@
+# Mail dispatcher delivery and retry tests
+import smtplib
+import pytest
+from utils import mail_dispatcher
+from utils.mail_dispatcher import MailDispatcher, build_message
+
+class FakeServer:
+    """
+    Scripted SMTP server: each step fails one send_message call, either
+    ('before', error) the message data goes out or ('after', error)
+    """
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.delivered = []
+
+class FakeConnection(mail_dispatcher.SMTPConnection):
+    server = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def send_message(self, message):
+        step = self.server.steps.pop(0) if self.server.steps else None
+        if step and step[0] == 'before':
+            raise step[1]
+        self.data(message.as_bytes())
+        if step:
+            raise step[1]
+        self.server.delivered.append(message['To'])
+
+    def quit(self):
+        pass
+
+@pytest.fixture
+def send(monkeypatch):
+    # The real SMTP.data talks to a socket; SMTPConnection.data still runs
+    monkeypatch.setattr(smtplib.SMTP, 'data', lambda self, msg: (250, b'ok'))
+    dispatchers = []
+
+    def send(server):
+        monkeypatch.setattr(FakeConnection, 'server', server)
+        monkeypatch.setattr(mail_dispatcher, 'SMTPConnection', FakeConnection)
+        dispatcher = MailDispatcher('smtp.test', 25, max_retries=2, retry_backoff=0.01)
+        dispatchers.append(dispatcher)
+        dispatcher.submit(build_message('from@example.com', 'to@example.com', 'Subject', 'Body'))
+        assert dispatcher.flush(timeout=5)
+        return dispatcher.stats()
+
+    yield send
+    for dispatcher in dispatchers:
+        dispatcher.close()
+
+def test_sends_message(send):
+    server = FakeServer()
+    stats = send(server)
+
+    assert server.delivered == ['to@example.com']
+    assert (stats['sent'], stats['retried'], stats['failed']) == (1, 0, 0)
+
+def test_reconnects_once_when_idle_connection_was_closed(send):
+    server = FakeServer(('before', smtplib.SMTPServerDisconnected('closed')))
+    stats = send(server)
+
+    assert server.delivered == ['to@example.com']
+    assert (stats['sent'], stats['retried'], stats['connections']) == (1, 0, 2)
+
+def test_does_not_resend_after_data(send):
+    server = FakeServer(('after', smtplib.SMTPServerDisconnected('closed')))
+    stats = send(server)
+
+    assert server.delivered == []
+    assert (stats['sent'], stats['retried'], stats['failed']) == (0, 0, 1)
+
+def test_refused_recipient_is_not_retried(send):
+    server = FakeServer(('before', smtplib.SMTPRecipientsRefused({'to@example.com': (550, b'no such user')})))
+    stats = send(server)
+
+    assert server.delivered == []
+    assert (stats['retried'], stats['failed']) == (0, 1)
+
+def test_server_error_is_retried_with_backoff(send):
+    # An SMTP reply is an OSError too, but not a dropped connection: it is
+    # retried later rather than resent at once on a new connection
+    server = FakeServer(('after', smtplib.SMTPDataError(451, b'try again later')))
+    stats = send(server)
+
+    assert server.delivered == ['to@example.com']
+    assert (stats['sent'], stats['retried'], stats['failed']) == (1, 1, 0)
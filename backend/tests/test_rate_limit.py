@@ -0,0 +1,131 @@
+# Rate limiting and admission control tests
+import threading
+import pytest
+from flask import Flask
+from pymongo.errors import ServerSelectionTimeoutError
+from utils import rate_limit
+from utils.rate_limit import (
+    ConcurrencyLimiter, MongoRateLimiter, TokenBucketLimiter, check_rate_limit, parse_rate
+)
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    return clock
+
+def test_parse_rate():
+    assert parse_rate('10/60') == (10.0, 10.0 / 60)
+    assert parse_rate('5') == (5.0, 5.0)
+    assert parse_rate('') is None
+    assert parse_rate(None) is None
+
+def test_bucket_allows_capacity_then_refuses(clock):
+    limiter = TokenBucketLimiter()
+    capacity, rate = parse_rate('3/30')
+
+    assert [limiter.acquire('k', capacity, rate)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = limiter.acquire('k', capacity, rate)
+    assert not allowed
+    assert retry_after == pytest.approx(10.0)
+    # Other keys have their own bucket
+    assert limiter.acquire('other', capacity, rate)[0]
+
+def test_bucket_refills_over_time(clock):
+    limiter = TokenBucketLimiter()
+    capacity, rate = parse_rate('2/20')
+    limiter.acquire('k', capacity, rate)
+    limiter.acquire('k', capacity, rate)
+
+    clock.now += 9.0
+    assert not limiter.acquire('k', capacity, rate)[0]
+    clock.now += 1.0
+    assert limiter.acquire('k', capacity, rate)[0]
+    # Idle time never fills a bucket past its capacity
+    clock.now += 1000.0
+    assert [limiter.acquire('k', capacity, rate)[0] for _ in range(3)] == [True, True, False]
+
+def test_bucket_forgets_least_recently_used_keys(clock):
+    limiter = TokenBucketLimiter(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        limiter.acquire(key, 1, 1)
+
+    assert limiter.stats()['keys'] == 2
+    # 'a' was dropped, so it starts full again; 'c' is still empty
+    assert limiter.acquire('a', 1, 1)[0]
+    assert not limiter.acquire('c', 1, 1)[0]
+
+class UnreachableCollection:
+    def find_one_and_update(self, *args, **kwargs):
+        raise ServerSelectionTimeoutError('no servers')
+
+class UnreachableDatabase:
+    rate_limits = UnreachableCollection()
+
+def test_mongo_limiter_falls_back_to_local_buckets(clock):
+    limiter = MongoRateLimiter(UnreachableDatabase(), TokenBucketLimiter())
+
+    assert limiter.acquire('k', 1, 0.1)[0]
+    assert not limiter.acquire('k', 1, 0.1)[0]
+    assert limiter.stats()['errors'] == 2
+    assert limiter.stats()['fallback']['keys'] == 1
+
+def test_concurrency_limiter_caps_holders():
+    limiter = ConcurrencyLimiter(2)
+
+    assert limiter.acquire()
+    assert limiter.acquire()
+    assert not limiter.acquire()
+    assert limiter.stats() == {'limit': 2, 'in_flight': 2, 'rejected': 1}
+    limiter.release()
+    assert limiter.acquire()
+
+def test_concurrency_limiter_waits_for_a_slot():
+    limiter = ConcurrencyLimiter(1, timeout=5.0)
+    limiter.acquire()
+    threading.Timer(0.05, limiter.release).start()
+
+    assert limiter.acquire()
+    assert limiter.in_flight == 1
+
+@pytest.fixture
+def app(monkeypatch, clock):
+    monkeypatch.setattr(rate_limit, '_rate_limiter', None)
+    app = Flask(__name__)
+    app.config.update(
+        RATE_LIMIT_ENABLED=True,
+        RATE_LIMIT_BACKEND='local',
+        RATE_LIMIT_MAX_KEYS=1000,
+        RATE_LIMIT_TRUST_FORWARDED=False,
+        RATE_LIMITS={'face_login': {'ip': '3/60', 'email': '2/60'}}
+    )
+    return app
+
+def attempt(app, email=None, ip='10.0.0.1'):
+    with app.test_request_context(environ_base={'REMOTE_ADDR': ip}):
+        return check_rate_limit('face_login', None, email)
+
+def test_email_limit_applies_across_addresses(app):
+    assert attempt(app, 'A@example.com', '10.0.0.1') is None
+    assert attempt(app, 'a@example.com', '10.0.0.2') is None
+
+    limited = attempt(app, 'a@example.com', '10.0.0.3')
+    assert limited['code'] == 'rate_limited'
+    assert limited['retry_after'] == 30
+
+def test_ip_limit_applies_across_emails(app):
+    for number in range(3):
+        assert attempt(app, f'user{number}@example.com') is None
+    assert attempt(app, 'other@example.com')['code'] == 'rate_limited'
+    assert attempt(app, 'other@example.com', '10.0.0.9') is None
+
+def test_disabled_rate_limit_allows_everything(app):
+    app.config['RATE_LIMIT_ENABLED'] = False
+    assert all(attempt(app, 'a@example.com') is None for _ in range(10))
@@ -0,0 +1,142 @@
+# Shared face index tests
+import os
+import time
+import numpy as np
+import pytest
+from bson import ObjectId
+from repositories.encoding_format import ENCODING_SIZE
+from services.shared_face_index import (
+    ADD, DELETE, SharedFaceIndex, _locked, _read_generation, append_deltas, compact, write_snapshot
+)
+
+@pytest.fixture
+def gallery(tmp_path):
+    rng = np.random.default_rng(0)
+    ids = [str(ObjectId()) for _ in range(200)]
+    vectors = rng.normal(0, 0.1, (len(ids), ENCODING_SIZE)).astype(np.float32)
+    with _locked(str(tmp_path)):
+        write_snapshot(str(tmp_path), ids, vectors)
+    return str(tmp_path), dict(zip(ids, vectors))
+
+def open_index(directory, **options):
+    index = SharedFaceIndex(directory, sync_interval=0, **options)
+    index.load(None)
+    return index
+
+def assert_matches(index, expected):
+    assert len(index) == len(expected)
+    for user_id, vector in expected.items():
+        found, distance = index.search(vector, k=1)[0]
+        assert found == user_id
+        # ||x||^2 - 2 x.q + ||q||^2 in float32 is not exactly zero
+        assert distance < 1e-3
+
+def random_vector(rng):
+    return rng.normal(0, 0.1, ENCODING_SIZE).astype(np.float32)
+
+def test_search_finds_snapshot_users(gallery):
+    directory, expected = gallery
+    assert_matches(open_index(directory), expected)
+
+def test_deltas_replay_in_other_processes(gallery):
+    directory, expected = gallery
+    writer = open_index(directory, compact_records=10 ** 6)
+    reader = open_index(directory, compact_records=10 ** 6)
+    rng = np.random.default_rng(1)
+
+    added = str(ObjectId())
+    expected[added] = random_vector(rng)
+    writer.add(added, expected[added])
+    replaced = next(iter(expected))
+    expected[replaced] = random_vector(rng)
+    writer.add(replaced, expected[replaced])
+    removed = list(expected)[5]
+    del expected[removed]
+    writer.remove(removed)
+
+    reader.search(expected[added])
+    assert_matches(reader, expected)
+    assert all(user_id != removed for user_id, _ in reader.search(np.zeros(ENCODING_SIZE), k=len(expected)))
+
+def test_compaction_keeps_every_change(gallery):
+    directory, expected = gallery
+    index = open_index(directory, compact_records=10 ** 6)
+    rng = np.random.default_rng(2)
+    generation = _read_generation(directory)
+
+    for user_id in list(expected)[:20]:
+        del expected[user_id]
+        index.remove(user_id)
+    for _ in range(30):
+        user_id = str(ObjectId())
+        expected[user_id] = random_vector(rng)
+        index.add(user_id, expected[user_id])
+
+    assert compact(directory) == generation + 1
+    assert not os.path.exists(os.path.join(directory, f'gen-{generation}'))
+    # The writer switches over on its next sync; a new process starts from the snapshot
+    assert_matches(index, expected)
+    fresh = open_index(directory)
+    assert fresh.stats()['delta_records'] == 0
+    assert_matches(fresh, expected)
+
+def test_compaction_carries_over_records_appended_meanwhile(gallery, monkeypatch):
+    directory, expected = gallery
+    rng = np.random.default_rng(3)
+    late = str(ObjectId())
+    expected[late] = random_vector(rng)
+
+    first = str(ObjectId())
+    expected[first] = random_vector(rng)
+    append_deltas(directory, [(ADD, first, expected[first])])
+
+    # Append while compaction is folding the log outside the lock
+    import services.shared_face_index as shared_face_index
+    stage = shared_face_index._stage_snapshot
+
+    def stage_then_append(*args):
+        staging = stage(*args)
+        append_deltas(directory, [(ADD, late, expected[late])])
+        return staging
+
+    monkeypatch.setattr(shared_face_index, '_stage_snapshot', stage_then_append)
+    compact(directory)
+
+    index = open_index(directory)
+    assert index.stats()['delta_records'] == 1
+    assert_matches(index, expected)
+
+def test_compaction_skips_short_logs(gallery):
+    directory, _ = gallery
+    generation = _read_generation(directory)
+    append_deltas(directory, [(DELETE, str(ObjectId()), None)])
+
+    assert compact(directory, min_records=2) is None
+    assert _read_generation(directory) == generation
+
+def test_open_follows_a_removed_generation(gallery):
+    directory, expected = gallery
+    index = SharedFaceIndex(directory)
+    generation = _read_generation(directory)
+    append_deltas(directory, [(DELETE, next(iter(expected)), None)])
+    compact(directory)
+
+    index._open(generation)
+    assert index.stats()['generation'] == generation + 1
+
+def test_crossing_the_threshold_compacts_in_the_background(gallery):
+    directory, expected = gallery
+    index = open_index(directory, compact_records=5)
+    generation = _read_generation(directory)
+    rng = np.random.default_rng(4)
+
+    for _ in range(5):
+        user_id = str(ObjectId())
+        expected[user_id] = random_vector(rng)
+        index.add(user_id, expected[user_id])
+
+    deadline = time.monotonic() + 10
+    while _read_generation(directory) == generation and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _read_generation(directory) == generation + 1
+    assert_matches(index, expected)
@@ -0,0 +1,69 @@
+# Token verification and revocation tests
+import time
+import jwt
+import mongomock
+import pytest
+from services.token_service import TokenRevoked, TokenVerifier
+
+SECRET = 'test-secret-key-of-at-least-32-bytes'
+
+def make_token(jti='token-1', ttl=3600):
+    return jwt.encode({'sub': 'user', 'jti': jti, 'exp': int(time.time()) + ttl}, SECRET, algorithm='HS256')
+
+def make_verifier(sync_interval=0):
+    return TokenVerifier(SECRET, max_entries=100, user_ttl=30, sync_interval=sync_interval)
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+def test_verifies_and_caches_claims(db):
+    verifier = make_verifier()
+    token = make_token()
+
+    assert verifier.verify(token, db)['jti'] == 'token-1'
+    assert verifier.verify(token, db)['jti'] == 'token-1'
+    assert verifier.stats()['claims']['hits'] == 1
+
+def test_rejects_bad_signature(db):
+    token = jwt.encode({'sub': 'user', 'exp': int(time.time()) + 60}, 'another-secret-key-of-32-bytes!!', algorithm='HS256')
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        make_verifier().verify(token, db)
+
+def test_revoked_here_is_rejected_at_once(db):
+    verifier = make_verifier(sync_interval=60)
+    token = make_token()
+    payload = verifier.verify(token, db)
+
+    assert verifier.revoke(payload, db)
+    with pytest.raises(TokenRevoked):
+        verifier.verify(token, db)
+
+def test_revoked_by_another_process_is_rejected_after_sync(db):
+    verifier = make_verifier(sync_interval=0)
+    other_process = make_verifier(sync_interval=0)
+    token = make_token()
+    # The claims are cached now; revocation must still win over the cache
+    verifier.verify(token, db)
+
+    other_process.revoke(jwt.decode(token, SECRET, algorithms=['HS256']), db)
+
+    with pytest.raises(TokenRevoked):
+        verifier.verify(token, db)
+    assert verifier.stats()['revoked'] == 1
+    # Other tokens are unaffected
+    assert verifier.verify(make_token(jti='token-2'), db)['jti'] == 'token-2'
+
+def test_revocations_are_not_read_before_the_sync_interval(db):
+    verifier = make_verifier(sync_interval=60)
+    token = make_token()
+    verifier.verify(token, db)
+
+    make_verifier().revoke(jwt.decode(token, SECRET, algorithms=['HS256']), db)
+
+    assert verifier.verify(token, db)['jti'] == 'token-1'
+
+def test_revoke_without_jti_is_refused(db):
+    assert not make_verifier().revoke({'sub': 'user', 'exp': int(time.time()) + 60}, db)
+    assert db.revoked_tokens.count_documents({}) == 0
@@ -0,0 +1,46 @@
+# Access token checks for protected routes
+from functools import wraps
+from flask import request, jsonify, current_app
+import jwt
+from extensions import mongo
+from services.token_service import get_token_verifier
+from utils.metrics import timer
+
+def bearer_token():
+    """
+    Return the token from the Authorization header, or None
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return auth_header.split(' ')[1]
+
+def token_required(f):
+    """
+    Reject the request unless it carries a valid, unrevoked access token;
+    the caller's id and email are put on request.user
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = bearer_token()
+        if not token:
+            return jsonify({'success': False, 'message': 'No token provided'}), 401
+        
+        try:
+            with timer('token_verify'):
+                payload = get_token_verifier(current_app.config).verify(token, mongo.db)
+        except jwt.ExpiredSignatureError:
+            return jsonify({'success': False, 'message': 'Token expired'}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({'success': False, 'message': 'Invalid token'}), 401
+        
+        # Add user info to request
+        request.user = {
+            'id': payload['sub'],
+            'email': payload['email']
+        }
+        request.token_payload = payload
+        
+        return f(*args, **kwargs)
+    
+    return decorated
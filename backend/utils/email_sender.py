@@ -1,14 +1,12 @@
 # Email sender for password reset
 from flask import current_app
-from flask_mail import Mail, Message
+from utils.mail_dispatcher import build_message, get_mail_dispatcher
 
 def send_password_reset_email(recipient, reset_url):
     """
-    Send password reset email to user
+    Queue password reset email to user; the mail dispatcher sends it in
+    the background. Returns False if the mail queue is full.
     """
-    # Initialize Flask-Mail
-    mail = Mail(current_app)
-    
     # Create email message
     subject = "Password Reset Request"
     body = f"""
@@ -24,15 +22,7 @@ def send_password_reset_email(recipient, reset_url):
     The Face Auth Team
     """
     
-    msg = Message(
-        subject=subject,
-        recipients=[recipient],
-        body=body
-    )
+    config = current_app.config
+    msg = build_message(config['MAIL_DEFAULT_SENDER'] or config['MAIL_USERNAME'], recipient, subject, body)
     
-    try:
-        mail.send(msg)
-        return True
-    except Exception as e:
-        current_app.logger.error(f"Failed to send email: {str(e)}")
-        return False
\ No newline at end of file
+    return get_mail_dispatcher(config).submit(msg)
\ No newline at end of file
@@ -0,0 +1,300 @@
+# Background outbound mail dispatcher
+# Requests only queue a message; a worker thread sends queued messages in
+# batches over one SMTP connection that it keeps open between batches and
+# closes after MAIL_IDLE_TIMEOUT seconds without mail. Failed messages are
+# retried with exponential backoff up to MAIL_MAX_RETRIES times, except
+# when the connection broke after the message data was sent: the server
+# may have delivered it, so it is given up on rather than sent twice.
+import atexit
+import heapq
+import itertools
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from utils.metrics import timer, count
+
+logger = logging.getLogger(__name__)
+
+class MessageInDoubt(Exception):
+    """
+    The connection failed after the message data was handed to the server,
+    which may already have accepted it
+    """
+
+# Errors that mean the connection is gone rather than the message is bad.
+# Every SMTPException is an OSError, so OSError itself cannot be listed.
+TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError)
+
+# Errors after which the message is not sent again: no retry will fix the
+# first two, and resending a message in doubt could deliver it twice
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, MessageInDoubt)
+
+class SMTPConnection(smtplib.SMTP):
+    """
+    SMTP client that notes when a message's data started going out
+    """
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+class MailDispatcher:
+    def __init__(self, server, port, use_tls=False, username=None, password=None,
+                 queue_size=1000, batch_size=20, idle_timeout=30, max_retries=5,
+                 retry_backoff=2.0, connect_timeout=10):
+        self.server = server
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.connect_timeout = connect_timeout
+        self._queue = queue.Queue(queue_size)
+        # (due, sequence, attempt, message) for messages waiting to be retried
+        self._retries = []
+        self._sequence = itertools.count()
+        self._connection = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._busy = 0
+        self._closed = False
+        self._queued = 0
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._dropped = 0
+        self._batches = 0
+        self._connections = 0
+        self._thread = threading.Thread(target=self._work, name='mail-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, message):
+        """
+        Queue a message for sending. Returns False if the queue is full.
+        """
+        try:
+            self._queue.put_nowait((0, message))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            logger.error('Mail queue full, dropping message to %s', message['To'])
+            count('emails', result='dropped')
+            return False
+
+        with self._lock:
+            self._queued += 1
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued message has been sent or given up on.
+        Returns False if `timeout` passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._queue.unfinished_tasks or self._retries or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(0.05 if remaining is None else min(0.05, remaining))
+        return True
+
+    def close(self, timeout=5):
+        self.flush(timeout)
+        self._closed = True
+        self._disconnect()
+
+    def stats(self):
+        """
+        Return queue depth and delivery counters for monitoring
+        """
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'waiting_retry': len(self._retries),
+                'queued': self._queued,
+                'sent': self._sent,
+                'failed': self._failed,
+                'retried': self._retried,
+                'dropped': self._dropped,
+                'batches': self._batches,
+                'connections': self._connections
+            }
+
+    def _work(self):
+        while not self._closed:
+            batch = self._next_batch()
+            if batch:
+                self._send_batch(batch)
+            elif self._connection is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                self._disconnect()
+
+    def _next_batch(self):
+        """
+        Collect up to batch_size messages: due retries first, then new mail
+        """
+        batch = []
+        now = time.monotonic()
+        with self._lock:
+            while self._retries and self._retries[0][0] <= now and len(batch) < self.batch_size:
+                _, _, attempt, message = heapq.heappop(self._retries)
+                batch.append((attempt, message, False))
+            wait = self._retries[0][0] - now if self._retries else 1.0
+            # Retries taken off the heap count as busy until sent, so
+            # flush() never sees them in neither place
+            claimed = bool(batch)
+            if claimed:
+                self._busy += 1
+
+        try:
+            if not batch:
+                batch.append(self._queue.get(timeout=max(0.01, min(wait, 1.0))) + (True,))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait() + (True,))
+        except queue.Empty:
+            pass
+
+        if batch and not claimed:
+            with self._lock:
+                self._busy += 1
+        return batch
+
+    def _send_batch(self, batch):
+        with self._lock:
+            self._batches += 1
+
+        for attempt, message, from_queue in batch:
+            try:
+                with timer('email_send'):
+                    self._send(message)
+            except PERMANENT_ERRORS as e:
+                self._give_up(attempt, message, e)
+            except Exception as e:
+                self._disconnect()
+                self._retry(attempt, message, e)
+            else:
+                with self._lock:
+                    self._sent += 1
+                count('emails', result='sent')
+            if from_queue:
+                self._queue.task_done()
+
+        self._last_used = time.monotonic()
+        self._finish()
+
+    def _send(self, message):
+        try:
+            self._send_once(message)
+        except TRANSIENT_ERRORS:
+            # The server may have closed an idle connection; reconnect once
+            self._disconnect()
+            self._send_once(message)
+
+    def _send_once(self, message):
+        connection = self._connect()
+        connection.data_started = False
+        try:
+            connection.send_message(message)
+        except smtplib.SMTPResponseException:
+            # The server answered, so it did not take the message
+            raise
+        except Exception as e:
+            if connection.data_started:
+                self._disconnect()
+                raise MessageInDoubt(f'connection failed after DATA: {e!r}') from e
+            raise
+
+    def _retry(self, attempt, message, error):
+        if attempt >= self.max_retries:
+            self._give_up(attempt, message, error)
+            return
+
+        due = time.monotonic() + self.retry_backoff * (2 ** attempt)
+        count('emails', result='retried')
+        with self._lock:
+            self._retried += 1
+            heapq.heappush(self._retries, (due, next(self._sequence), attempt + 1, message))
+        logger.warning('Mail to %s failed, retrying: %s', message['To'], error)
+
+    def _give_up(self, attempt, message, error):
+        count('emails', result='failed')
+        with self._lock:
+            self._failed += 1
+        logger.error('Giving up on mail to %s after %d attempts: %s', message['To'], attempt + 1, error)
+
+    def _connect(self):
+        if self._connection is None:
+            connection = SMTPConnection(self.server, self.port, timeout=self.connect_timeout)
+            if self.use_tls:
+                connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password)
+            self._connection = connection
+            with self._lock:
+                self._connections += 1
+        return self._connection
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.quit()
+            except Exception:
+                connection.close()
+
+    def _finish(self):
+        with self._idle:
+            self._busy -= 1
+            self._idle.notify_all()
+
+def build_message(sender, recipient, subject, body):
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
+
+# Process-wide dispatcher, created on first use
+_mail_dispatcher = None
+_mail_dispatcher_lock = threading.Lock()
+
+def get_mail_dispatcher(config):
+    """
+    Return the shared dispatcher, starting its worker on first use
+    """
+    global _mail_dispatcher
+
+    if _mail_dispatcher is None:
+        with _mail_dispatcher_lock:
+            if _mail_dispatcher is None:
+                _mail_dispatcher = MailDispatcher(
+                    server=config['MAIL_SERVER'],
+                    port=config['MAIL_PORT'],
+                    use_tls=config['MAIL_USE_TLS'],
+                    username=config['MAIL_USERNAME'],
+                    password=config['MAIL_PASSWORD'],
+                    queue_size=config['MAIL_QUEUE_SIZE'],
+                    batch_size=config['MAIL_BATCH_SIZE'],
+                    idle_timeout=config['MAIL_IDLE_TIMEOUT'],
+                    max_retries=config['MAIL_MAX_RETRIES'],
+                    retry_backoff=config['MAIL_RETRY_BACKOFF']
+                )
+                # Give queued mail a moment to go out on a clean shutdown
+                atexit.register(_mail_dispatcher.close, config['MAIL_SHUTDOWN_TIMEOUT'])
+
+    return _mail_dispatcher
+
+def mail_dispatcher_stats():
+    """
+    Return the dispatcher counters, or None if no mail has been queued yet
+    """
+    return _mail_dispatcher.stats() if _mail_dispatcher is not None else None
@@ -0,0 +1,183 @@
+# Latency histograms and outcome counters
+# Hot paths wrap their stages in timer('stage') and bump outcome counters
+# with count(). Both return straight away while metrics are disabled.
+# init_metrics() turns them on, serves the Prometheus text format at
+# /metrics and, if SERVER_TIMING_ENABLED is set, reports the request's
+# stage timings in a Server-Timing response header. Every process keeps
+# its own numbers.
+import bisect
+import threading
+import time
+from flask import Response, g, has_request_context, request
+
+# Seconds; covers a token check through a slow face extraction
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        # label value -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[slot] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, values):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += values[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        # sorted (label, value) pairs -> count
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            labels = ','.join(f'{label}="{label_value}"' for label, label_value in key)
+            lines.append(f'{self.name}{{{labels}}} {value}' if labels else f'{self.name} {value}')
+        return lines
+
+STAGE_SECONDS = Histogram('faceauth_stage_seconds', 'Time spent in each hot-path stage', 'stage')
+REQUEST_SECONDS = Histogram('faceauth_request_seconds', 'Request handling time per endpoint', 'endpoint')
+COUNTERS = {
+    'face_extractions': Counter('faceauth_face_extractions_total', 'Face extraction outcomes'),
+    'face_matches': Counter('faceauth_face_matches_total', 'Face comparison outcomes'),
+    'logins': Counter('faceauth_logins_total', 'Login outcomes'),
+    'emails': Counter('faceauth_emails_total', 'Outbound mail outcomes'),
+    'rate_limited': Counter('faceauth_rate_limited_total', 'Attempts refused by a rate limit'),
+    'face_admission': Counter('faceauth_face_admission_total', 'Face extractions admitted or refused by the concurrency cap')
+}
+
+# (name, help, fn) sampled on every scrape; fn returns a number or None
+GAUGES = []
+
+_enabled = False
+_server_timing = False
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+def timer(stage):
+    """
+    Context manager timing a stage; a shared no-op while metrics are off
+    """
+    return _Timer(stage) if _enabled else _NULL_TIMER
+
+def observe(stage, seconds):
+    """
+    Record a stage duration measured elsewhere, for example in a worker process
+    """
+    if not _enabled:
+        return
+    STAGE_SECONDS.observe(stage, seconds)
+    if _server_timing and has_request_context():
+        timings = g.get('server_timing')
+        if timings is None:
+            timings = g.server_timing = []
+        timings.append((stage, seconds))
+
+def count(name, **labels):
+    """
+    Bump one of the COUNTERS with the given labels
+    """
+    if _enabled:
+        COUNTERS[name].inc(labels)
+
+def register_gauge(name, help_text, fn):
+    GAUGES.append((name, help_text, fn))
+
+def render():
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render()
+    for counter in COUNTERS.values():
+        lines += counter.render()
+    for name, help_text, fn in GAUGES:
+        value = fn()
+        if value is not None:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+def init_metrics(app):
+    """
+    Enable instrumentation for the app and add the /metrics endpoint
+    """
+    global _enabled, _server_timing
+
+    _enabled = app.config['METRICS_ENABLED']
+    _server_timing = _enabled and app.config['SERVER_TIMING_ENABLED']
+    if not _enabled:
+        return
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(request.endpoint or 'unmatched', elapsed)
+
+        if _server_timing:
+            entries = [f'{stage};dur={seconds * 1000.0:.2f}' for stage, seconds in g.get('server_timing', ())]
+            entries.append(f'total;dur={elapsed * 1000.0:.2f}')
+            response.headers['Server-Timing'] = ', '.join(entries)
+        return response
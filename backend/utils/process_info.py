@@ -0,0 +1,64 @@
+# Process startup time and memory usage
+import os
+import sys
+import time
+
+# smaps_rollup fields reported, in kB
+MEMORY_FIELDS = {
+    'Rss': 'rss_bytes',
+    'Pss': 'pss_bytes',
+    'Shared_Clean': 'shared_clean_bytes',
+    'Shared_Dirty': 'shared_dirty_bytes',
+    'Private_Clean': 'private_clean_bytes',
+    'Private_Dirty': 'private_dirty_bytes'
+}
+
+_started_at = time.monotonic()
+_startup_seconds = None
+
+def record_startup(seconds):
+    global _startup_seconds
+    _startup_seconds = seconds
+
+def memory_usage():
+    """
+    Return this process's memory use. On Linux shared and private pages
+    are split out, which shows how much of the face models a forked worker
+    shares with the master; elsewhere only the peak RSS is known.
+    """
+    try:
+        usage = {}
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                field, _, value = line.partition(':')
+                if field in MEMORY_FIELDS:
+                    usage[MEMORY_FIELDS[field]] = int(value.split()[0]) * 1024
+        return usage
+    except OSError:
+        import resource
+        # ru_maxrss is in bytes on macOS and kB elsewhere
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return {'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale}
+
+def peak_memory_bytes():
+    """
+    Return the highest resident memory this process has used so far
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def process_stats():
+    return {
+        'pid': os.getpid(),
+        'startup_seconds': _startup_seconds,
+        'uptime_seconds': time.monotonic() - _started_at,
+        'memory': memory_usage()
+    }
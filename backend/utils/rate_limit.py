@@ -0,0 +1,221 @@
+# Rate limiting and admission control for face endpoints
+# Every face attempt takes a token from a bucket per client IP and, when
+# the request names one, per email, before any face work starts. Buckets
+# live in process memory, or in MongoDB so every worker and host shares
+# them; if MongoDB cannot be reached the local buckets stand in. Separately,
+# FACE_MAX_CONCURRENT caps how many extractions run at once in a process,
+# so overload turns into quick 503s instead of a growing queue.
+import datetime
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from utils.metrics import count
+
+logger = logging.getLogger(__name__)
+
+def parse_rate(rate):
+    """
+    Turn '10/60' (10 attempts per 60 seconds) into (capacity, tokens per
+    second); None or an empty string means unlimited
+    """
+    if not rate:
+        return None
+    attempts, _, seconds = str(rate).partition('/')
+    capacity = float(attempts)
+    return capacity, capacity / float(seconds or 1)
+
+class TokenBucketLimiter:
+    """
+    In-process token buckets, one per key, created full. The least
+    recently used buckets are dropped beyond `max_keys`; a dropped bucket
+    would have refilled anyway unless its key was very busy.
+    """
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, capacity, refill_rate):
+        """
+        Take one token; returns (allowed, seconds until one is available)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, 0.0 if allowed else (1.0 - tokens) / refill_rate
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'local', 'keys': len(self._buckets)}
+
+class MongoRateLimiter:
+    """
+    Token buckets in the rate_limits collection, refilled and taken from
+    in one atomic update so every worker sees the same count. A TTL index
+    drops buckets once they would be full again.
+    """
+    def __init__(self, db, fallback):
+        self.collection = db.rate_limits
+        self.fallback = fallback
+        self._errors = 0
+
+    def acquire(self, key, capacity, refill_rate):
+        now = time.time()
+        refilled = {'$min': [capacity, {'$add': [
+            {'$ifNull': ['$tokens', capacity]},
+            {'$multiply': [{'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}, refill_rate]}
+        ]}]}
+        try:
+            bucket = self.collection.find_one_and_update(
+                {'_id': key},
+                [
+                    {'$set': {'tokens': refilled, 'updated_at': now}},
+                    {'$set': {
+                        'allowed': {'$gte': ['$tokens', 1]},
+                        'tokens': {'$cond': [{'$gte': ['$tokens', 1]}, {'$subtract': ['$tokens', 1]}, '$tokens']},
+                        'expires_at': datetime.datetime.utcfromtimestamp(now + capacity / refill_rate)
+                    }}
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError:
+            self._errors += 1
+            logger.warning('Rate limit store unavailable, using local buckets', exc_info=True)
+            return self.fallback.acquire(key, capacity, refill_rate)
+
+        if bucket['allowed']:
+            return True, 0.0
+        return False, (1.0 - bucket['tokens']) / refill_rate
+
+    def stats(self):
+        return {'backend': 'mongo', 'errors': self._errors, 'fallback': self.fallback.stats()}
+
+class ConcurrencyLimiter:
+    """
+    Admits at most `limit` holders at once; acquire() waits up to
+    `timeout` seconds for a slot and returns False if none frees up
+    """
+    def __init__(self, limit, timeout=0.0):
+        self.limit = limit
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    def acquire(self):
+        if self.timeout:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self._rejected += 1
+            return False
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'in_flight': self._in_flight, 'rejected': self._rejected}
+
+# Process-wide limiters, created on first use
+_rate_limiter = None
+_face_admission = None
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(config, db=None):
+    """
+    Return the shared rate limiter for RATE_LIMIT_BACKEND ('local' or 'mongo')
+    """
+    global _rate_limiter
+
+    if _rate_limiter is None:
+        with _limiters_lock:
+            if _rate_limiter is None:
+                local = TokenBucketLimiter(config['RATE_LIMIT_MAX_KEYS'])
+                if config['RATE_LIMIT_BACKEND'] == 'mongo':
+                    _rate_limiter = MongoRateLimiter(db, local)
+                else:
+                    _rate_limiter = local
+
+    return _rate_limiter
+
+def get_face_admission(config):
+    """
+    Return the shared face concurrency limiter, or None when
+    FACE_MAX_CONCURRENT is 0
+    """
+    global _face_admission
+
+    if _face_admission is None and config['FACE_MAX_CONCURRENT'] > 0:
+        with _limiters_lock:
+            if _face_admission is None:
+                _face_admission = ConcurrencyLimiter(config['FACE_MAX_CONCURRENT'], config['FACE_ADMISSION_TIMEOUT'])
+
+    return _face_admission
+
+def rate_limit_stats():
+    return {
+        'rate_limiter': _rate_limiter.stats() if _rate_limiter is not None else None,
+        'face_admission': _face_admission.stats() if _face_admission is not None else None
+    }
+
+def client_ip():
+    # Behind a proxy the client is the first X-Forwarded-For hop
+    if current_app.config['RATE_LIMIT_TRUST_FORWARDED']:
+        return request.access_route[0] if request.access_route else request.remote_addr
+    return request.remote_addr
+
+def check_rate_limit(route, db, email=None):
+    """
+    Take a token from the client IP's and the email's bucket for `route`.
+    Returns None if the attempt may go ahead, otherwise a failure result
+    for error_response() (429 with Retry-After).
+    """
+    config = current_app.config
+    if not config['RATE_LIMIT_ENABLED']:
+        return None
+
+    limits = config['RATE_LIMITS'].get(route, {})
+    limiter = get_rate_limiter(config, db)
+
+    for scope, value in (('ip', client_ip()), ('email', email.lower() if email else None)):
+        rate = parse_rate(limits.get(scope))
+        if rate is None or not value:
+            continue
+        allowed, retry_after = limiter.acquire(f'{route}:{scope}:{value}', *rate)
+        if not allowed:
+            count('rate_limited', route=route, scope=scope)
+            return {
+                'success': False,
+                'code': 'rate_limited',
+                'message': 'Too many attempts. Please wait before trying again.',
+                'retry_after': max(1, math.ceil(retry_after))
+            }
+
+    return None
@@ -0,0 +1,30 @@
+# Shared response helpers
+from flask import jsonify
+
+# Failure codes that mean the server is overloaded rather than the request is bad
+BUSY_CODES = ('face_busy', 'face_timeout', 'auth_busy')
+
+def error_response(result, status=400):
+    """
+    Build the response for a failed request: 503 with Retry-After when the
+    server is saturated, 429 with Retry-After when the client is rate
+    limited, `status` otherwise
+    """
+    response = jsonify(result)
+    
+    if result.get('code') in BUSY_CODES:
+        response.headers['Retry-After'] = str(result.get('retry_after', 1))
+        return response, 503
+    
+    if result.get('code') == 'rate_limited':
+        response.headers['Retry-After'] = str(result.get('retry_after', 1))
+        return response, 429
+    
+    return response, status
+
+def face_error_response(result):
+    """
+    Build the response for a failed face extraction: 503 when face
+    processing is saturated, 400 for a bad image
+    """
+    return error_response(result)
@@ -0,0 +1,58 @@
+# Face image upload parsing
+from flask import request
+
+# Content types accepted as a raw image body
+RAW_IMAGE_TYPES = ('application/octet-stream', 'image/jpeg', 'image/png')
+
+def get_face_payload():
+    """
+    Return the request fields and the face image for a face upload.
+
+    Multipart requests carry the image as a 'faceImage' file part and the
+    other fields as form fields. Raw image bodies carry the fields in the
+    query string, so they cannot carry a password (see
+    password_in_query_string()). Both return the image as bytes. JSON requests keep the
+    base64 data URL in 'faceImage' and return it as a string.
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('faceImage')
+        face_image = upload.read() if upload else request.form.get('faceImage')
+        return request.form, face_image or None
+
+    if request.mimetype in RAW_IMAGE_TYPES:
+        return request.args, request.get_data(cache=False) or None
+
+    data = request.get_json(silent=True) or {}
+    return data, data.get('faceImage')
+
+def password_in_query_string():
+    """
+    Return True if the request sends a password in the query string, where
+    proxies and access logs would record it. Requests that send a password
+    must use a multipart form or a JSON body.
+    """
+    return 'password' in request.args
+
+def get_face_uploads():
+    """
+    Return the request fields and every face image in an enrollment upload.
+
+    Like get_face_payload(), but multipart requests may repeat the
+    'faceImage' part and JSON requests may send a 'faceImages' list.
+    """
+    if request.mimetype == 'multipart/form-data':
+        face_images = [upload.read() for upload in request.files.getlist('faceImage')]
+        face_images += request.form.getlist('faceImage')
+        return request.form, [face_image for face_image in face_images if face_image]
+
+    if request.mimetype in RAW_IMAGE_TYPES:
+        face_image = request.get_data(cache=False)
+        return request.args, [face_image] if face_image else []
+
+    data = request.get_json(silent=True) or {}
+    face_images = data.get('faceImages') or []
+    if not isinstance(face_images, list):
+        face_images = [face_images]
+    if data.get('faceImage'):
+        face_images.append(data['faceImage'])
+    return data, face_images